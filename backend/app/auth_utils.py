@@ -2,13 +2,14 @@ from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, Request, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 
 from .config import settings
 from .database import get_db
 from .models import User
+from . import request_context, sharding
 
 # Password hashing context
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -54,11 +55,18 @@ def get_user_by_email(db: Session, email: str):
     """Retrieves a user from the database by email."""
     return db.query(User).filter(User.email == email).first()
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
     """
     Dependency to get the current authenticated user.
     Raises HTTPException if authentication fails.
     """
+    batch = request.scope.get("batch")
+    if batch is not None:
+        # Sub-request of POST /batch: the batch authenticated once for all of them, writes still check the shard
+        if request.method not in sharding.READ_METHODS:
+            sharding.route(db, batch.user, request.method)
+            return batch.attach_user(db)
+        return batch.user
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -71,6 +79,8 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     user = get_user_by_username(db, username=username)
     if user is None:
         raise credentials_exception
+    request_context.set_owner(user.id)
+    sharding.route(db, user, request.method)
     return user
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
@@ -81,3 +91,13 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
     if not current_user.is_active:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user")
     return current_user
+
+async def get_current_admin_user(current_user: User = Depends(get_current_active_user)) -> User:
+    """
+    Dependency for operator endpoints.
+    Raises HTTPException unless the user is listed in ADMIN_USERNAMES.
+    """
+    admins = {name.strip() for name in settings.ADMIN_USERNAMES.split(",") if name.strip()}
+    if current_user.username not in admins:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return current_user
@@ -0,0 +1,168 @@
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Callable, Optional
+
+from fastapi import Request, Response, status
+from sqlalchemy.orm import Session
+
+from .config import settings
+
+
+class VersionRegistry:
+    """
+    Per-owner, per-collection version counters.
+    Every write bumps the counter, and anything cached against an older version is stale.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = defaultdict(int)  # (owner_id, collection) -> version
+        self._listeners = []
+
+    def get(self, owner_id: int, collection: str) -> int:
+        return self._versions[(owner_id, collection)]
+
+    def bump(self, owner_id: int, collection: str) -> int:
+        with self._lock:
+            self._versions[(owner_id, collection)] += 1
+            version = self._versions[(owner_id, collection)]
+        for listener in self._listeners:
+            listener(owner_id, collection, version)
+        return version
+
+    def bump_all(self):
+        """Bumps every known counter, for when writes may have been missed."""
+        with self._lock:
+            keys = list(self._versions)
+        for owner_id, collection in keys:
+            self.bump(owner_id, collection)
+
+    def add_listener(self, listener):
+        """Registers `listener(owner_id, collection, version)`, called after every bump."""
+        self._listeners.append(listener)
+
+
+versions = VersionRegistry()
+
+# Counters are per process and restart at zero, so ETags also carry a per-process token
+_etag_epoch = secrets.token_hex(8)
+
+
+def collection_etag(owner_id: int, collection: str, *variant) -> str:
+    """Builds a strong ETag for an owner's collection at its current version."""
+    raw = ":".join(str(part) for part in (_etag_epoch, owner_id, collection, versions.get(owner_id, collection), *variant))
+    return '"' + hashlib.sha1(raw.encode()).hexdigest() + '"'
+
+
+def check_etag(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """
+    Returns a 304 response if the client already holds `etag`, otherwise tags `response` with it.
+    Compute the ETag before loading data, so a concurrent write can only make it more conservative.
+    """
+    header = request.headers.get("if-none-match")
+    if header:
+        # Weak comparison: compressed responses carry the tag as W/ (compression.py)
+        for tag in (tag.strip() for tag in header.split(",")):
+            if tag == "*" or tag.removeprefix("W/") == etag:
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag if tag == "*" else tag})
+    response.headers["ETag"] = etag
+    return None
+
+
+class _Entry:
+    __slots__ = ("version", "loaded_at", "items", "derived")
+
+    def __init__(self, version: int, items: dict):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.items = items
+        self.derived = {}  # name -> what derive() built from the items
+
+
+class CatalogCache:
+    """
+    Read-through, per-owner cache of small catalog tables (products, plans, taxes, discounts).
+    Entries are keyed by the owner's collection version, so a bump makes the next read reload.
+    Keeps the max_entries most recently read (owner, collection) entries.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (owner_id, collection) -> _Entry, least recently used first
+        self._loaders = {}  # collection -> loader(db, owner_id) -> {id: item}
+
+    def register(self, collection: str, loader):
+        self._loaders[collection] = loader
+
+    def get(self, db: Session, owner_id: int, collection: str) -> dict:
+        """Returns {id: item} for the owner's collection, loading it from the DB on a miss."""
+        return self._entry(db, owner_id, collection).items
+
+    def derive(self, db: Session, owner_id: int, collection: str, name: str, build: Callable[[dict], object],
+               current: Optional[Callable[[object], bool]] = None):
+        """
+        build(items) of the owner's collection, e.g. an index over them. Kept on the cache entry, so it is
+        rebuilt when the collection reloads and evicted with it; `current` can reject a kept one.
+        """
+        entry = self._entry(db, owner_id, collection)
+        value = entry.derived.get(name)
+        if value is None or (current is not None and not current(value)):
+            value = entry.derived[name] = build(entry.items)
+        return value
+
+    def _entry(self, db: Session, owner_id: int, collection: str) -> _Entry:
+        key = (owner_id, collection)
+        version = versions.get(owner_id, collection)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version and time.monotonic() - entry.loaded_at < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                return entry
+
+        entry = _Entry(version, self._loaders[collection](db, owner_id))
+        with self._lock:
+            # Only store if no write happened while we were loading
+            if versions.get(owner_id, collection) == version:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def list(self, db: Session, owner_id: int, collection: str, skip: int = 0, limit: int = 100) -> list:
+        items = self.get(db, owner_id, collection)
+        return [items[item_id] for item_id in sorted(items)][skip:skip + limit]
+
+    def invalidate(self, owner_id: int, collection: str):
+        with self._lock:
+            self._entries.pop((owner_id, collection), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+catalog_cache = CatalogCache(ttl_seconds=settings.CATALOG_CACHE_TTL_SECONDS, max_entries=settings.CATALOG_CACHE_MAX_ENTRIES)
+
+
+def _register_catalog_loaders():
+    from . import models, schemas
+
+    def loader(model, schema):
+        def load(db: Session, owner_id: int) -> dict:
+            rows = db.query(model).filter(model.owner_id == owner_id).all()
+            return {row.id: schema.model_validate(row, from_attributes=True) for row in rows}
+        return load
+
+    catalog_cache.register("products", loader(models.Product, schemas.Product))
+    catalog_cache.register("plans", loader(models.Plan, schemas.Plan))
+    catalog_cache.register("taxes", loader(models.Tax, schemas.Tax))
+    catalog_cache.register("discounts", loader(models.Discount, schemas.Discount))
+
+
+_register_catalog_loaders()
@@ -0,0 +1,116 @@
+import csv
+from typing import Iterable, List, TextIO
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+
+from .models import Product, Plan
+from .schemas import CatalogProductImport, CatalogImportResult
+
+PRODUCT_FIELDS = ("base_price", "type", "description", "is_active")
+PLAN_FIELDS = ("billing_period", "price", "min_quantity", "auto_close", "pausable", "renewable", "start_date", "end_date")
+
+# CSV layout: one row per plan, product columns repeated. Rows without plan_name only carry the product.
+CSV_PRODUCT_COLUMNS = {"product_name": "name", "base_price": "base_price", "type": "type", "description": "description", "is_active": "is_active"}
+CSV_PLAN_COLUMNS = {"plan_name": "name", "billing_period": "billing_period", "price": "price", "min_quantity": "min_quantity",
+                    "auto_close": "auto_close", "pausable": "pausable", "renewable": "renewable", "start_date": "start_date", "end_date": "end_date"}
+
+
+def parse_catalog_csv(stream: TextIO) -> List[CatalogProductImport]:
+    """Groups CSV rows into products with nested plans."""
+    products = {}
+    for row in csv.DictReader(stream):
+        # Empty cells fall back to the schema defaults
+        row = {key: value.strip() for key, value in row.items() if key and value is not None and value.strip() != ""}
+        name = row.get("product_name")
+        if not name:
+            continue
+        product = products.setdefault(name, {"plans": []})
+        product.update({field: row[column] for column, field in CSV_PRODUCT_COLUMNS.items() if column in row})
+        if row.get("plan_name"):
+            product["plans"].append({field: row[column] for column, field in CSV_PLAN_COLUMNS.items() if column in row})
+    return [CatalogProductImport(**product) for product in products.values()]
+
+
+def _batches(items: list, size: int) -> Iterable[list]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _changed(existing, values: dict, fields) -> bool:
+    return any(getattr(existing, field) != values[field] for field in fields)
+
+
+def upsert_catalog(db: Session, owner_id: int, catalog: List[CatalogProductImport], batch_size: int = 500) -> CatalogImportResult:
+    """
+    Creates or updates the owner's products (matched by name) and their plans (matched by product and plan name).
+    Each batch resolves existing rows with one lookup per table and writes with executemany.
+    Does not commit, so the whole import is one transaction owned by the caller.
+    """
+    result = CatalogImportResult()
+
+    # Last occurrence wins when a product name repeats
+    by_name = {}
+    for product in catalog:
+        by_name[product.name] = product
+    products = list(by_name.values())
+
+    for batch in _batches(products, batch_size):
+        names = [product.name for product in batch]
+        existing = {row.name: row for row in db.execute(
+            select(Product.id, Product.name, *[getattr(Product, field) for field in PRODUCT_FIELDS])
+            .where(Product.owner_id == owner_id, Product.name.in_(names))
+        )}
+
+        to_insert, to_update = [], []
+        for product in batch:
+            values = product.model_dump(include=set(PRODUCT_FIELDS))
+            row = existing.get(product.name)
+            if row is None:
+                to_insert.append({"name": product.name, "owner_id": owner_id, **values})
+            elif _changed(row, values, PRODUCT_FIELDS):
+                to_update.append({"id": row.id, **values})
+
+        product_ids = {name: row.id for name, row in existing.items()}
+        if to_insert:
+            for row in db.execute(insert(Product).returning(Product.id, Product.name), to_insert):
+                product_ids[row.name] = row.id
+        if to_update:
+            db.execute(update(Product), to_update)
+        result.products_created += len(to_insert)
+        result.products_updated += len(to_update)
+
+        _upsert_plans(db, owner_id, batch, product_ids, result)
+
+    db.flush()
+    return result
+
+
+def _upsert_plans(db: Session, owner_id: int, products: List[CatalogProductImport], product_ids: dict, result: CatalogImportResult):
+    wanted = {}
+    for product in products:
+        for plan in product.plans:
+            wanted[(product_ids[product.name], plan.name)] = plan
+    if not wanted:
+        return
+
+    existing = {(row.product_id, row.name): row for row in db.execute(
+        select(Plan.id, Plan.product_id, Plan.name, *[getattr(Plan, field) for field in PLAN_FIELDS])
+        .where(Plan.owner_id == owner_id, Plan.product_id.in_({product_id for product_id, _ in wanted}))
+    )}
+
+    to_insert, to_update = [], []
+    for (product_id, name), plan in wanted.items():
+        values = plan.model_dump(include=set(PLAN_FIELDS))
+        row = existing.get((product_id, name))
+        if row is None:
+            to_insert.append({"product_id": product_id, "name": name, "owner_id": owner_id, **values})
+        elif _changed(row, values, PLAN_FIELDS):
+            to_update.append({"id": row.id, **values})
+
+    if to_insert:
+        db.execute(insert(Plan), to_insert)
+    if to_update:
+        db.execute(update(Plan), to_update)
+    result.plans_created += len(to_insert)
+    result.plans_updated += len(to_update)
@@ -1,4 +1,4 @@
-from pydantic_settings import BaseSettings
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
     DATABASE_URL: str
@@ -6,8 +6,92 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
 
-    class Config:
-        env_file = ".env"
-        env_file_encoding = "utf-8"
+    # Tenant sharding (app/sharding.py): more databases as "name=url,name=url", each with the full schema.
+    # DATABASE_URL stays the primary database, which also holds the users and the shard directory
+    SHARD_DATABASE_URLS: str = ""
+    NEW_TENANT_SHARD: str = "" # Where new business users go, empty for the primary database
+    # Ids each shard hands out on Postgres: the n-th database (primary first, then SHARD_DATABASE_URLS in order) from n * this.
+    # Tenants keep their ids when they move, so only ever append shards to the list
+    SHARD_ID_RANGE_SIZE: int = 100_000_000
+
+    # Pooled connections opened at startup, so the first requests don't pay for the connect
+    DB_POOL_WARMUP_CONNECTIONS: int = 2
+
+    # Live dashboard stream (/dashboard/stream)
+    DASHBOARD_STREAM_KEEPALIVE_SECONDS: int = 15
+    DASHBOARD_STREAM_COALESCE_SECONDS: float = 0.25
+
+    # Per-owner catalog cache (products, plans, taxes, discounts). Writes evict it in every worker
+    # through the invalidation bus, the TTL only covers lost messages
+    CATALOG_CACHE_TTL_SECONDS: int = 3600
+    CATALOG_CACHE_MAX_ENTRIES: int = 2048 # (owner, collection) pairs kept per worker, least recently read dropped beyond this
+
+    # Cache invalidation between workers: "auto" uses LISTEN/NOTIFY on Postgres and unix sockets in
+    # INVALIDATION_SOCKET_DIR otherwise (workers on one host), "off" leaves each worker on its own
+    INVALIDATION_BUS: str = "auto"
+    INVALIDATION_CHANNEL: str = "cache_invalidation"
+    INVALIDATION_SOCKET_DIR: str = "" # Default: a directory per database under the system temp dir
+
+    # Conditional GET: paid invoices may be reused by the client this long before revalidating with their ETag, 0 turns it off
+    PAID_INVOICE_MAX_AGE_SECONDS: int = 60
+
+    # In-memory prefix index used by /search when the database is not Postgres
+    SEARCH_INDEX_TTL_SECONDS: int = 300
+    SEARCH_INDEX_MAX_OWNERS: int = 256 # Least recently searched owners are dropped beyond this
+    SEARCH_INDEX_IDLE_SECONDS: int = 1800 # Owners who haven't searched for this long are dropped
+
+    # Prometheus metrics at /metrics (see app/metrics.py for multi-worker setups)
+    METRICS_ENABLED: bool = True
+
+    # Slow-query log (/admin/slow-queries), 0 turns it off
+    SLOW_QUERY_THRESHOLD_MS: float = 500
+    SLOW_QUERY_LOG_SIZE: int = 100 # Distinct statements kept
+    SLOW_QUERY_EXPLAIN: bool = True # Capture the plan of each new slow statement in the background
+    SLOW_QUERY_EXPLAIN_TIMEOUT_MS: int = 5000
+
+    # Responses at least this large are compressed (brotli or gzip, as the client accepts), 0 turns it off
+    COMPRESSION_MINIMUM_SIZE: int = 1024
+    GZIP_LEVEL: int = 6
+    BROTLI_QUALITY: int = 4 # 0-11, higher compresses better but costs far more CPU
+
+    # Token buckets per user and route group (read, write, reports, bulk, auth), "group=rate/burst" in requests
+    # per second; groups left out aren't limited. Portal users get PORTAL_RATE_LIMITS
+    RATE_LIMITS: str = "read=20/60,write=5/20,reports=0.5/5,bulk=0.05/2,auth=1/10"
+    PORTAL_RATE_LIMITS: str = "read=5/20,write=1/5,reports=0.2/2,bulk=0.02/1,auth=1/10"
+    RATE_LIMIT_REDIS_URL: str = "" # e.g. redis://localhost:6379/0 shares the buckets between workers (needs the redis package)
+
+    # Load shedding per worker, 0 turns it off
+    MAX_IN_FLIGHT_REQUESTS: int = 64 # Beyond this new requests get 503
+    MAX_IN_FLIGHT_PER_USER: int = 8 # Beyond this the user gets 429
+
+    # Statement timeout per route group in milliseconds, so runaway queries give their connection back
+    STATEMENT_TIMEOUTS_MS: str = "read=5000,write=10000,reports=60000,bulk=300000,auth=5000"
+
+    # Background jobs (app/jobs.py): each app worker with JOBS_ENABLED runs queued jobs, on any number of nodes
+    JOBS_ENABLED: bool = True
+    JOBS_POLL_SECONDS: float = 2
+    JOBS_CONCURRENCY: int = 4 # Jobs running at once per worker
+    JOBS_PROCESS_WORKERS: int = 2 # Processes for CPU-bound jobs per worker, 0 runs them in threads
+    JOBS_MAX_ATTEMPTS: int = 3
+    JOBS_RETRY_BACKOFF_SECONDS: float = 30 # Doubles with each attempt
+    JOBS_STALE_SECONDS: int = 120 # Running jobs without a heartbeat for this long go back to the queue
+    JOBS_SHUTDOWN_GRACE_SECONDS: float = 10 # Running jobs get this long to finish on shutdown, then they are requeued
+    JOBS_RETENTION_DAYS: int = 30 # Finished jobs are deleted after this, 0 keeps them
+    JOBS_SPOOL_DIR: str = "job_uploads" # Uploads waiting for their job (customer imports), must be shared by every node running jobs
+
+    # POST /batch: sub-requests allowed per batch, and how many of its reads run at once (each on its own session)
+    BATCH_MAX_REQUESTS: int = 20
+    BATCH_READ_CONCURRENCY: int = 4
+
+    # Comma-separated usernames allowed on the /admin endpoints
+    ADMIN_USERNAMES: str = ""
+
+    # Per-request SQL profiling (Server-Timing header, /admin/sql-profile), off by default
+    SQL_PROFILING_ENABLED: bool = False
+    SQL_PROFILING_SAMPLE_RATE: float = 1.0 # Share of requests profiled
+    SQL_PROFILING_REPEAT_THRESHOLD: int = 5 # Same statement this often in one request is reported as N+1
+    SQL_PROFILING_REPORT_SIZE: int = 200 # Recent requests kept
+
+    model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
 settings = Settings()
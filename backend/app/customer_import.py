@@ -0,0 +1,144 @@
+import csv
+import hashlib
+import io
+import json
+import os
+from typing import Callable, Iterable, Iterator, List, Optional, TextIO
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.orm import Session
+
+from .jobs import JobContext, job
+from .models import Customer
+from .schemas import CustomerImportResult
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+def _email_key(email: str) -> int:
+    # 64-bit digest instead of the string itself, so the seen-set stays small for millions of rows
+    return int.from_bytes(hashlib.blake2b(email.encode(), digest_size=8).digest(), "big")
+
+
+def iter_customer_rows(stream: TextIO, fmt: str = "csv") -> Iterator[dict]:
+    """Streams rows from a CSV with name,email columns or from JSON lines. Unreadable lines come through as {}."""
+    if fmt == "jsonl":
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row if isinstance(row, dict) else {}
+    else:
+        yield from csv.DictReader(stream)
+
+
+def _batches(rows: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _copy_customers(db: Session, rows: List[dict]):
+    """Loads rows with COPY in the session's transaction."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow((row["owner_id"], row["name"], row["email"]))
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert("COPY customers (owner_id, name, email) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+
+def import_customers(db: Session, owner_id: int, rows: Iterable[dict], batch_size: int = 1000,
+                     on_batch: Optional[Callable[[CustomerImportResult], None]] = None) -> CustomerImportResult:
+    """
+    Imports customers for an owner, matching by case-insensitive email.
+    The first occurrence of an email in the file wins, later ones are skipped. An existing customer
+    gets its name updated. Each batch is one lookup plus a COPY (Postgres) or executemany, and is
+    committed on its own, so an interrupted import can simply be run again. on_batch gets the
+    running totals after each commit.
+    """
+    result = CustomerImportResult()
+    use_copy = db.get_bind().dialect.name == "postgresql"
+    seen = set()
+
+    for batch in _batches(rows, batch_size):
+        wanted = {}
+        for row in batch:
+            name = str(row.get("name") or "").strip()
+            email = normalize_email(str(row.get("email") or ""))
+            if not name or "@" not in email:
+                result.skipped += 1
+                continue
+            key = _email_key(email)
+            if key in seen:
+                result.skipped += 1
+                continue
+            seen.add(key)
+            wanted[email] = (name, str(row["email"]).strip())
+
+        existing = {}
+        if wanted:
+            for row in db.execute(
+                select(Customer.id, Customer.name, func.lower(Customer.email).label("email"))
+                .where(Customer.owner_id == owner_id, func.lower(Customer.email).in_(list(wanted)))
+                .order_by(Customer.id)
+            ):
+                existing.setdefault(row.email, row)
+
+        to_insert, to_update = [], []
+        for email, (name, original_email) in wanted.items():
+            row = existing.get(email)
+            if row is None:
+                to_insert.append({"owner_id": owner_id, "name": name, "email": original_email})
+            elif row.name != name:
+                to_update.append({"id": row.id, "name": name})
+            else:
+                result.skipped += 1
+
+        if to_insert:
+            if use_copy:
+                _copy_customers(db, to_insert)
+            else:
+                db.execute(insert(Customer), to_insert)
+        if to_update:
+            db.execute(update(Customer), to_update)
+        db.commit()
+        result.inserted += len(to_insert)
+        result.updated += len(to_update)
+        if on_batch is not None:
+            on_batch(result)
+
+    return result
+
+
+@job("customer_import", invalidates=("customers",))
+def run_import_job(ctx: JobContext) -> dict:
+    """import_customers over the uploaded file, streamed from the spool."""
+    db = ctx.session()
+    try:
+        with open(ctx.upload_path(), "rb") as raw:
+            size = max(os.fstat(raw.fileno()).st_size, 1)
+
+            def report(result: CustomerImportResult):
+                done = result.inserted + result.updated + result.skipped
+                ctx.progress(min(raw.tell() / size, 0.99), f"{done} rows imported")
+
+            stream = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+            rows = iter_customer_rows(stream, ctx.params.get("format", "csv"))
+            return import_customers(db, ctx.owner_id, rows, on_batch=report).model_dump()
+    finally:
+        db.close()
@@ -1,18 +1,50 @@
-from sqlalchemy import create_engine
+from fastapi import Request
+from sqlalchemy import create_engine, inspect
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
 from .config import settings # Import settings
 
 # Database connection details from environment variables or default
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
+PRIMARY_SHARD = "primary"
+# Only in the primary database (jobs too, so every runner sees one queue). Shards hold stub users rows for their tenants' foreign keys (see app/sharding.py)
+DIRECTORY_TABLES = {"users", "tenant_shards", "jobs"}
+
+def shard_urls() -> dict:
+    """Shard name -> database URL, the primary database first."""
+    urls = {PRIMARY_SHARD: settings.DATABASE_URL}
+    for item in settings.SHARD_DATABASE_URLS.split(","):
+        name, _, url = item.strip().partition("=")
+        if url:
+            urls[name.strip()] = url.strip()
+    return urls
+
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+shard_engines = {PRIMARY_SHARD: engine, **{name: create_engine(url) for name, url in shard_urls().items() if name != PRIMARY_SHARD}}
+
+class ShardedSession(Session):
+    """Sends the directory tables to the primary database and everything else to the shard in info["shard"]."""
+
+    def get_bind(self, mapper=None, *, clause=None, bind=None, **kw):
+        if bind is not None:
+            return bind
+        shard = self.info.get("shard", PRIMARY_SHARD)
+        if shard == PRIMARY_SHARD or (mapper is not None and inspect(mapper).mapper.local_table.name in DIRECTORY_TABLES):
+            return engine
+        return shard_engines[shard]
+
+SessionLocal = sessionmaker(class_=ShardedSession, autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 # Dependency to get the database session
-def get_db():
+def get_db(request: Request):
+    batch_db = request.scope.get("batch_db")
+    if batch_db is not None:
+        # Sub-request of POST /batch, the batch owns the session (routers/batch.py)
+        yield batch_db
+        return
     db = SessionLocal()
     try:
         yield db
@@ -21,4 +53,9 @@ def get_db():
 
 def create_all_tables():
     from . import models # Import models to ensure they are registered with Base metadata
-    Base.metadata.create_all(bind=engine)
+    from .sharding import enabled, reserve_id_range
+    for shard, shard_engine in shard_engines.items():
+        Base.metadata.create_all(bind=shard_engine)
+        if enabled():
+            with shard_engine.begin() as conn:
+                reserve_id_range(conn, shard)
@@ -0,0 +1,85 @@
+from bisect import bisect_right
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from .cache import catalog_cache
+from .models import Discount, DiscountRedemption
+from .schemas import Discount as SchemaDiscount
+
+PERCENTAGE_TYPES = {"percentage", "percent"}
+FIXED_TYPES = {"fixed", "amount"}
+
+
+class DiscountIntervalIndex:
+    """Discounts of one owner grouped by code and sorted by start date, for active-window lookups."""
+
+    def __init__(self, discounts):
+        by_code = {}
+        for discount in discounts:
+            start = discount.start_date or date.min
+            by_code.setdefault(discount.name.strip().lower(), []).append((start, discount.id, discount))
+        self._starts = {}
+        self._discounts = {}
+        for code, entries in by_code.items():
+            entries.sort()
+            self._starts[code] = [start for start, _, _ in entries]
+            self._discounts[code] = [discount for _, _, discount in entries]
+
+    def find(self, code: str, on_date: date) -> Optional[SchemaDiscount]:
+        code = code.strip().lower()
+        starts = self._starts.get(code)
+        if not starts:
+            return None
+        # Latest-starting discount that has started by on_date and not yet ended
+        position = bisect_right(starts, on_date)
+        for discount in reversed(self._discounts[code][:position]):
+            if discount.end_date is None or discount.end_date >= on_date:
+                return discount
+        return None
+
+
+def find_active_discount(db: Session, owner_id: int, code: str, on_date: date) -> Optional[SchemaDiscount]:
+    """Looks up an active discount code from the cached catalog; the index lives on the cache entry."""
+    index = catalog_cache.derive(db, owner_id, "discounts", "interval_index", lambda items: DiscountIntervalIndex(items.values()))
+    return index.find(code, on_date)
+
+
+def discount_percent_for(discount: SchemaDiscount, discountable_amount: float) -> float:
+    """Expresses a discount as a percentage of the amount it applies to."""
+    discount_type = (discount.type or "").lower()
+    if discount_type in PERCENTAGE_TYPES:
+        percent = discount.value
+    elif discount_type in FIXED_TYPES:
+        percent = (discount.value / discountable_amount * 100.0) if discountable_amount > 0 else 0.0
+    else:
+        raise ValueError(f"Unsupported discount type '{discount.type}'")
+    return max(0.0, min(100.0, percent))
+
+
+def combine_percents(line_percent: float, extra_percent: float) -> float:
+    """Stacks a subscription-wide discount on top of a line's own discount."""
+    return 100.0 - (100.0 - line_percent) * (100.0 - extra_percent) / 100.0
+
+
+def redeem(db: Session, discount: SchemaDiscount, subscription_id: int, amount: float) -> bool:
+    """
+    Records a redemption in the caller's transaction. Returns False if the usage limit is reached.
+    Limited codes take a conditional increment, so concurrent redemptions never overshoot the limit
+    and the row is only locked for the rest of the transaction; call this right before commit.
+    Unlimited codes never touch the discount row, their usage is the count of redemption rows.
+    """
+    if discount.usage_limit is not None:
+        result = db.execute(
+            update(Discount)
+            .where(Discount.id == discount.id, Discount.used_count < Discount.usage_limit)
+            .values(used_count=Discount.used_count + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            return False
+
+    db.add(DiscountRedemption(discount_id=discount.id, subscription_id=subscription_id, amount=amount, redeemed_at=datetime.utcnow()))
+    return True
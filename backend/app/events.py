@@ -0,0 +1,91 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from .cache import versions
+
+
+class _Listener:
+    """A single connected stream waiting for changes to one owner's data."""
+    __slots__ = ("loop", "event", "topics")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.event = asyncio.Event()
+        self.topics = set()
+
+    def _wake(self, topic: str):
+        self.topics.add(topic)
+        self.event.set()
+
+    async def wait(self) -> set:
+        """Waits for the next batch of changed topics and resets the listener."""
+        await self.event.wait()
+        self.event.clear()
+        topics, self.topics = self.topics, set()
+        return topics
+
+
+class EventBroker:
+    """
+    In-process pub/sub for per-owner change notifications.
+    Routers publish from worker threads, listeners live on the event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listeners = defaultdict(set)  # owner_id -> set of _Listener
+        self._generations = defaultdict(int)  # owner_id -> number of changes seen
+
+    def subscribe(self, owner_id: int) -> _Listener:
+        listener = _Listener(asyncio.get_running_loop())
+        with self._lock:
+            self._listeners[owner_id].add(listener)
+        return listener
+
+    def unsubscribe(self, owner_id: int, listener: _Listener):
+        with self._lock:
+            listeners = self._listeners.get(owner_id)
+            if listeners is None:
+                return
+            listeners.discard(listener)
+            if not listeners:
+                del self._listeners[owner_id]
+
+    def listening(self, owner_id: int) -> bool:
+        with self._lock:
+            return bool(self._listeners.get(owner_id))
+
+    def generation(self, owner_id: int) -> int:
+        return self._generations[owner_id]
+
+    def publish(self, owner_id: int, topic: str):
+        """Notifies every listener of owner_id that `topic` changed. Safe to call from any thread."""
+        with self._lock:
+            self._generations[owner_id] += 1
+            listeners = list(self._listeners.get(owner_id, ()))
+        for listener in listeners:
+            try:
+                listener.loop.call_soon_threadsafe(listener._wake, topic)
+            except RuntimeError:
+                # Loop already closed, the stream is going away
+                pass
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(listeners) for listeners in self._listeners.values())
+
+
+broker = EventBroker()
+
+
+# Dashboard streams follow the collections that feed the stats
+DASHBOARD_COLLECTIONS = {"subscriptions", "invoices", "payments"}
+
+
+def _on_version_bump(owner_id: int, collection: str, version: int):
+    if collection in DASHBOARD_COLLECTIONS:
+        broker.publish(owner_id, collection)
+
+
+versions.add_listener(_on_version_bump)
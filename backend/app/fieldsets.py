@@ -0,0 +1,94 @@
+"""
+Sparse fieldsets: `?fields=` picks the top-level fields of a response and `?include=` the nested
+relations (e.g. invoice_lines, payments). Without either the full representation is returned.
+`fields` alone returns no relations, `include` alone returns every field plus the named relations.
+
+Unselected columns are left out of the SELECT (load_only), selected relations are loaded with one
+extra query each (selectinload) and the response is serialized with a schema holding only the
+selected fields, so nothing unselected is loaded lazily either.
+"""
+from functools import lru_cache
+from typing import Optional
+
+from fastapi import HTTPException, Query, status
+from pydantic import ConfigDict, create_model
+from sqlalchemy.orm import RelationshipProperty, load_only, selectinload
+
+
+@lru_cache(maxsize=256)
+def sparse_schema(schema, names: frozenset):
+    """`schema` reduced to `names`, one model per distinct selection."""
+    selected = {name: (field.annotation, field) for name, field in schema.model_fields.items() if name in names}
+    # Same module as the schema, so forward references like "InvoiceLine" resolve
+    return create_model(f"{schema.__name__}Fields", __config__=ConfigDict(from_attributes=True), __module__=schema.__module__, **selected)
+
+
+def _split(value: str) -> set:
+    return {name.strip() for name in value.split(",") if name.strip()}
+
+
+class Fieldset:
+    def __init__(self, selector: "SparseFields", fields: Optional[frozenset], include: Optional[frozenset]):
+        self.selector = selector
+        self.fields = fields # None: all fields
+        self.include = include # None: all relations
+
+    @property
+    def is_full(self) -> bool:
+        return self.fields is None and self.include is None
+
+    @property
+    def relations(self) -> frozenset:
+        if self.include is not None:
+            return self.include
+        return frozenset() if self.fields is not None else frozenset(self.selector.relations)
+
+    @property
+    def schema(self):
+        if self.is_full:
+            return self.selector.schema
+        names = (self.fields if self.fields is not None else frozenset(self.selector.scalars)) | {"id"} | self.relations
+        return sparse_schema(self.selector.schema, names)
+
+    def options(self) -> list:
+        """Query options loading the selected columns and relations."""
+        options = [selectinload(getattr(self.selector.model, name)) for name in sorted(self.relations)]
+        if self.fields is not None:
+            columns = self.selector.model.__table__.c
+            wanted = (self.fields | set(self.selector.required)) & set(columns.keys())
+            options.append(load_only(*(getattr(self.selector.model, name) for name in sorted(wanted))))
+        return options
+
+    def cache_key(self) -> tuple:
+        """Part of the ETag, each selection is its own representation."""
+        return (",".join(sorted(self.fields)) if self.fields is not None else "*",
+                ",".join(sorted(self.include)) if self.include is not None else "*")
+
+
+class SparseFields:
+    """`?fields=` / `?include=` dependency for one response schema, e.g. Depends(SparseFields(Invoice, DBInvoice))."""
+
+    def __init__(self, schema, model, required: tuple = ()):
+        self.schema = schema
+        self.model = model
+        self.required = required # Columns the endpoint itself needs, e.g. for ownership checks
+        self.relations = tuple(
+            name for name in schema.model_fields
+            if isinstance(getattr(getattr(model, name, None), "property", None), RelationshipProperty)
+        )
+        self.scalars = tuple(name for name in schema.model_fields if name not in self.relations)
+
+    def __call__(self, fields: Optional[str] = Query(None, description="Comma-separated fields to return (default: all)"),
+                 include: Optional[str] = Query(None, description="Comma-separated nested relations to return (default: all unless fields is given)")) -> Fieldset:
+        selected_fields = selected_relations = None
+        if fields is not None:
+            selected_fields = frozenset(_split(fields))
+            unknown = selected_fields - set(self.scalars)
+            if unknown:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown fields: {', '.join(sorted(unknown))}. Available: {', '.join(self.scalars)}")
+        if include is not None:
+            selected_relations = frozenset(_split(include))
+            unknown = selected_relations - set(self.relations)
+            if unknown:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown relations: {', '.join(sorted(unknown))}. Available: {', '.join(self.relations)}")
+        return Fieldset(self, selected_fields, selected_relations)
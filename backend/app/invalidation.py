@@ -0,0 +1,240 @@
+"""
+Cache invalidation between workers. Every versions.bump (routers bump after their commit) is
+published as (owner_id, collection, version), and every other worker applies it to its own
+VersionRegistry. That evicts exactly what the write touched there too: catalog cache entries,
+search indexes and ETags of that collection, and the dashboard stats and streams that follow it.
+
+On Postgres the messages go through LISTEN/NOTIFY, which reaches the workers on every node. On
+SQLite (one host) each worker binds a unix datagram socket in INVALIDATION_SOCKET_DIR and a
+publish is sent to every socket there.
+
+Delivery is asynchronous: another worker can serve the old version for the few milliseconds a
+message takes. Messages missed while the listener reconnects can't be replayed, so a reconnect
+bumps every collection the worker knows about. The cache TTLs stay as the last resort.
+"""
+import hashlib
+import logging
+import os
+import queue
+import secrets
+import select
+import socket
+import tempfile
+import threading
+
+from sqlalchemy import text
+
+from .cache import versions
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PostgresTransport:
+    """LISTEN/NOTIFY on a connection of its own, outside the pool, run by one thread."""
+
+    def __init__(self, engine, channel: str, on_message, on_reconnect):
+        self.engine = engine
+        self.channel = channel
+        self.on_message = on_message
+        self.on_reconnect = on_reconnect
+        self._outbox = queue.SimpleQueue()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="invalidation-listener", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def publish(self, payload: str):
+        self._outbox.put(payload)
+        self._wake_w.send(b"\0")
+
+    def stop(self):
+        self._stopping.set()
+        self._wake_w.send(b"\0")
+        self._thread.join(timeout=5)
+
+    def _connect(self):
+        connection = self.engine.raw_connection()
+        connection.detach() # Held for the life of the worker, not a pool connection
+        dbapi_connection = connection.dbapi_connection
+        dbapi_connection.autocommit = True
+        with dbapi_connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        return dbapi_connection
+
+    def _run(self):
+        connected_before = False
+        delay = 1
+        while not self._stopping.is_set():
+            try:
+                dbapi_connection = self._connect()
+            except Exception as exc:
+                logger.warning("Invalidation listener can't connect, retrying in %ss: %s", delay, exc)
+                self._stopping.wait(delay)
+                delay = min(delay * 2, 30)
+                continue
+            if connected_before:
+                self.on_reconnect()
+            connected_before, delay = True, 1
+            try:
+                self._listen(dbapi_connection)
+            except Exception as exc:
+                logger.warning("Invalidation listener lost its connection: %s", exc)
+            finally:
+                try:
+                    dbapi_connection.close()
+                except Exception:
+                    pass
+
+    def _listen(self, dbapi_connection):
+        while not self._stopping.is_set():
+            readable, _, _ = select.select([dbapi_connection, self._wake_r], [], [], 60)
+            if self._wake_r in readable:
+                try:
+                    while self._wake_r.recv(4096):
+                        pass
+                except BlockingIOError:
+                    pass
+                with dbapi_connection.cursor() as cursor:
+                    while True:
+                        try:
+                            payload = self._outbox.get_nowait()
+                        except queue.Empty:
+                            break
+                        cursor.execute("SELECT pg_notify(%s, %s)", (self.channel, payload))
+            # Also polls after our own NOTIFYs and on timeout, which notices a dead connection
+            dbapi_connection.poll()
+            while dbapi_connection.notifies:
+                self.on_message(dbapi_connection.notifies.pop(0).payload)
+
+
+class SocketTransport:
+    """A unix datagram socket per worker in a shared directory, for workers on one host."""
+
+    def __init__(self, directory: str, on_message):
+        self.directory = directory
+        self.on_message = on_message
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.path = os.path.join(directory, f"{os.getpid()}-{secrets.token_hex(4)}.sock")
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(self.path)
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.setblocking(False)
+        self._thread = threading.Thread(target=self._run, name="invalidation-listener", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def publish(self, payload: str):
+        data = payload.encode()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if path == self.path or not name.endswith(".sock"):
+                continue
+            try:
+                self._sender.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a worker that's gone
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except BlockingIOError:
+                logger.warning("Invalidation message to %s dropped, its queue is full", name)
+
+    def stop(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self._socket.close() # Ends the recv in _run
+        self._sender.close()
+
+    def _run(self):
+        while True:
+            try:
+                data = self._socket.recv(65536)
+            except OSError:
+                return
+            self.on_message(data.decode())
+
+
+def default_socket_dir() -> str:
+    # One directory per database, so unrelated deployments on the host don't invalidate each other
+    database = hashlib.sha1(settings.DATABASE_URL.encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"oneguard-invalidation-{database}")
+
+
+class InvalidationBus:
+    def __init__(self, registry):
+        self.registry = registry
+        self.origin = secrets.token_hex(8)
+        self.transport = None
+        self._applying = threading.local()
+        registry.add_listener(self._on_bump)
+
+    def start(self, engine):
+        if self.transport is not None:
+            return
+        if engine.dialect.name == "postgresql":
+            self.transport = PostgresTransport(engine, settings.INVALIDATION_CHANNEL, self._receive, self._resync)
+        elif hasattr(socket, "AF_UNIX"):
+            self.transport = SocketTransport(settings.INVALIDATION_SOCKET_DIR or default_socket_dir(), self._receive)
+        else:
+            logger.warning("No cache invalidation bus for %s on this platform, caches rely on their TTLs", engine.dialect.name)
+            return
+        self.transport.start()
+
+    def stop(self):
+        if self.transport is not None:
+            self.transport.stop()
+            self.transport = None
+
+    def _on_bump(self, owner_id: int, collection: str, version: int):
+        if self.transport is not None and not getattr(self._applying, "active", False):
+            self.transport.publish(f"{self.origin} {owner_id} {collection} {version}")
+
+    def _receive(self, payload: str):
+        try:
+            origin, owner_id, collection, _version = payload.split(" ")
+            owner_id = int(owner_id)
+        except ValueError:
+            logger.warning("Ignoring malformed invalidation message %r", payload)
+            return
+        if origin == self.origin:
+            return
+        # Counters are per process, so the remote version only says a write happened: bump ours
+        self._apply(lambda: self.registry.bump(owner_id, collection))
+
+    def _resync(self):
+        logger.info("Invalidation listener reconnected, invalidating every cached collection")
+        self._apply(self.registry.bump_all)
+
+    def _apply(self, bump):
+        self._applying.active = True
+        try:
+            bump()
+        finally:
+            self._applying.active = False
+
+
+invalidation_bus = InvalidationBus(versions)
+
+
+def broadcast(engine, owner_id: int, collections):
+    """Publishes bumps from outside the app workers, e.g. a maintenance script that changed a tenant's data."""
+    payloads = [f"external-{secrets.token_hex(4)} {owner_id} {collection} 0" for collection in collections]
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            for payload in payloads:
+                conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": settings.INVALIDATION_CHANNEL, "payload": payload})
+    elif hasattr(socket, "AF_UNIX"):
+        transport = SocketTransport(settings.INVALIDATION_SOCKET_DIR or default_socket_dir(), None)
+        try:
+            for payload in payloads:
+                transport.publish(payload)
+        finally:
+            transport.stop()
@@ -0,0 +1,392 @@
+"""
+Background jobs. Work that shouldn't hold an HTTP request (imports, exports, billing runs, sweeps)
+is queued in the jobs table with enqueue() and run by the JobRunner of any app worker with
+JOBS_ENABLED, on any node. Handlers are plain functions registered with @job(kind).
+
+Runners claim queued jobs with UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED), so two
+nodes never claim the same job (SQLite has no row locks, but it runs one writer at a time, which
+gives the same guarantee). Handlers run in a thread pool, cpu_bound ones in a process pool. Runners
+heartbeat their jobs, and jobs whose runner stopped heartbeating go back to the queue.
+
+Handlers report progress with ctx.progress(), which is also where they stop: it raises when the job
+was cancelled or no longer belongs to this runner. Failed jobs are retried with exponential backoff
+up to max_attempts. A job may run more than once, so handlers must be safe to run again.
+
+Files don't go in the jobs table either: uploads a job works on are spooled to JOBS_SPOOL_DIR with
+spool() and deleted once the job is over (succeeded, cancelled or out of attempts); files a job
+produces are written there with ctx.write_output() and deleted with the job.
+"""
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import secrets
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy import case, delete, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import sharding
+from .cache import versions
+from .config import settings
+from .database import SessionLocal, engine
+from .metrics import JOB_DURATION, JOB_FAILURES
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+FINISHED = ("succeeded", "failed", "cancelled")
+PURGE_INTERVAL_SECONDS = 3600
+
+
+class JobCancelled(Exception):
+    """Raised by ctx.progress() once the job is cancelled."""
+
+
+class JobInterrupted(Exception):
+    """Raised by ctx.progress() once the job no longer belongs to this runner (shut down, or presumed dead)."""
+
+
+class JobDeferred(Exception):
+    """Raised to run the job again later without using up an attempt, e.g. while its tenant is being moved."""
+
+
+@dataclass
+class JobHandler:
+    kind: str
+    fn: Callable
+    cpu_bound: bool
+    max_attempts: int
+    invalidates: tuple # Cache collections of the owner bumped when the job ends
+
+
+_handlers: dict = {}
+
+
+def job(kind: str, cpu_bound: bool = False, max_attempts: Optional[int] = None, invalidates=()):
+    """Registers the handler of a job kind. It gets a JobContext and returns the job's result (JSON-able)."""
+    def register(fn):
+        _handlers[kind] = JobHandler(kind, fn, cpu_bound, max_attempts or settings.JOBS_MAX_ATTEMPTS, tuple(invalidates))
+        return fn
+    return register
+
+
+def enqueue(db: Session, owner_id: Optional[int], kind: str, params: Optional[dict] = None,
+            payload: Optional[str] = None, delay_seconds: float = 0) -> Job:
+    """Queues a job and commits it."""
+    db_job = Job(
+        owner_id=owner_id,
+        kind=kind,
+        params=params or {},
+        payload=payload,
+        max_attempts=_handlers[kind].max_attempts,
+        run_after=datetime.utcnow() + timedelta(seconds=delay_seconds),
+    )
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    job_runner.wake()
+    return db_job
+
+
+def spool(chunks: Iterable[bytes]) -> str:
+    """Writes an upload to JOBS_SPOOL_DIR chunk by chunk. Returns its name there, for the job's params["upload"]."""
+    os.makedirs(settings.JOBS_SPOOL_DIR, exist_ok=True)
+    name = secrets.token_hex(16)
+    path = os.path.join(settings.JOBS_SPOOL_DIR, name)
+    try:
+        with open(path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return name
+
+
+def _discard_file(name: Optional[str]):
+    if name:
+        try:
+            os.unlink(os.path.join(settings.JOBS_SPOOL_DIR, name))
+        except FileNotFoundError:
+            pass
+
+
+def _discard_upload(params: Optional[dict]):
+    _discard_file((params or {}).get("upload"))
+
+
+def output_path(db_job: Job) -> Optional[str]:
+    """Path of the file the job produced, None without one."""
+    return os.path.join(settings.JOBS_SPOOL_DIR, db_job.output) if db_job.output else None
+
+
+def cancel(db: Session, db_job: Job) -> Job:
+    """Cancels a queued job at once, a running one stops at its next progress report. Finished jobs are left alone."""
+    cancelled = db.execute(update(Job).where(Job.id == db_job.id, Job.status == "queued")
+                           .values(status="cancelled", cancel_requested=True, finished_at=datetime.utcnow())).rowcount
+    db.execute(update(Job).where(Job.id == db_job.id, Job.status == "running").values(cancel_requested=True))
+    db.commit()
+    db.refresh(db_job)
+    if cancelled:
+        _discard_upload(db_job.params)
+    return db_job
+
+
+class JobContext:
+    """What a handler gets: the job's input, a session on the owner's shard and progress reporting."""
+
+    def __init__(self, job_id: int, owner_id: Optional[int], params: dict, payload: Optional[str], attempt: int, runner_id: str):
+        self.job_id = job_id
+        self.owner_id = owner_id
+        self.params = params
+        self.payload = payload
+        self.attempt = attempt
+        self.runner_id = runner_id
+
+    def session(self) -> Session:
+        """A new session on the owner's shard, the caller closes it."""
+        self._check_tenant()
+        return sharding.session_for(self.owner_id)
+
+    def progress(self, fraction: Optional[float] = None, message: Optional[str] = None):
+        """Records progress (0-1) and heartbeats. Raises JobCancelled or JobInterrupted when the job should stop."""
+        values = {"heartbeat_at": datetime.utcnow()}
+        if fraction is not None:
+            values["progress"] = min(max(fraction, 0.0), 1.0)
+        if message is not None:
+            values["progress_message"] = message[:200]
+        with engine.begin() as conn:
+            row = conn.execute(self._own_job().values(**values).returning(Job.cancel_requested)).first()
+        if row is None:
+            raise JobInterrupted(f"Job {self.job_id} was taken away from this runner")
+        if row.cancel_requested:
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+        self._check_tenant()
+
+    def upload_path(self) -> str:
+        """Path of the file spooled for the job with spool()."""
+        return os.path.join(settings.JOBS_SPOOL_DIR, self.params["upload"])
+
+    def write_output(self, chunks: Iterable[str], media_type: str):
+        """Writes the file the job produces to JOBS_SPOOL_DIR chunk by chunk, for /jobs/{id}/output."""
+        os.makedirs(settings.JOBS_SPOOL_DIR, exist_ok=True)
+        name = f"job-{self.job_id}-output" # A retry overwrites what an earlier attempt left
+        path = os.path.join(settings.JOBS_SPOOL_DIR, name)
+        try:
+            with open(path + ".part", "w", encoding="utf-8", newline="") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(path + ".part", path)
+        except BaseException:
+            _discard_file(name + ".part")
+            raise
+        with engine.begin() as conn:
+            conn.execute(self._own_job().values(output=name, output_type=media_type))
+
+    def _own_job(self):
+        return update(Job).where(Job.id == self.job_id, Job.locked_by == self.runner_id, Job.status == "running")
+
+    def _check_tenant(self):
+        # Writes are paused while the tenant moves between shards (app/tenant_move.py), come back afterwards
+        if self.owner_id is None or not sharding.enabled():
+            return
+        with SessionLocal() as db:
+            entry = sharding.shard_of(db, self.owner_id)
+        if entry is not None and entry.state == "moving":
+            raise JobDeferred("The account is being moved")
+
+
+def _execute(job_id: int, runner_id: str):
+    """Runs the handler of a claimed job, in a runner thread or a pool process."""
+    with engine.connect() as conn:
+        row = conn.execute(select(Job.kind, Job.owner_id, Job.params, Job.payload, Job.attempts).where(Job.id == job_id)).one()
+    ctx = JobContext(job_id, row.owner_id, row.params or {}, row.payload, row.attempts, runner_id)
+    return _handlers[row.kind].fn(ctx)
+
+
+def _execute_in_process(module: str, job_id: int, runner_id: str):
+    importlib.import_module(module) # Registers the handler in the pool process
+    return _execute(job_id, runner_id)
+
+
+class JobRunner:
+    """Claims and runs queued jobs in the worker's event loop. start() and stop() from the app's lifespan."""
+
+    def __init__(self):
+        self.runner_id = None
+        self._running = {} # job id -> task
+        self._task = None
+        self._loop = None
+        self._wake = None
+        self._stopping = False
+        self._threads = None
+        self._processes = None
+        self._last_purge = None
+
+    def start(self):
+        self.runner_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._threads = ThreadPoolExecutor(max_workers=settings.JOBS_CONCURRENCY, thread_name_prefix="job")
+        self._task = asyncio.create_task(self._run())
+
+    def wake(self):
+        """Looks for new jobs now instead of at the next poll. Safe from any thread."""
+        if self._task is not None and not self._stopping:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def stop(self):
+        """Stops claiming, gives running jobs the grace period and puts the ones still running back in the queue."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._task.cancel()
+        if self._running:
+            await asyncio.wait(list(self._running.values()), timeout=settings.JOBS_SHUTDOWN_GRACE_SECONDS)
+        # Their handlers stop at the next progress report
+        await self._loop.run_in_executor(None, self._release)
+        for task in self._running.values():
+            task.cancel()
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
+            self._processes = None
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                free = settings.JOBS_CONCURRENCY - len(self._running)
+                claimed = await self._loop.run_in_executor(None, self._maintain_and_claim, list(self._running), free)
+                for job_id, kind in claimed:
+                    self._running[job_id] = asyncio.create_task(self._execute(job_id, kind))
+            except Exception:
+                logger.exception("Job runner poll failed")
+            try:
+                await asyncio.wait_for(self._wake.wait(), settings.JOBS_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def _maintain_and_claim(self, running_ids: list, limit: int) -> list:
+        now = datetime.utcnow()
+        with engine.begin() as conn:
+            if running_ids:
+                conn.execute(update(Job).where(Job.id.in_(running_ids), Job.locked_by == self.runner_id, Job.status == "running")
+                             .values(heartbeat_at=now))
+            self._requeue_stale(conn, now)
+        if settings.JOBS_RETENTION_DAYS > 0 and (self._last_purge is None or time.monotonic() - self._last_purge > PURGE_INTERVAL_SECONDS):
+            self._last_purge = time.monotonic()
+            with engine.begin() as conn:
+                expired = conn.execute(delete(Job).where(Job.status.in_(FINISHED), Job.finished_at < now - timedelta(days=settings.JOBS_RETENTION_DAYS))
+                                       .returning(Job.params, Job.output)).all()
+            for params, output in expired:
+                _discard_upload(params) # Normally gone already, not for jobs that ran out of attempts in _requeue_stale
+                _discard_file(output)
+        if limit <= 0 or self._stopping:
+            return []
+        with engine.begin() as conn:
+            candidates = select(Job.id)\
+                .where(Job.status == "queued", Job.run_after <= now, Job.kind.in_(list(_handlers)))\
+                .order_by(Job.run_after, Job.id)\
+                .limit(limit)\
+                .with_for_update(skip_locked=True)
+            return conn.execute(
+                update(Job).where(Job.id.in_(candidates))
+                .values(status="running", locked_by=self.runner_id, attempts=Job.attempts + 1, started_at=now, heartbeat_at=now)
+                .returning(Job.id, Job.kind)
+            ).all()
+
+    def _requeue_stale(self, conn, now: datetime):
+        """Jobs whose runner stopped heartbeating go back to the queue, or fail if that was their last attempt."""
+        stale = select(Job.id)\
+            .where(Job.status == "running", Job.heartbeat_at < now - timedelta(seconds=settings.JOBS_STALE_SECONDS))\
+            .with_for_update(skip_locked=True)
+        ends = or_(Job.cancel_requested, Job.attempts >= Job.max_attempts)
+        conn.execute(update(Job).where(Job.id.in_(stale)).values(
+            status=case((Job.cancel_requested, "cancelled"), (Job.attempts >= Job.max_attempts, "failed"), else_="queued"),
+            finished_at=case((ends, now), else_=None),
+            error="The worker running it stopped responding",
+            locked_by=None,
+            run_after=now,
+        ))
+
+    def _release(self):
+        # Also covers a claim that completed after the poll loop was cancelled
+        with engine.begin() as conn:
+            conn.execute(update(Job).where(Job.locked_by == self.runner_id, Job.status == "running")
+                         .values(status="queued", locked_by=None, attempts=Job.attempts - 1, run_after=datetime.utcnow()))
+
+    def _process_pool(self) -> ProcessPoolExecutor:
+        if self._processes is None:
+            # Spawned rather than forked: the worker has threads and open connections
+            self._processes = ProcessPoolExecutor(settings.JOBS_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return self._processes
+
+    async def _execute(self, job_id: int, kind: str):
+        handler = _handlers[kind]
+        started = time.perf_counter()
+        try:
+            if handler.cpu_bound and settings.JOBS_PROCESS_WORKERS > 0:
+                result = await self._loop.run_in_executor(self._process_pool(), _execute_in_process, handler.fn.__module__, job_id, self.runner_id)
+            else:
+                result = await self._loop.run_in_executor(self._threads, _execute, job_id, self.runner_id)
+            outcome = {"status": "succeeded", "result": result}
+        except JobInterrupted:
+            return
+        except JobCancelled:
+            outcome = {"status": "cancelled"}
+        except JobDeferred as exc:
+            outcome = {"status": "deferred", "error": str(exc)}
+        except Exception as exc:
+            if isinstance(exc, BrokenProcessPool):
+                self._processes = None
+            JOB_FAILURES.labels(kind).inc()
+            logger.warning("Job %s (%s) failed: %r", job_id, kind, exc)
+            outcome = {"status": "failed", "error": f"{type(exc).__name__}: {exc}"[:1000]}
+        finally:
+            JOB_DURATION.labels(kind).observe(time.perf_counter() - started)
+            self._running.pop(job_id, None)
+        await self._loop.run_in_executor(None, self._finish, job_id, handler, outcome)
+        self._wake.set() # A slot is free
+
+    def _finish(self, job_id: int, handler: JobHandler, outcome: dict):
+        now = datetime.utcnow()
+        with engine.begin() as conn:
+            row = conn.execute(select(Job.owner_id, Job.params, Job.attempts, Job.max_attempts, Job.cancel_requested)
+                               .where(Job.id == job_id, Job.locked_by == self.runner_id, Job.status == "running")).first()
+            if row is None:
+                return
+            status = outcome["status"]
+            values = {"status": status, "finished_at": now}
+            if status == "succeeded":
+                values.update(result=outcome["result"], progress=1.0, error=None)
+            elif status == "deferred":
+                values = {"status": "queued", "attempts": Job.attempts - 1, "error": outcome["error"], "locked_by": None,
+                          "run_after": now + timedelta(seconds=settings.JOBS_RETRY_BACKOFF_SECONDS)}
+            elif status == "failed":
+                values["error"] = outcome["error"]
+                if row.cancel_requested:
+                    values["status"] = "cancelled"
+                elif row.attempts < row.max_attempts:
+                    backoff = settings.JOBS_RETRY_BACKOFF_SECONDS * 2 ** (row.attempts - 1)
+                    values.update(status="queued", finished_at=None, locked_by=None, run_after=now + timedelta(seconds=backoff))
+            conn.execute(update(Job).where(Job.id == job_id).values(**values))
+        if values["status"] in FINISHED:
+            _discard_upload(row.params)
+        # Whatever the outcome, the job may have written some of its data
+        if row.owner_id is not None:
+            for collection in handler.invalidates:
+                versions.bump(row.owner_id, collection)
+
+
+job_runner = JobRunner()
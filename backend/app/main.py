@@ -1,10 +1,53 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import ORJSONResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from .routers import auth, products, plans, subscriptions, taxes, discounts, payments, dashboard, invoices
-from .database import create_all_tables # Import create_all_tables
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import configure_mappers
+
+from .routers import auth, products, plans, subscriptions, taxes, discounts, payments, dashboard, invoices, search, reports, customers, admin, jobs, batch
+from .database import engine, shard_engines
+from .auth_utils import pwd_context
 from .config import settings
+from . import profiling, metrics, request_context, statement_timeout
+from .compression import CompressionMiddleware
+from .rate_limit import RateLimitMiddleware
+from .slow_queries import slow_query_log
+from .invalidation import invalidation_bus
+from .jobs import job_runner
+
+def warm_up(app: FastAPI):
+    """Pays the one-off costs before the first request instead of during it."""
+    configure_mappers()
+    pwd_context.handler("bcrypt").get_backend() # Loads the bcrypt backend without hashing anything
+    app.openapi()
+    # Open a few pooled connections up front, they go back to the pool for the first requests
+    connections = [engine.connect() for _ in range(settings.DB_POOL_WARMUP_CONNECTIONS)]
+    try:
+        for conn in connections:
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in connections:
+            conn.close()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(warm_up, app)
+    if settings.INVALIDATION_BUS != "off":
+        invalidation_bus.start(engine)
+    if settings.JOBS_ENABLED:
+        job_runner.start()
+    yield
+    await job_runner.stop()
+    invalidation_bus.stop()
+    for shard_engine in shard_engines.values():
+        await run_in_threadpool(shard_engine.dispose)
+
+# Importing the app has no side effects: the schema is managed with `python run_migration.py`
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse) # orjson renders the responses built from response_model
 
 origins = [
     "http://localhost",
@@ -12,6 +55,9 @@ origins = [
     "http://localhost:5173", # Add the default Vite port for the frontend
 ]
 
+# Innermost of the middleware, so its 429/503 responses still get CORS headers
+app.add_middleware(RateLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -20,8 +66,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Call create_all_tables to ensure database tables are created
-create_all_tables()
+app.add_middleware(request_context.RequestContextMiddleware)
+
+if settings.COMPRESSION_MINIMUM_SIZE > 0:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+        gzip_level=settings.GZIP_LEVEL,
+        brotli_quality=settings.BROTLI_QUALITY,
+    )
+
+for shard_engine in shard_engines.values():
+    statement_timeout.install(shard_engine)
+    if settings.SLOW_QUERY_THRESHOLD_MS > 0:
+        slow_query_log.install(shard_engine)
+    if settings.METRICS_ENABLED:
+        metrics.instrument_engine(shard_engine)
+    if settings.SQL_PROFILING_ENABLED:
+        profiling.install(shard_engine)
+
+if settings.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
+if settings.SQL_PROFILING_ENABLED:
+    app.add_middleware(
+        profiling.SQLProfilingMiddleware,
+        sample_rate=settings.SQL_PROFILING_SAMPLE_RATE,
+        repeat_threshold=settings.SQL_PROFILING_REPEAT_THRESHOLD,
+    )
 
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(products.router, prefix="/products", tags=["products"])
@@ -32,9 +104,25 @@ app.include_router(discounts.router, prefix="/discounts", tags=["discounts"])
 app.include_router(payments.router, prefix="/payments", tags=["payments"])
 app.include_router(dashboard.router, prefix="/dashboard", tags=["dashboard"])
 app.include_router(invoices.router, prefix="/invoices", tags=["invoices"])
-from .routers import customers
+app.include_router(search.router, prefix="/search", tags=["search"])
+app.include_router(reports.router, prefix="/reports", tags=["reports"])
 app.include_router(customers.router)
+app.include_router(admin.router, prefix="/admin", tags=["admin"])
+app.include_router(jobs.router, prefix="/jobs", tags=["jobs"])
+app.include_router(batch.router, prefix="/batch", tags=["batch"])
+
+@app.exception_handler(OperationalError)
+async def database_error(request: Request, exc: OperationalError):
+    if statement_timeout.is_timeout(exc):
+        return ORJSONResponse({"detail": "The query took too long, try a narrower request"}, status_code=503)
+    raise exc
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to -oneGuard Backend!"}
+
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def read_metrics():
+        body, content_type = metrics.render()
+        return Response(body, media_type=content_type)
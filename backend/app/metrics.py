@@ -0,0 +1,141 @@
+"""
+Prometheus metrics, served by GET /metrics.
+
+Each worker process counts on its own. Under gunicorn with several workers, set PROMETHEUS_MULTIPROC_DIR
+to an empty directory before the workers start: every process then writes its values to its own
+memory-mapped files in there and /metrics adds up all of them, whichever worker serves the scrape.
+The gunicorn config should call `prometheus_client.multiprocess.mark_process_dead(worker.pid)`
+from its child_exit hook so the in-progress and pool gauges of dead workers are dropped.
+"""
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from sqlalchemy import event
+
+REQUESTS = Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+REQUEST_DURATION = Histogram("http_request_duration_seconds", "HTTP request duration", ["method", "route"],
+                             buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+REQUESTS_IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests being served", ["method"], multiprocess_mode="livesum")
+REQUEST_QUERIES = Histogram("http_request_db_queries", "Database queries per HTTP request", ["method", "route"],
+                            buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250))
+DB_QUERIES = Counter("db_queries_total", "Database queries issued while serving requests", ["method", "route"])
+REQUESTS_REJECTED = Counter("http_requests_rejected_total", "Requests turned away by rate limiting or load shedding", ["reason", "group"])
+
+POOL_CHECKOUTS = Counter("db_pool_checkouts_total", "Connections checked out of the pool")
+POOL_CONNECTS = Counter("db_pool_connections_created_total", "New database connections opened by the pool")
+POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections currently checked out of the pool", multiprocess_mode="livesum")
+POOL_CHECKOUT_DURATION = Histogram("db_pool_checkout_duration_seconds", "How long connections stay checked out",
+                                   buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30))
+
+INVOICES_GENERATED = Counter("invoices_generated_total", "Invoices generated")
+PAYMENTS_RECORDED = Counter("payments_recorded_total", "Payments recorded", ["method"])
+PAYMENT_AMOUNT = Counter("payments_amount_total", "Sum of the recorded payment amounts")
+
+JOB_DURATION = Histogram("job_duration_seconds", "Duration of background and bulk jobs", ["job"],
+                         buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900))
+JOB_FAILURES = Counter("job_failures_total", "Jobs that raised", ["job"])
+
+# Query counter of the request being served, bumped by the engine listener
+_request_queries: ContextVar[Optional[list]] = ContextVar("request_queries", default=None)
+
+
+def render():
+    """(body, content type) of the current metrics, added up over all workers in multiprocess mode."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+@contextmanager
+def track_job(name: str):
+    """Times a job into job_duration_seconds, counting it in job_failures_total if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        JOB_FAILURES.labels(name).inc()
+        raise
+    finally:
+        JOB_DURATION.labels(name).observe(time.perf_counter() - started)
+
+
+def record_payment(method: str, amount: float):
+    PAYMENTS_RECORDED.labels(method or "unknown").inc()
+    PAYMENT_AMOUNT.inc(amount or 0.0)
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = _request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    POOL_CHECKOUTS.inc()
+    POOL_CHECKED_OUT.inc()
+    connection_record.info["metrics_checked_out_at"] = time.perf_counter()
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    started = connection_record.info.pop("metrics_checked_out_at", None)
+    if started is not None:
+        POOL_CHECKED_OUT.dec()
+        POOL_CHECKOUT_DURATION.observe(time.perf_counter() - started)
+
+
+def _on_connect(dbapi_connection, connection_record):
+    POOL_CONNECTS.inc()
+
+
+def instrument_engine(engine):
+    """Pool and query listeners for the engine."""
+    if event.contains(engine, "after_cursor_execute", _count_query):
+        return
+    event.listen(engine, "after_cursor_execute", _count_query)
+    event.listen(engine.pool, "checkout", _on_checkout)
+    event.listen(engine.pool, "checkin", _on_checkin)
+    event.listen(engine.pool, "connect", _on_connect)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording count, duration and query count of every HTTP request by route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        queries = [0]
+        token = _request_queries.set(queries)
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        REQUESTS_IN_PROGRESS.labels(method).inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_PROGRESS.labels(method).dec()
+            _request_queries.reset(token)
+            # Label by path template; unmatched paths are all one label so scanners can't blow up the series count
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUESTS.labels(method, route, str(status_code)).inc()
+            REQUEST_DURATION.labels(method, route).observe(time.perf_counter() - started)
+            REQUEST_QUERIES.labels(method, route).observe(queries[0])
+            DB_QUERIES.labels(method, route).inc(queries[0])
@@ -0,0 +1,87 @@
+"""
+Versioned schema migrations.
+
+Each module named vNNNN_<name>.py in this package is one migration, applied in version order and
+recorded in the schema_migrations table. A migration defines `upgrade(conn)`, and sets
+`TRANSACTIONAL = False` if it needs autocommit (e.g. CREATE INDEX CONCURRENTLY on Postgres).
+
+The baseline builds the current models on an empty database, so later migrations must check
+before they change anything (see ops.py) and be safe to run against an already current schema.
+"""
+import importlib
+import pkgutil
+import re
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, select, text
+
+_MODULE_PATTERN = re.compile(r"^v(\d{4})_\w+$")
+_ADVISORY_LOCK_ID = 7_420_001 # Arbitrary, shared by every process running migrations
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def discover() -> list:
+    """All migrations of this package as (version, name, module), in order."""
+    migrations = []
+    for info in pkgutil.iter_modules(__path__):
+        match = _MODULE_PATTERN.match(info.name)
+        if match:
+            migrations.append((int(match.group(1)), info.name, importlib.import_module(f"{__name__}.{info.name}")))
+    return sorted(migrations, key=lambda migration: migration[0])
+
+
+def applied_versions(engine) -> dict:
+    """version -> applied_at of the migrations recorded in the database."""
+    with engine.begin() as conn:
+        schema_migrations.create(conn, checkfirst=True)
+        return {row.version: row.applied_at for row in conn.execute(select(schema_migrations))}
+
+
+@contextmanager
+def _migration_lock(engine):
+    # Several app instances starting at once must not apply the same migration twice
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": _ADVISORY_LOCK_ID})
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": _ADVISORY_LOCK_ID})
+
+
+def upgrade(engine, target: int = None, log=print) -> list:
+    """Applies the pending migrations up to `target` (default: all). Returns the applied versions."""
+    done = []
+    with _migration_lock(engine):
+        applied = applied_versions(engine)
+        for version, name, module in discover():
+            if version in applied or (target is not None and version > target):
+                continue
+            log(f"Applying {name}...")
+            record = schema_migrations.insert().values(version=version, name=name, applied_at=datetime.utcnow())
+            if getattr(module, "TRANSACTIONAL", True):
+                with engine.begin() as conn:
+                    module.upgrade(conn)
+                    conn.execute(record)
+            else:
+                with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                    module.upgrade(conn)
+                    conn.execute(record)
+            done.append(version)
+    return done
+
+
+def status(engine) -> list:
+    """(version, name, applied_at or None) for every known migration."""
+    applied = applied_versions(engine)
+    return [(version, name, applied.get(version)) for version, name, _ in discover()]
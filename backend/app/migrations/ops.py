@@ -0,0 +1,62 @@
+"""Idempotent schema operations for migrations, working on Postgres and SQLite."""
+from sqlalchemy import inspect, text
+
+
+def has_table(conn, table: str) -> bool:
+    return inspect(conn).has_table(table)
+
+
+def has_column(conn, table: str, column: str) -> bool:
+    return any(existing["name"] == column for existing in inspect(conn).get_columns(table))
+
+
+def add_column(conn, table: str, column: str, ddl: str) -> bool:
+    """ALTER TABLE ... ADD COLUMN unless the column is already there. `ddl` is the type and constraints."""
+    if not has_table(conn, table) or has_column(conn, table, column):
+        return False
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return True
+
+
+def _is_partitioned(conn, table: str) -> bool:
+    return conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}).scalar() == "p"
+
+
+def _index_state(conn, name: str):
+    """None if the index does not exist, otherwise whether it is valid (Postgres marks failed concurrent builds invalid)."""
+    if conn.dialect.name == "postgresql":
+        return conn.execute(text(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+        ), {"name": name}).scalar()
+    exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"), {"name": name}).scalar()
+    return True if exists else None
+
+
+def create_index(conn, name: str, table: str, columns: str, where: str = None, postgresql_using: str = None, postgresql_include: str = None) -> bool:
+    """
+    CREATE INDEX unless it already exists. On Postgres with an autocommit connection the index is built
+    CONCURRENTLY, without blocking writes; an invalid leftover from an interrupted build is rebuilt.
+    Partitioned tables do not support CONCURRENTLY and get a plain build.
+    """
+    if not has_table(conn, table):
+        return False
+    postgres = conn.dialect.name == "postgresql"
+    state = _index_state(conn, name)
+    if state:
+        return False
+
+    concurrently = postgres and conn.get_isolation_level() == "AUTOCOMMIT" and not _is_partitioned(conn, table)
+    if state is False:
+        conn.execute(text(f"DROP INDEX {'CONCURRENTLY ' if concurrently else ''}{name}"))
+
+    statement = f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}{name} ON {table}"
+    if postgres and postgresql_using:
+        statement += f" USING {postgresql_using}"
+    statement += f" ({columns})"
+    if postgres and postgresql_include:
+        statement += f" INCLUDE ({postgresql_include})"
+    if where:
+        statement += f" WHERE {where}"
+    conn.execute(text(statement))
+    return True
@@ -0,0 +1,7 @@
+"""Creates every table of the current models that does not exist yet."""
+from ..database import Base
+from .. import models  # noqa: F401 (registers the tables)
+
+
+def upgrade(conn):
+    Base.metadata.create_all(conn)
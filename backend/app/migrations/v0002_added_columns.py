@@ -0,0 +1,22 @@
+"""Columns added to existing tables since the first release (replaces migrate_owner.py)."""
+from sqlalchemy import text
+
+from .ops import add_column
+
+
+def upgrade(conn):
+    false = "false" if conn.dialect.name == "postgresql" else "0"
+
+    # Multi-tenancy: catalog rows created before owner_id belong to the first user
+    first_user_id = conn.execute(text("SELECT id FROM users ORDER BY id LIMIT 1")).scalar()
+    for table in ("products", "plans", "taxes", "discounts"):
+        if add_column(conn, table, "owner_id", "INTEGER REFERENCES users (id)") and first_user_id is not None:
+            conn.execute(text(f"UPDATE {table} SET owner_id = :user_id"), {"user_id": first_user_id})
+
+    add_column(conn, "discounts", "used_count", "INTEGER NOT NULL DEFAULT 0")
+    add_column(conn, "subscriptions", "discount_id", "INTEGER REFERENCES discounts (id)")
+    add_column(conn, "taxes", "is_compound", f"BOOLEAN NOT NULL DEFAULT {false}")
+    if add_column(conn, "invoice_lines", "issue_date", "DATE"):
+        conn.execute(text(
+            "UPDATE invoice_lines SET issue_date = (SELECT issue_date FROM invoices WHERE invoices.id = invoice_lines.invoice_id)"
+        ))
@@ -0,0 +1,56 @@
+"""Indexes on foreign keys and hot filters, built CONCURRENTLY on Postgres."""
+from sqlalchemy import text
+
+from .ops import create_index
+
+TRANSACTIONAL = False
+
+# name, table, columns
+INDEXES = [
+    # Owner-scoped lists and lookups
+    ("ix_customers_owner_id_id", "customers", "owner_id, id"),
+    ("ix_products_owner_id_id", "products", "owner_id, id"),
+    ("ix_plans_owner_id_id", "plans", "owner_id, id"),
+    ("ix_taxes_owner_id_id", "taxes", "owner_id, id"),
+    ("ix_discounts_owner_id_id", "discounts", "owner_id, id"),
+    ("ix_customers_portal_user_id", "customers", "portal_user_id"),
+    # Foreign keys
+    ("ix_plans_product_id", "plans", "product_id"),
+    ("ix_subscriptions_plan_id", "subscriptions", "plan_id"),
+    ("ix_subscriptions_discount_id", "subscriptions", "discount_id"),
+    ("ix_subscription_lines_subscription_id", "subscription_lines", "subscription_id"),
+    ("ix_subscription_lines_product_id", "subscription_lines", "product_id"),
+    ("ix_subscription_line_taxes_tax_id", "subscription_line_taxes", "tax_id"),
+    ("ix_invoices_subscription_id", "invoices", "subscription_id"),
+    ("ix_invoice_lines_invoice_id", "invoice_lines", "invoice_id"),
+    ("ix_payments_invoice_id", "payments", "invoice_id"),
+    ("ix_discount_redemptions_subscription_id", "discount_redemptions", "subscription_id"),
+    # Status filters per customer (dashboard counts, portal and customer pages)
+    ("ix_subscriptions_customer_id_status", "subscriptions", "customer_id, status"),
+    ("ix_invoices_customer_id_status", "invoices", "customer_id, status"),
+    # Customer import deduplication
+    ("ix_customers_owner_email_lower", "customers", "owner_id, lower(email)"),
+]
+
+TRIGRAM_INDEXES = [
+    ("ix_customers_name_trgm", "customers", "name"),
+    ("ix_customers_email_trgm", "customers", "email"),
+    ("ix_products_name_trgm", "products", "name"),
+    ("ix_plans_name_trgm", "plans", "name"),
+    ("ix_subscriptions_number_trgm", "subscriptions", "subscription_number"),
+    ("ix_invoices_number_trgm", "invoices", "invoice_number"),
+]
+
+
+def upgrade(conn):
+    for name, table, columns in INDEXES:
+        create_index(conn, name, table, columns)
+
+    # AR aging report
+    create_index(conn, "ix_invoices_unpaid_customer_due", "invoices", "customer_id, due_date",
+                 where="status <> 'paid'", postgresql_include="grand_total")
+
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        for name, table, column in TRIGRAM_INDEXES:
+            create_index(conn, name, table, f"{column} gin_trgm_ops", postgresql_using="gin")
@@ -0,0 +1,6 @@
+"""Shard directory for tenant sharding (app/sharding.py)."""
+from ..models import TenantShard
+
+
+def upgrade(conn):
+    TenantShard.__table__.create(conn, checkfirst=True)
@@ -0,0 +1,6 @@
+"""Background jobs table (app/jobs.py)."""
+from ..models import Job
+
+
+def upgrade(conn):
+    Job.__table__.create(conn, checkfirst=True)
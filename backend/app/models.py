@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, Boolean, DateTime
-from sqlalchemy.orm import relationship
-from datetime import datetime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, Boolean, DateTime, Index, DDL, JSON, Table, Text, event, false, func
+from sqlalchemy.orm import deferred, relationship
+from datetime import date, datetime
 from .database import Base
 
 class User(Base):
@@ -19,6 +19,43 @@ class User(Base):
     # For portal users, this links to the customer record they represent
     customer_profile = relationship("Customer", foreign_keys="Customer.portal_user_id", back_populates="portal_user", uselist=False)
 
+class TenantShard(Base):
+    """Shard directory (primary database only): where a user's tenant lives, for tenants not on the primary database."""
+    __tablename__ = "tenant_shards"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True) # The owner and each of its portal users have a row
+    owner_id = Column(Integer, index=True, nullable=False)
+    shard = Column(String, nullable=False)
+    state = Column(String, nullable=False, default="active") # 'active' or 'moving' (writes paused while move_tenant.py syncs)
+
+class Job(Base):
+    """Background job (app/jobs.py), primary database only."""
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True) # None for jobs not run for a tenant
+    kind = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="queued") # 'queued', 'running', 'succeeded', 'failed' or 'cancelled'
+    params = Column(JSON, nullable=False, default=dict)
+    payload = deferred(Column(Text, nullable=True)) # Input too big for params, e.g. an uploaded file
+    result = Column(JSON, nullable=True)
+    output = deferred(Column(Text, nullable=True)) # Name of the file the job produced in JOBS_SPOOL_DIR, served by /jobs/{id}/output
+    output_type = Column(String, nullable=True)
+    error = Column(String, nullable=True) # Of the last failed attempt
+    progress = Column(Float, nullable=False, default=0.0) # 0-1
+    progress_message = Column(String, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow) # Not claimed before this (retry backoff)
+    locked_by = Column(String, nullable=True) # Runner that claimed it
+    heartbeat_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True) # Of the last attempt
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (Index("ix_jobs_status_run_after", "status", "run_after"),) # Claim query
+
 class Customer(Base):
     __tablename__ = "customers"
 
@@ -26,7 +63,7 @@ class Customer(Base):
     owner_id = Column(Integer, ForeignKey("users.id")) # The business user who owns this customer record
     name = Column(String, index=True)
     email = Column(String, index=True)
-    portal_user_id = Column(Integer, ForeignKey("users.id"), nullable=True) # Optional link to a real user for portal access
+    portal_user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True) # Optional link to a real user for portal access
 
     owner = relationship("User", foreign_keys=[owner_id], back_populates="owned_customers")
     portal_user = relationship("User", foreign_keys=[portal_user_id], back_populates="customer_profile")
@@ -34,6 +71,12 @@ class Customer(Base):
     subscriptions = relationship("Subscription", back_populates="customer")
     invoices = relationship("Invoice", back_populates="customer")
 
+    __table_args__ = (
+        # Case-insensitive email lookups of one owner (customer import deduplication)
+        Index("ix_customers_owner_email_lower", "owner_id", func.lower(email)),
+        Index("ix_customers_owner_id_id", "owner_id", "id"),
+    )
+
 class Product(Base):
     __tablename__ = "products"
 
@@ -49,11 +92,13 @@ class Product(Base):
     owner = relationship("User")
     plans = relationship("Plan", back_populates="product")
 
+    __table_args__ = (Index("ix_products_owner_id_id", "owner_id", "id"),)
+
 class Plan(Base):
     __tablename__ = "plans"
 
     id = Column(Integer, primary_key=True, index=True)
-    product_id = Column(Integer, ForeignKey("products.id"))
+    product_id = Column(Integer, ForeignKey("products.id"), index=True)
     name = Column(String, index=True)
     billing_period = Column(String)
     price = Column(Float)
@@ -68,6 +113,8 @@ class Plan(Base):
     owner = relationship("User")
     product = relationship("Product", back_populates="plans")
 
+    __table_args__ = (Index("ix_plans_owner_id_id", "owner_id", "id"),)
+
 class Subscription(Base):
     __tablename__ = "subscriptions"
     id = Column(Integer, primary_key=True, index=True)
@@ -89,18 +136,29 @@ class Subscription(Base):
     confirmed_at = Column(DateTime, nullable=True)
     closed_at = Column(DateTime, nullable=True)
 
-    plan_id = Column(Integer, ForeignKey("plans.id"))
+    plan_id = Column(Integer, ForeignKey("plans.id"), index=True)
+    discount_id = Column(Integer, ForeignKey("discounts.id"), nullable=True, index=True) # Discount code applied at creation
     plan = relationship("Plan")
     invoices = relationship("Invoice", back_populates="subscription")
     subscription_lines = relationship("SubscriptionLine", back_populates="subscription")
     customer = relationship("Customer", back_populates="subscriptions") # Relationship to Customer
 
+    __table_args__ = (Index("ix_subscriptions_customer_id_status", "customer_id", "status"),)
+
+# Taxes a subscription line is priced with, resolved to tax_percent at pricing time
+subscription_line_taxes = Table(
+    "subscription_line_taxes",
+    Base.metadata,
+    Column("subscription_line_id", Integer, ForeignKey("subscription_lines.id"), primary_key=True),
+    Column("tax_id", Integer, ForeignKey("taxes.id"), primary_key=True, index=True),
+)
+
 class SubscriptionLine(Base):
     __tablename__ = "subscription_lines"
 
     id = Column(Integer, primary_key=True, index=True)
-    subscription_id = Column(Integer, ForeignKey("subscriptions.id"))
-    product_id = Column(Integer, ForeignKey("products.id"), nullable=True)
+    subscription_id = Column(Integer, ForeignKey("subscriptions.id"), index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=True, index=True)
     product_name_snapshot = Column(String)
     unit_price_snapshot = Column(Float)
     quantity = Column(Integer)
@@ -110,15 +168,20 @@ class SubscriptionLine(Base):
 
     subscription = relationship("Subscription", back_populates="subscription_lines")
     product = relationship("Product")
+    taxes = relationship("Tax", secondary=subscription_line_taxes, lazy="selectin")
+
+    @property
+    def tax_ids(self):
+        return [tax.id for tax in self.taxes]
 
 class Invoice(Base):
     __tablename__ = "invoices"
     id = Column(Integer, primary_key=True, index=True)
     invoice_number = Column(String, unique=True, index=True)
-    subscription_id = Column(Integer, ForeignKey("subscriptions.id"))
+    subscription_id = Column(Integer, ForeignKey("subscriptions.id"), index=True)
     customer_id = Column(Integer, ForeignKey("customers.id")) # Re-pointed to customers
 
-    issue_date = Column(Date)
+    issue_date = Column(Date, default=date.today) # Partition key when partitioned (partition_tables.py)
     due_date = Column(Date)
     status = Column(String, default="draft")
     paid_date = Column(Date, nullable=True)
@@ -133,11 +196,14 @@ class Invoice(Base):
     payments = relationship("Payment", back_populates="invoice")
     customer = relationship("Customer", back_populates="invoices") # Relationship to Customer
 
+    __table_args__ = (Index("ix_invoices_customer_id_status", "customer_id", "status"),)
+
 class InvoiceLine(Base):
     __tablename__ = "invoice_lines"
 
     id = Column(Integer, primary_key=True, index=True)
-    invoice_id = Column(Integer, ForeignKey("invoices.id"))
+    invoice_id = Column(Integer, ForeignKey("invoices.id"), index=True)
+    issue_date = Column(Date, nullable=True) # Copy of the invoice's issue_date, keeps lines in the same partition as their invoice
     product_name = Column(String)
     unit_price = Column(Float)
     quantity = Column(Integer)
@@ -152,11 +218,25 @@ class Tax(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
-    percent = Column(Float)
+    percent = Column(Float) # Rate used when no dated TaxRate applies
     is_active = Column(Boolean, default=True)
+    is_compound = Column(Boolean, default=False, server_default=false()) # Applied on top of the price plus the other taxes
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=True) # owner_id added for multi-tenancy
 
     owner = relationship("User")
+    rates = relationship("TaxRate", back_populates="tax", cascade="all, delete-orphan")
+
+    __table_args__ = (Index("ix_taxes_owner_id_id", "owner_id", "id"),)
+
+class TaxRate(Base):
+    __tablename__ = "tax_rates"
+
+    id = Column(Integer, primary_key=True, index=True)
+    tax_id = Column(Integer, ForeignKey("taxes.id"), index=True)
+    percent = Column(Float)
+    effective_from = Column(Date) # In effect until the next rate of the same tax starts
+
+    tax = relationship("Tax", back_populates="rates")
 
 class Discount(Base):
     __tablename__ = "discounts"
@@ -168,20 +248,52 @@ class Discount(Base):
     start_date = Column(Date, nullable=True)
     end_date = Column(Date, nullable=True)
     usage_limit = Column(Integer, nullable=True)
+    used_count = Column(Integer, default=0, server_default="0", nullable=False) # Only maintained for codes with a usage_limit
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=True) # owner_id added for multi-tenancy
 
     owner = relationship("User")
 
+    __table_args__ = (Index("ix_discounts_owner_id_id", "owner_id", "id"),)
+
+class DiscountRedemption(Base):
+    __tablename__ = "discount_redemptions"
+
+    # Append-only, so redemptions of unlimited codes never contend on the discount row
+    id = Column(Integer, primary_key=True, index=True)
+    discount_id = Column(Integer, ForeignKey("discounts.id"), index=True)
+    subscription_id = Column(Integer, ForeignKey("subscriptions.id"), index=True)
+    amount = Column(Float, default=0.0)
+    redeemed_at = Column(DateTime, default=datetime.utcnow)
+
 class Payment(Base):
     __tablename__ = "payments"
 
     id = Column(Integer, primary_key=True, index=True)
-    invoice_id = Column(Integer, ForeignKey("invoices.id"))
+    invoice_id = Column(Integer, ForeignKey("invoices.id"), index=True)
     amount = Column(Float)
     method = Column(String)
     reference_id = Column(String, nullable=True)
     status = Column(String, default="pending")
-    payment_date = Column(DateTime, default=datetime.utcnow)
+    payment_date = Column(DateTime, default=datetime.utcnow) # Partition key when partitioned (partition_tables.py)
 
     invoice = relationship("Invoice", back_populates="payments")
 
+# Trigram indexes for substring search (/search) on Postgres. They need pg_trgm,
+# which is created before the tables; other databases use the in-memory prefix index.
+event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+
+def _trigram_index(name, column):
+    return Index(name, column, postgresql_using="gin", postgresql_ops={column.key: "gin_trgm_ops"}).ddl_if(dialect="postgresql")
+
+_trigram_index("ix_customers_name_trgm", Customer.name)
+_trigram_index("ix_customers_email_trgm", Customer.email)
+_trigram_index("ix_products_name_trgm", Product.name)
+_trigram_index("ix_plans_name_trgm", Plan.name)
+_trigram_index("ix_subscriptions_number_trgm", Subscription.subscription_number)
+_trigram_index("ix_invoices_number_trgm", Invoice.invoice_number)
+
+# Unpaid invoices by customer and due date, covering the AR aging report (/reports/ar-aging)
+Index(
+    "ix_invoices_unpaid_customer_due", Invoice.customer_id, Invoice.due_date,
+    postgresql_include=["grand_total"], postgresql_where=Invoice.status != "paid",
+)
@@ -0,0 +1,164 @@
+"""
+Per-request SQL profiling: counts the queries and database time of each request through engine
+events and flags statements repeated within one request, the usual sign of an N+1 lazy load.
+
+Only installed when SQL_PROFILING_ENABLED is set (see main.py), otherwise neither the engine
+listeners nor the middleware exist. Results go out in a Server-Timing header and into an
+in-memory report per worker process, served by /admin/sql-profile.
+"""
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Set by the middleware for the requests being profiled; sync endpoints see it too, the threadpool copies the context
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("sql_profile", default=None)
+
+
+class RequestProfile:
+    """Queries of one request, grouped by statement text (parameters are bound, so repeats have the same text)."""
+
+    __slots__ = ("queries", "db_time", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = {} # statement -> [count, seconds]
+
+    def record(self, statement: str, elapsed: float):
+        self.queries += 1
+        self.db_time += elapsed
+        entry = self.statements.get(statement)
+        if entry is None:
+            self.statements[statement] = [1, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def repeated(self, threshold: int) -> list:
+        """Statements run at least `threshold` times, most frequent first."""
+        return sorted(
+            ({"statement": statement, "count": count, "db_ms": round(seconds * 1000, 3)}
+             for statement, (count, seconds) in self.statements.items() if count >= threshold),
+            key=lambda item: -item["count"],
+        )
+
+    def server_timing(self, total: float) -> str:
+        return f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries", app;dur={total * 1000:.2f}'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _current_profile.get() is not None:
+        context._profile_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    started = getattr(context, "_profile_started", None)
+    if profile is not None and started is not None:
+        profile.record(statement, time.perf_counter() - started)
+
+
+def install(engine):
+    """Adds the timing listeners to the engine."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class SQLProfileReport:
+    """Recent profiled requests plus totals per route, kept in memory by each worker."""
+
+    def __init__(self, size: int = 200):
+        self._lock = threading.Lock()
+        self.recent = deque(maxlen=size)
+        self.routes = {}
+
+    def add(self, entry: dict):
+        key = f"{entry['method']} {entry['route']}"
+        with self._lock:
+            self.recent.append(entry)
+            route = self.routes.setdefault(key, {"route": key, "requests": 0, "queries": 0, "db_ms": 0.0, "max_queries": 0, "n_plus_one": 0})
+            route["requests"] += 1
+            route["queries"] += entry["queries"]
+            route["db_ms"] += entry["db_ms"]
+            route["max_queries"] = max(route["max_queries"], entry["queries"])
+            route["n_plus_one"] += bool(entry["repeated"])
+
+    def snapshot(self, limit: int = 50) -> dict:
+        with self._lock:
+            recent = list(self.recent)[-limit:][::-1] if limit else []
+            routes = [
+                {**route, "db_ms": round(route["db_ms"], 3), "avg_queries": round(route["queries"] / route["requests"], 2)}
+                for route in self.routes.values()
+            ]
+        routes.sort(key=lambda route: -route["db_ms"])
+        return {"routes": routes, "recent": recent}
+
+    def clear(self):
+        with self._lock:
+            self.recent.clear()
+            self.routes.clear()
+
+
+profile_report = SQLProfileReport(settings.SQL_PROFILING_REPORT_SIZE)
+
+
+class SQLProfilingMiddleware:
+    """ASGI middleware profiling a `sample_rate` share of the HTTP requests."""
+
+    def __init__(self, app, sample_rate: float = 1.0, repeat_threshold: int = 5, report: SQLProfileReport = profile_report):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.repeat_threshold = repeat_threshold
+        self.report = report
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or random.random() >= self.sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message).append("Server-Timing", profile.server_timing(time.perf_counter() - started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_profile.reset(token)
+            self._record(scope, profile, status_code, time.perf_counter() - started)
+
+    def _record(self, scope, profile: RequestProfile, status_code: int, total: float):
+        # The router leaves the matched route in the scope, so requests group by path template
+        route = scope.get("route")
+        path = getattr(route, "path", scope["path"])
+        repeated = profile.repeated(self.repeat_threshold)
+        for item in repeated:
+            logger.warning("Possible N+1 in %s %s: statement ran %d times: %s", scope["method"], path, item["count"], item["statement"][:200])
+        self.report.add({
+            "method": scope["method"],
+            "route": path,
+            "status_code": status_code,
+            "queries": profile.queries,
+            "db_ms": round(profile.db_time * 1000, 3),
+            "total_ms": round(total * 1000, 3),
+            "repeated": repeated,
+        })
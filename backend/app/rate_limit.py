@@ -0,0 +1,200 @@
+"""
+Per-user token buckets and load shedding, applied before a request reaches the routers (and the
+database): the user comes from the bearer token alone, without a lookup.
+
+Every owner and every portal user has a bucket per route group (read, write, reports, bulk, auth;
+see route_group), with limits from RATE_LIMITS / PORTAL_RATE_LIMITS. Requests without a valid
+token are limited per client address. Buckets live in the worker unless RATE_LIMIT_REDIS_URL
+points at a Redis-compatible server, which shares them between workers and nodes.
+
+Load shedding works on the requests in flight in this worker: beyond MAX_IN_FLIGHT_REQUESTS new
+requests get 503, and a single user beyond MAX_IN_FLIGHT_PER_USER gets 429, so one tenant can't
+take every pooled connection. The request's route group also picks its statement timeout.
+POST /batch charges each of its sub-requests the same way, through scope["rate_limiter"].
+"""
+import logging
+import math
+import threading
+import time
+from typing import Optional
+
+from jose import JWTError, jwt
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+from . import metrics, statement_timeout
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Path prefix -> route group, first match wins; other paths are "read" or "write" by method
+ROUTE_GROUPS = (
+    ("/auth/", "auth"),
+    ("/reports/", "reports"),
+    ("/customers/import", "bulk"),
+    ("/products/import", "bulk"), # Also /products/import/csv
+)
+EXEMPT_PATHS = {"/", "/metrics", "/docs", "/redoc", "/openapi.json"}
+LONG_LIVED_PATHS = {"/dashboard/stream"} # Limited when they connect, not counted as in flight
+
+
+def route_group(method: str, path: str) -> str:
+    for prefix, group in ROUTE_GROUPS:
+        if path.startswith(prefix):
+            return group
+    return "read" if method in ("GET", "HEAD") else "write"
+
+
+def parse_group_settings(value: str, parse) -> dict:
+    """"read=20/40,write=5/10" -> {"read": parse("20/40"), ...}"""
+    parsed = {}
+    for item in value.split(","):
+        if item.strip():
+            group, _, setting = item.partition("=")
+            parsed[group.strip()] = parse(setting.strip())
+    return parsed
+
+
+def parse_limit(value: str) -> tuple:
+    rate, _, burst = value.partition("/")
+    return float(rate), float(burst or rate)
+
+
+class LocalBuckets:
+    """Token buckets in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {} # key -> [tokens, updated]
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        """Takes a token. Returns 0 if there was one, otherwise the seconds until there is."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= 100_000:
+                    self._prune(now)
+                bucket = self._buckets[key] = [burst, now]
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0.0
+            bucket[0] = tokens
+            return (1 - tokens) / rate
+
+    def _prune(self, now: float):
+        # Buckets idle long enough to be full again carry no state
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if now - bucket[1] < 60}
+
+
+# KEYS[1] bucket, ARGV rate and burst. Uses the server clock, so workers on different hosts agree
+_REDIS_TAKE = """
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = math.min(burst, (tonumber(state[1]) or burst) + (now - (tonumber(state[2]) or now)) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisBuckets:
+    """Token buckets shared through a Redis-compatible server, falling back to local ones while it is unreachable."""
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError as exc:
+            raise RuntimeError("RATE_LIMIT_REDIS_URL is set but the redis package is not installed (pip install redis)") from exc
+        self._client = redis.from_url(url)
+        self._take = self._client.register_script(_REDIS_TAKE)
+        self._fallback = LocalBuckets()
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        try:
+            return float(await self._take(keys=[f"ratelimit:{key}"], args=[rate, burst]))
+        except Exception as exc:
+            logger.warning("Rate limit store unavailable, limiting per worker: %s", exc)
+            return await self._fallback.take(key, rate, burst)
+
+
+def _too_many(detail: str, retry_after: float, status_code: int = 429) -> JSONResponse:
+    return JSONResponse({"detail": detail}, status_code=status_code, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+class RateLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.limits = parse_group_settings(settings.RATE_LIMITS, parse_limit)
+        self.portal_limits = parse_group_settings(settings.PORTAL_RATE_LIMITS, parse_limit)
+        self.timeouts = parse_group_settings(settings.STATEMENT_TIMEOUTS_MS, int)
+        self.buckets = RedisBuckets(settings.RATE_LIMIT_REDIS_URL) if settings.RATE_LIMIT_REDIS_URL else LocalBuckets()
+        self.in_flight = 0
+        self.in_flight_by_user = {}
+
+    def identity(self, scope) -> tuple:
+        """(bucket key, is portal user) from the bearer token, or the client address without a valid one."""
+        authorization = Headers(scope=scope).get("authorization", "")
+        if authorization[:7].lower() == "bearer ":
+            try:
+                payload = jwt.decode(authorization[7:], settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+            except JWTError:
+                payload = {}
+            if payload.get("sub"):
+                # Tokens carry the mode they were issued for; a mode change applies from the next login
+                return f"user:{payload['sub']}", payload.get("mode") == "portal"
+        client = scope.get("client")
+        return f"ip:{client[0] if client else 'unknown'}", False
+
+    async def charge(self, group: str, identity: str, portal: bool) -> float:
+        """Takes a token from the identity's bucket of the group. Returns 0 if there was one, otherwise the seconds until there is."""
+        limit = (self.portal_limits if portal else self.limits).get(group)
+        if not limit:
+            return 0.0
+        return await self.buckets.take(f"{group}:{identity}", *limit)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        group = route_group(scope["method"], scope["path"])
+        identity, portal = self.identity(scope)
+        counted = scope["path"] not in LONG_LIVED_PATHS
+        rejection = None
+
+        if counted and settings.MAX_IN_FLIGHT_REQUESTS and self.in_flight >= settings.MAX_IN_FLIGHT_REQUESTS:
+            rejection = ("overloaded", _too_many("Server is busy, try again shortly", 1, status_code=503))
+        elif counted and settings.MAX_IN_FLIGHT_PER_USER and self.in_flight_by_user.get(identity, 0) >= settings.MAX_IN_FLIGHT_PER_USER:
+            rejection = ("concurrency", _too_many("Too many concurrent requests", 1))
+        else:
+            wait = await self.charge(group, identity, portal)
+            if wait:
+                rejection = ("rate", _too_many("Rate limit exceeded", wait))
+        if rejection:
+            metrics.REQUESTS_REJECTED.labels(rejection[0], group).inc()
+            await rejection[1](scope, receive, send)
+            return
+
+        scope["rate_limiter"] = self
+        if counted:
+            self.in_flight += 1
+            self.in_flight_by_user[identity] = self.in_flight_by_user.get(identity, 0) + 1
+        token = statement_timeout.set_timeout(self.timeouts.get(group))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            statement_timeout.reset_timeout(token)
+            if counted:
+                self.in_flight -= 1
+                remaining = self.in_flight_by_user[identity] - 1
+                if remaining:
+                    self.in_flight_by_user[identity] = remaining
+                else:
+                    del self.in_flight_by_user[identity]
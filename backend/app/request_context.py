@@ -0,0 +1,52 @@
+"""
+What is known about the request being served (route, authenticated owner), for code that runs
+below the routers such as engine event listeners. Set up by RequestContextMiddleware; the
+threadpool copies the context, so sync endpoints and dependencies see the same object.
+"""
+from contextvars import ContextVar
+from typing import Optional
+
+
+class RequestContext:
+    __slots__ = ("scope", "owner_id")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.owner_id = None # Set once the user is authenticated
+
+    @property
+    def method(self) -> str:
+        return self.scope["method"]
+
+    @property
+    def route(self) -> str:
+        # The router leaves the matched route in the scope
+        return getattr(self.scope.get("route"), "path", self.scope["path"])
+
+
+_current: ContextVar[Optional[RequestContext]] = ContextVar("request_context", default=None)
+
+
+def current() -> Optional[RequestContext]:
+    return _current.get()
+
+
+def set_owner(owner_id: int):
+    context = _current.get()
+    if context is not None:
+        context.owner_id = owner_id
+
+
+class RequestContextMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _current.set(RequestContext(scope))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
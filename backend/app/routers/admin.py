@@ -0,0 +1,58 @@
+from fastapi import APIRouter, Depends, Query, status
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from ..models import Customer, Invoice, Subscription, User
+from ..schemas import SQLProfileReport, SlowQueryLog, ShardReport, ShardStats
+from .. import sharding
+from ..auth_utils import get_current_admin_user
+from ..config import settings
+from ..profiling import profile_report
+from ..slow_queries import slow_query_log
+
+router = APIRouter()
+
+@router.get("/sql-profile", response_model=SQLProfileReport)
+def read_sql_profile(limit: int = Query(50, ge=0, le=1000), current_user: User = Depends(get_current_admin_user)):
+    """Queries and database time per route and for the most recent profiled requests of this worker."""
+    return SQLProfileReport(
+        enabled=settings.SQL_PROFILING_ENABLED,
+        sample_rate=settings.SQL_PROFILING_SAMPLE_RATE,
+        **profile_report.snapshot(limit),
+    )
+
+@router.delete("/sql-profile", status_code=status.HTTP_204_NO_CONTENT)
+def clear_sql_profile(current_user: User = Depends(get_current_admin_user)):
+    profile_report.clear()
+
+@router.get("/slow-queries", response_model=SlowQueryLog)
+def read_slow_queries(order_by: str = Query("last_seen", pattern="^(last_seen|max_ms|total_ms|count)$"), limit: int = Query(50, ge=1, le=1000),
+                      current_user: User = Depends(get_current_admin_user)):
+    """Statements slower than SLOW_QUERY_THRESHOLD_MS seen by this worker, one per fingerprint."""
+    return SlowQueryLog(threshold_ms=settings.SLOW_QUERY_THRESHOLD_MS, queries=slow_query_log.entries(order_by, limit))
+
+@router.delete("/slow-queries", status_code=status.HTTP_204_NO_CONTENT)
+def clear_slow_queries(current_user: User = Depends(get_current_admin_user)):
+    slow_query_log.clear()
+
+def _shard_stats(db: Session) -> dict:
+    try:
+        return {
+            "tenants": db.query(func.count(func.distinct(Customer.owner_id))).scalar(),
+            "customers": db.query(func.count(Customer.id)).scalar(),
+            "subscriptions": db.query(func.count(Subscription.id)).scalar(),
+            "invoices": db.query(func.count(Invoice.id)).scalar(),
+            "revenue": db.query(func.coalesce(func.sum(Invoice.grand_total), 0.0)).filter(Invoice.status == "paid").scalar(),
+        }
+    except SQLAlchemyError as exc:
+        return {"error": str(getattr(exc, "orig", None) or exc)}
+
+@router.get("/shards", response_model=ShardReport)
+def read_shards(current_user: User = Depends(get_current_admin_user)):
+    """Tenants, row counts and revenue per shard, queried on every shard at once."""
+    shards = [ShardStats(shard=name, **stats) for name, stats in sharding.scatter(_shard_stats).items()]
+    answered = [stats for stats in shards if stats.error is None]
+    totals = ShardStats(shard="all", **{field: sum(getattr(stats, field) for stats in answered)
+                                        for field in ("tenants", "customers", "subscriptions", "invoices", "revenue")})
+    return ShardReport(shards=shards, totals=totals)
@@ -9,6 +9,7 @@ from .. import schemas
 from ..models import User
 from ..auth_utils import get_password_hash, verify_password, create_access_token, get_current_user, get_user_by_username, get_user_by_email
 from ..config import settings
+from .. import sharding
 
 router = APIRouter()
 
@@ -26,6 +27,8 @@ def signup(user: UserCreate, db: Session = Depends(get_db)):
     db_user = User(username=user.username, email=user.email, hashed_password=hashed_password)
     db.add(db_user)
     db.commit()
+    sharding.place_user(db, db_user)
+    db.commit()
     db.refresh(db_user)
     return db_user
 
@@ -40,7 +43,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
         )
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "mode": user.mode}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -0,0 +1,223 @@
+"""
+POST /batch runs several API calls in one round trip. The sub-requests go through the app's routes
+in-process, past the middleware, and share the batch's user and database session: get_current_user
+and get_db take them from the sub-request's scope instead of decoding the token and opening a session.
+
+Consecutive reads (GET, HEAD) don't depend on each other and run concurrently, up to
+BATCH_READ_CONCURRENCY at once. A session can't be used by two threads at a time, so the reads
+beyond the first get a session of their own on the same shard. Other methods run alone and in
+order, so later sub-requests see their effects.
+
+Each sub-request is charged to the caller's rate limit bucket of its own route group, and is turned
+away with 429 on its own when that is empty. It runs with its group's statement timeout, in a
+transaction of its own like a request would.
+"""
+import asyncio
+import logging
+import math
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from starlette.exceptions import HTTPException as StarletteHTTPException
+
+from .. import metrics, models, schemas, statement_timeout
+from ..auth_utils import get_current_user
+from ..config import settings
+from ..database import SessionLocal, get_db
+from ..rate_limit import LONG_LIVED_PATHS, route_group
+from ..sharding import READ_METHODS
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Set by the router for the batch request itself, each sub-request gets its own
+_ROUTE_SCOPE_KEYS = ("endpoint", "route", "path_params", "router", "fastapi_inner_astack", "fastapi_function_astack")
+_DROPPED_RESPONSE_HEADERS = {"content-length", "content-type", "content-encoding", "transfer-encoding"}
+
+
+class _Batch:
+    def __init__(self, request: Request, db: Session, user: models.User):
+        self.request = request
+        self.db = db
+        self.user = user # Detached, see attach_user
+        self.attached_user = None
+        self.extra_sessions = []
+
+    def sessions(self, count: int) -> list:
+        """The shared session plus count - 1 more on its shard, for concurrent reads."""
+        while len(self.extra_sessions) < count - 1:
+            self.extra_sessions.append(SessionLocal(info=dict(self.db.info)))
+        return [self.db, *self.extra_sessions[:count - 1]]
+
+    def attach_user(self, session: Session) -> models.User:
+        """The user merged into the session, for a write sub-request that may change or refresh it."""
+        self.attached_user = session.merge(self.user, load=False)
+        return self.attached_user
+
+    def detach_user(self, session: Session):
+        # After a write: later sub-requests see what it changed on the user (PATCH /auth/users/me)
+        user, self.attached_user = self.attached_user, None
+        if user is None:
+            return
+        try:
+            session.refresh(user)
+            session.expunge(user)
+        except SQLAlchemyError:
+            logger.warning("Couldn't reload the user after a batch sub-request", exc_info=True)
+            session.rollback()
+            return
+        self.user = user
+
+    def close(self):
+        for session in self.extra_sessions:
+            session.close()
+
+    def scope(self, item: schemas.BatchRequestItem, session: Session, body: bytes) -> dict:
+        path, _, query = item.path.partition("?")
+        headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in item.headers.items()
+                   if name.lower() not in ("authorization", "content-length", "content-type", "host")]
+        authorization = self.request.headers.get("authorization")
+        if authorization:
+            headers.append((b"authorization", authorization.encode("latin-1")))
+        if body:
+            headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        scope = {key: value for key, value in self.request.scope.items() if key not in _ROUTE_SCOPE_KEYS}
+        scope.update(
+            method=item.method.upper(),
+            path=path,
+            raw_path=path.encode(),
+            query_string=query.encode(),
+            headers=headers,
+            state=dict(self.request.scope.get("state", {})),
+            batch=self,
+            batch_db=session,
+        )
+        return scope
+
+    async def run(self, item: schemas.BatchRequestItem, session: Session) -> tuple:
+        """(status, headers, body) of one sub-request."""
+        path = item.path.partition("?")[0]
+        if not path.startswith("/") or path.rstrip("/") == "/batch" or path in LONG_LIVED_PATHS:
+            return 400, [], orjson.dumps({"detail": f"{item.path} can't be part of a batch"})
+        group = route_group(item.method.upper(), path)
+        limiter = self.request.scope.get("rate_limiter")
+        if limiter is not None:
+            wait = await limiter.charge(group, *limiter.identity(self.request.scope))
+            if wait:
+                metrics.REQUESTS_REJECTED.labels("rate", group).inc()
+                retry_after = str(max(1, math.ceil(wait))).encode()
+                return 429, [(b"retry-after", retry_after)], orjson.dumps({"detail": "Rate limit exceeded"})
+        body = orjson.dumps(item.body) if item.body is not None else b""
+        # Ends what the previous sub-request left open (and drops anything it didn't commit, as closing a
+        # request's session would), so this one begins a transaction with its own timeout
+        session.rollback()
+        timeout = statement_timeout.set_timeout(limiter.timeouts.get(group) if limiter is not None else None)
+        try:
+            return await _call(self.request.app.router, self.scope(item, session, body), body)
+        except StarletteHTTPException as exc:
+            # The router's 404 and 405, which the exception middleware would render
+            headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in (exc.headers or {}).items()]
+            return exc.status_code, headers, orjson.dumps({"detail": exc.detail})
+        except Exception:
+            logger.exception("Batch sub-request %s %s failed", item.method, item.path)
+            session.rollback()
+            return 500, [], orjson.dumps({"detail": "Internal Server Error"})
+        finally:
+            self.detach_user(session)
+            statement_timeout.reset_timeout(timeout)
+
+
+async def _call(app, scope: dict, body: bytes) -> tuple:
+    """Runs an ASGI request in-process and collects the response."""
+    response = {"status": 500, "headers": [], "body": []}
+    finished = asyncio.Event()
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = message.get("headers", [])
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        finished.set()
+    return response["status"], response["headers"], b"".join(response["body"])
+
+
+def _result(item_id: str, status_code: int, raw_headers: list, body: bytes) -> dict:
+    headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in raw_headers}
+    content_type = headers.get("content-type", "application/json")
+    if not body:
+        content = None
+    elif content_type.startswith("application/json"):
+        content = orjson.Fragment(body) # Already JSON, spliced in as is
+    else:
+        content = body.decode("utf-8", errors="replace")
+    return {
+        "id": item_id,
+        "status": status_code,
+        "headers": {name: value for name, value in headers.items() if name not in _DROPPED_RESPONSE_HEADERS},
+        "body": content,
+    }
+
+
+@router.post("", response_model=schemas.BatchResponse)
+async def run_batch(batch_request: schemas.BatchRequest, request: Request, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """
+    Runs up to BATCH_MAX_REQUESTS API calls with the caller's token and returns their responses in order.
+    Each sub-request succeeds or fails on its own; writes are not rolled back when a later one fails.
+    """
+    items = batch_request.requests
+    if len(items) > settings.BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {settings.BATCH_MAX_REQUESTS} requests per batch")
+    # Detached, so commits of the sub-requests don't expire it while concurrent reads use it. Writes, which
+    # run alone, get it merged back into the session
+    db.expunge(current_user)
+    batch = _Batch(request, db, current_user)
+    results: list = [None] * len(items)
+
+    async def run_reads(indexes: list):
+        sessions = asyncio.Queue()
+        for session in batch.sessions(min(len(indexes), max(settings.BATCH_READ_CONCURRENCY, 1))):
+            sessions.put_nowait(session)
+
+        async def run_read(index: int):
+            session = await sessions.get()
+            try:
+                results[index] = await batch.run(items[index], session)
+            finally:
+                sessions.put_nowait(session)
+
+        await asyncio.gather(*(run_read(index) for index in indexes))
+
+    try:
+        reads: list = []
+        for index, item in enumerate(items):
+            if item.method.upper() in READ_METHODS:
+                reads.append(index)
+                continue
+            if reads:
+                await run_reads(reads)
+                reads = []
+            results[index] = await batch.run(item, db)
+        if reads:
+            await run_reads(reads)
+    finally:
+        batch.close()
+
+    responses = [_result(item.id if item.id is not None else str(index), *results[index]) for index, item in enumerate(items)]
+    return Response(orjson.dumps({"responses": responses}), media_type="application/json")
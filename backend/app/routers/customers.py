@@ -1,12 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
-from .. import models, schemas
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, UploadFile, File, status
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, joinedload
+from typing import List, Optional
+from .. import customer_import, jobs, models, schemas, sharding # customer_import registers its job
 from ..database import get_db
 from ..auth_utils import get_current_user, get_password_hash
+from ..cache import versions, collection_etag, check_etag
+from ..serialization import json_response
+import codecs
 import secrets
 import string
 
+UPLOAD_CHUNK_SIZE = 1 << 20
+
 router = APIRouter(
     prefix="/customers",
     tags=["customers"],
@@ -14,18 +20,45 @@ router = APIRouter(
 )
 
 @router.get("/", response_model=List[schemas.Customer])
-def read_customers(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def read_customers(request: Request, response: Response, skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    not_modified = check_etag(request, response, collection_etag(current_user.id, "customers", skip, limit))
+    if not_modified:
+        return not_modified
     customers = db.query(models.Customer).filter(models.Customer.owner_id == current_user.id).offset(skip).limit(limit).all()
-    return customers
+    return json_response(List[schemas.Customer], customers, response)
 
 @router.post("/", response_model=schemas.Customer, status_code=status.HTTP_201_CREATED)
 def create_customer(customer: schemas.CustomerCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    db_customer = models.Customer(**customer.dict(), owner_id=current_user.id)
+    db_customer = models.Customer(**customer.model_dump(), owner_id=current_user.id)
     db.add(db_customer)
     db.commit()
     db.refresh(db_customer)
+    versions.bump(current_user.id, "customers")
     return db_customer
 
+@router.post("/import", response_model=schemas.Job, status_code=status.HTTP_202_ACCEPTED)
+def import_customers_file(file: UploadFile = File(...), format: Optional[str] = Query(None, pattern="^(csv|jsonl)$"), db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """
+    Bulk import from a CSV (name,email columns) or JSON lines file, deduplicated by email.
+    The format follows the file extension unless given. The import runs as a background job,
+    follow it at /jobs/{id}; its result has the inserted, updated and skipped counts.
+    """
+    fmt = format or ("jsonl" if (file.filename or "").lower().endswith((".jsonl", ".ndjson")) else "csv")
+    decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def chunks():
+        # Spooled as it comes in, checking it decodes on the way
+        while chunk := file.file.read(UPLOAD_CHUNK_SIZE):
+            decoder.decode(chunk)
+            yield chunk
+        decoder.decode(b"", final=True)
+
+    try:
+        upload = jobs.spool(chunks())
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="The file is not UTF-8 text")
+    return jobs.enqueue(db, current_user.id, "customer_import", {"format": fmt, "filename": file.filename, "upload": upload})
+
 @router.get("/{customer_id}", response_model=schemas.Customer)
 def read_customer(customer_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     customer = db.query(models.Customer).filter(models.Customer.id == customer_id, models.Customer.owner_id == current_user.id).first()
@@ -33,6 +66,66 @@ def read_customer(customer_id: int, db: Session = Depends(get_db), current_user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Customer not found")
     return customer
 
+@router.get("/{customer_id}/overview", response_model=schemas.CustomerOverview)
+def read_customer_overview(
+    customer_id: int,
+    subscriptions_limit: int = Query(20, ge=1, le=100),
+    invoices_limit: int = Query(10, ge=1, le=100),
+    payments_limit: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Everything the customer page needs in 4 queries, however long the customer's history is."""
+    Invoice, Payment, Subscription = models.Invoice, models.Payment, models.Subscription
+
+    def invoice_total(*criteria):
+        return select(func.coalesce(func.sum(Invoice.grand_total), 0.0))\
+            .where(Invoice.customer_id == models.Customer.id, *criteria).scalar_subquery()
+
+    def count(model, *criteria):
+        return select(func.count()).select_from(model).where(*criteria).scalar_subquery()
+
+    # 1: the customer and its aggregates
+    row = db.query(
+        models.Customer,
+        invoice_total(Invoice.status != "paid").label("outstanding_balance"),
+        invoice_total(Invoice.status == "paid").label("lifetime_value"),
+        count(Subscription, Subscription.customer_id == models.Customer.id).label("subscription_count"),
+        count(Invoice, Invoice.customer_id == models.Customer.id).label("invoice_count"),
+        count(Payment, Payment.invoice_id == Invoice.id, Invoice.customer_id == models.Customer.id).label("payment_count"),
+    ).filter(models.Customer.id == customer_id, models.Customer.owner_id == current_user.id).first()
+    if row is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Customer not found")
+
+    # 2: subscriptions with their lines and line taxes in one joined query
+    subscriptions = db.query(Subscription)\
+        .options(joinedload(Subscription.subscription_lines).joinedload(models.SubscriptionLine.taxes))\
+        .filter(Subscription.customer_id == customer_id)\
+        .order_by(Subscription.created_at.desc(), Subscription.id.desc())\
+        .limit(subscriptions_limit).all()
+
+    # 3 and 4: the latest invoices and payments, without their nested collections
+    invoices = db.query(Invoice)\
+        .filter(Invoice.customer_id == customer_id)\
+        .order_by(Invoice.issue_date.desc(), Invoice.id.desc())\
+        .limit(invoices_limit).all()
+    payments = db.query(Payment).join(Invoice)\
+        .filter(Invoice.customer_id == customer_id)\
+        .order_by(Payment.payment_date.desc(), Payment.id.desc())\
+        .limit(payments_limit).all()
+
+    return schemas.CustomerOverview(
+        customer=schemas.Customer.model_validate(row[0], from_attributes=True),
+        outstanding_balance=row.outstanding_balance,
+        lifetime_value=row.lifetime_value,
+        subscription_count=row.subscription_count,
+        invoice_count=row.invoice_count,
+        payment_count=row.payment_count,
+        subscriptions=[schemas.Subscription.model_validate(subscription, from_attributes=True) for subscription in subscriptions],
+        recent_invoices=[schemas.InvoiceSummary.model_validate(invoice, from_attributes=True) for invoice in invoices],
+        recent_payments=[schemas.Payment.model_validate(payment, from_attributes=True) for payment in payments],
+    )
+
 @router.post("/{customer_id}/invite", response_model=schemas.CustomerInviteResponse)
 def invite_customer(customer_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     customer = db.query(models.Customer).filter(models.Customer.id == customer_id, models.Customer.owner_id == current_user.id).first()
@@ -80,9 +173,12 @@ def invite_customer(customer_id: int, db: Session = Depends(get_db), current_use
         db.commit()
         db.refresh(portal_user)
 
-    # Link to Customer
+    # Same shard as its owner, then link to Customer
+    sharding.place_user(db, portal_user, owner_id=current_user.id)
     customer.portal_user_id = portal_user.id
     db.commit()
+    versions.bump(current_user.id, "customers")
+    versions.bump(current_user.id, "invoices") # Invoices embed their customer
 
     return {
         "username": username,
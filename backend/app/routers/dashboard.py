@@ -1,33 +1,46 @@
+import asyncio
+import json
+import threading
+
 from fastapi import APIRouter, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 
+from ..config import settings
 from ..database import get_db
+from ..events import broker
 from ..models import Subscription as DBSubscription, Invoice as DBInvoice, Customer as DBCustomer, User as DBUser
 from ..auth_utils import get_current_user
+from .. import sharding
 
 router = APIRouter()
 
-@router.get("/stats", tags=["dashboard"])
-def get_dashboard_stats(db: Session = Depends(get_db), current_user: DBUser = Depends(get_current_user)):
+# owner_id -> (broker generation, stats) so several open dashboards of one owner share a recompute.
+# Only for owners with a stream open, the last one to close drops the entry
+_stats_cache = {}
+_stats_lock = threading.Lock()
+
+def compute_dashboard_stats(db: Session, owner_id: int) -> dict:
     # Join with Customer to filter by owner_id
     active_subscriptions = db.query(DBSubscription)\
         .join(DBCustomer)\
-        .filter(DBCustomer.owner_id == current_user.id)\
+        .filter(DBCustomer.owner_id == owner_id)\
         .filter(DBSubscription.status == "active")\
         .count()
-    
+
     total_revenue_result = db.query(func.sum(DBInvoice.grand_total))\
         .join(DBCustomer)\
-        .filter(DBCustomer.owner_id == current_user.id)\
+        .filter(DBCustomer.owner_id == owner_id)\
         .filter(DBInvoice.status == "paid")\
         .scalar()
-        
+
     total_revenue = float(total_revenue_result) if total_revenue_result is not None else 0.0
 
     unpaid_invoices = db.query(DBInvoice)\
         .join(DBCustomer)\
-        .filter(DBCustomer.owner_id == current_user.id)\
+        .filter(DBCustomer.owner_id == owner_id)\
         .filter(DBInvoice.status != "paid")\
         .count()
 
@@ -36,3 +49,72 @@ def get_dashboard_stats(db: Session = Depends(get_db), current_user: DBUser = De
         "total_revenue": total_revenue,
         "unpaid_invoices": unpaid_invoices
     }
+
+def _load_stats(owner_id: int) -> dict:
+    """Loads stats in a short-lived session, reusing the last result if nothing changed since."""
+    generation = broker.generation(owner_id)
+    cached = _stats_cache.get(owner_id)
+    if cached and cached[0] == generation:
+        return cached[1]
+
+    db = sharding.session_for(owner_id)
+    try:
+        stats = compute_dashboard_stats(db, owner_id)
+    finally:
+        db.close()
+    with _stats_lock:
+        if broker.listening(owner_id):
+            _stats_cache[owner_id] = (generation, stats)
+    return stats
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.get("/stats", tags=["dashboard"])
+def get_dashboard_stats(db: Session = Depends(get_db), current_user: DBUser = Depends(get_current_user)):
+    return compute_dashboard_stats(db, current_user.id)
+
+@router.get("/stream", tags=["dashboard"])
+async def stream_dashboard_stats(db: Session = Depends(get_db), current_user: DBUser = Depends(get_current_user)):
+    """
+    Server-Sent Events stream of dashboard stats.
+    Sends a full `stats` event on connect, then `delta` events with only the changed keys
+    whenever the owner's subscriptions, invoices or payments change.
+    """
+    owner_id = current_user.id
+    # Give the pooled connection back right away, an idle stream must not hold one
+    await run_in_threadpool(db.close)
+
+    async def event_stream():
+        listener = broker.subscribe(owner_id)
+        try:
+            stats = await run_in_threadpool(_load_stats, owner_id)
+            yield _sse("stats", stats)
+            while True:
+                try:
+                    await asyncio.wait_for(listener.wait(), timeout=settings.DASHBOARD_STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+
+                # Coalesce bursts of writes (e.g. confirm creates a subscription change and an invoice) into one recompute
+                await asyncio.sleep(settings.DASHBOARD_STREAM_COALESCE_SECONDS)
+                listener.event.clear()
+                listener.topics.clear()
+
+                new_stats = await run_in_threadpool(_load_stats, owner_id)
+                delta = {key: value for key, value in new_stats.items() if stats.get(key) != value}
+                stats = new_stats
+                if delta:
+                    yield _sse("delta", delta)
+        finally:
+            broker.unsubscribe(owner_id, listener)
+            with _stats_lock:
+                if not broker.listening(owner_id):
+                    _stats_cache.pop(owner_id, None)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -7,6 +7,7 @@ from ..database import get_db
 from ..models import Discount as DBDiscount, User
 from ..schemas import Discount, DiscountCreate
 from ..auth_utils import get_current_user
+from ..cache import catalog_cache, versions
 
 router = APIRouter()
 
@@ -24,16 +25,17 @@ def create_discount(discount: DiscountCreate, db: Session = Depends(get_db), cur
     db.add(db_discount)
     db.commit()
     db.refresh(db_discount)
+    versions.bump(current_user.id, "discounts")
     return db_discount
 
 @router.get("/discounts/", response_model=List[Discount])
 def read_discounts(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    discounts = db.query(DBDiscount).filter(DBDiscount.owner_id == current_user.id).offset(skip).limit(limit).all()
+    discounts = catalog_cache.list(db, current_user.id, "discounts", skip, limit)
     return discounts
 
 @router.get("/discounts/{discount_id}", response_model=Discount)
 def read_discount(discount_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    discount = db.query(DBDiscount).filter(DBDiscount.id == discount_id, DBDiscount.owner_id == current_user.id).first()
+    discount = catalog_cache.get(db, current_user.id, "discounts").get(discount_id)
     if discount is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Discount not found")
     return discount
@@ -53,6 +55,7 @@ def update_discount(discount_id: int, discount: DiscountCreate, db: Session = De
     
     db.commit()
     db.refresh(db_discount)
+    versions.bump(current_user.id, "discounts")
     return db_discount
 
 @router.delete("/discounts/{discount_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -62,4 +65,5 @@ def delete_discount(discount_id: int, db: Session = Depends(get_db), current_use
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Discount not found")
     db.delete(db_discount)
     db.commit()
+    versions.bump(current_user.id, "discounts")
     return {"ok": True}
\ No newline at end of file
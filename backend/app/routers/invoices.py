@@ -1,27 +1,50 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from datetime import date, datetime
 
 from ..database import get_db
 from ..models import Invoice as DBInvoice, InvoiceLine as DBInvoiceLine, User, Customer as DBCustomer
 from ..schemas import Invoice as SchemaInvoice, InvoiceLine as SchemaInvoiceLine, InvoicePay
 from ..auth_utils import get_current_user
+from ..config import settings
+from ..cache import versions, collection_etag, check_etag
+from .. import metrics
+from ..serialization import json_response
+from ..fieldsets import Fieldset, SparseFields
 
 router = APIRouter()
 
+invoice_fields = SparseFields(SchemaInvoice, DBInvoice, required=("customer_id", "status"))
+
 @router.get("/", response_model=List[SchemaInvoice], tags=["invoices"])
-def read_invoices(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def read_invoices(request: Request, response: Response, skip: int = 0, limit: int = 100, issued_from: Optional[date] = None, issued_to: Optional[date] = None, fieldset: Fieldset = Depends(invoice_fields), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    Lists invoices, optionally within an issue date window (inclusive). The window lets a partitioned table skip old partitions.
+    `fields` / `include` select what is returned, e.g. ?fields=invoice_number,status,grand_total&include=payments
+    """
     if current_user.mode == 'portal':
-        invoices = db.query(DBInvoice).join(DBCustomer).filter(DBCustomer.portal_user_id == current_user.id).offset(skip).limit(limit).all()
+        query = db.query(DBInvoice).join(DBCustomer).filter(DBCustomer.portal_user_id == current_user.id)
     else:
+        not_modified = check_etag(request, response, collection_etag(current_user.id, "invoices", skip, limit, issued_from, issued_to, *fieldset.cache_key()))
+        if not_modified:
+            return not_modified
         # Filter invoices where the customer is owned by the current user
-        invoices = db.query(DBInvoice).join(DBCustomer).filter(DBCustomer.owner_id == current_user.id).offset(skip).limit(limit).all()
-    return invoices
+        query = db.query(DBInvoice).join(DBCustomer).filter(DBCustomer.owner_id == current_user.id)
+    if issued_from:
+        query = query.filter(DBInvoice.issue_date >= issued_from)
+    if issued_to:
+        query = query.filter(DBInvoice.issue_date <= issued_to)
+    return json_response(List[fieldset.schema], query.options(*fieldset.options()).offset(skip).limit(limit).all(), response)
 
 @router.get("/{invoice_id}", response_model=SchemaInvoice, tags=["invoices"])
-def read_invoice(invoice_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    invoice = db.query(DBInvoice).join(DBCustomer).filter(DBInvoice.id == invoice_id).first()
+def read_invoice(invoice_id: int, request: Request, response: Response, fieldset: Fieldset = Depends(invoice_fields), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if current_user.mode != 'portal':
+        not_modified = check_etag(request, response, collection_etag(current_user.id, "invoices", invoice_id, *fieldset.cache_key()))
+        if not_modified:
+            return not_modified
+
+    invoice = db.query(DBInvoice).join(DBCustomer).options(*fieldset.options()).filter(DBInvoice.id == invoice_id).first()
     if not invoice:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Invoice not found")
     
@@ -31,8 +54,11 @@ def read_invoice(invoice_id: int, db: Session = Depends(get_db), current_user: U
              raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Invoice not found")
     elif invoice.customer.owner_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Invoice not found")
-        
-    return invoice
+
+    if invoice.status == "paid" and settings.PAID_INVOICE_MAX_AGE_SECONDS > 0:
+        # The amounts are final, but the embedded customer and payments can still change: keep it short, then revalidate
+        response.headers["Cache-Control"] = f"private, max-age={settings.PAID_INVOICE_MAX_AGE_SECONDS}, must-revalidate"
+    return json_response(fieldset.schema, invoice, response)
 
 @router.patch("/{invoice_id}/pay", response_model=SchemaInvoice, tags=["invoices"])
 def pay_invoice(invoice_id: int, payment_data: InvoicePay, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
@@ -68,4 +94,7 @@ def pay_invoice(invoice_id: int, payment_data: InvoicePay, db: Session = Depends
 
     db.commit()
     db.refresh(invoice)
+    versions.bump(invoice.customer.owner_id, "invoices")
+    versions.bump(invoice.customer.owner_id, "payments")
+    metrics.record_payment(new_payment.method, new_payment.amount)
     return invoice
@@ -0,0 +1,50 @@
+import os
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+
+from .. import jobs, models, schemas
+from ..database import get_db
+from ..auth_utils import get_current_user
+
+router = APIRouter()
+
+def _owned_job(db: Session, job_id: int, current_user: models.User) -> models.Job:
+    job = db.query(models.Job).filter(models.Job.id == job_id, models.Job.owner_id == current_user.id).first()
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
+@router.get("/", response_model=List[schemas.Job])
+def read_jobs(status_filter: Optional[str] = Query(None, alias="status"), kind: Optional[str] = None, skip: int = 0, limit: int = Query(50, ge=1, le=500),
+              db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """The user's jobs, newest first."""
+    query = db.query(models.Job).filter(models.Job.owner_id == current_user.id)
+    if status_filter:
+        query = query.filter(models.Job.status == status_filter)
+    if kind:
+        query = query.filter(models.Job.kind == kind)
+    return query.order_by(models.Job.id.desc()).offset(skip).limit(limit).all()
+
+@router.get("/{job_id}", response_model=schemas.Job)
+def read_job(job_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    return _owned_job(db, job_id, current_user)
+
+@router.post("/{job_id}/cancel", response_model=schemas.Job)
+def cancel_job(job_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """A queued job is cancelled at once, a running one stops at its next progress report."""
+    return jobs.cancel(db, _owned_job(db, job_id, current_user))
+
+@router.get("/{job_id}/output")
+def read_job_output(job_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """The file a finished job produced, e.g. a report export."""
+    job = _owned_job(db, job_id, current_user)
+    if job.status != "succeeded":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"The job is {job.status}")
+    path = jobs.output_path(job)
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="This job has no output")
+    filename = (job.result or {}).get("filename") or f"job-{job.id}"
+    return FileResponse(path, media_type=job.output_type or "application/octet-stream", filename=filename)
@@ -1,12 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from datetime import datetime, date # Import date
+from datetime import datetime, date, timedelta # Import date
 
 from ..database import get_db
 from ..models import Payment as DBPayment, Invoice as DBInvoice, User, Customer as DBCustomer
 from ..schemas import Payment, PaymentCreate, PaymentBase, InvoiceUpdate, Invoice # Import Invoice
 from ..auth_utils import get_current_user
+from ..cache import versions
+from .. import metrics
+from ..serialization import json_response
 
 router = APIRouter()
 
@@ -27,12 +30,20 @@ def create_payment(payment: PaymentCreate, db: Session = Depends(get_db), curren
     db.add(db_payment)
     db.commit()
     db.refresh(db_payment)
+    versions.bump(current_user.id, "payments")
+    versions.bump(current_user.id, "invoices") # Invoices embed their payments
+    metrics.record_payment(db_payment.method, db_payment.amount)
     return db_payment
 
 @router.get("/payments/", response_model=List[Payment])
-def read_payments(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    payments = db.query(DBPayment).join(DBInvoice).join(DBCustomer).filter(DBCustomer.owner_id == current_user.id).offset(skip).limit(limit).all()
-    return payments
+def read_payments(skip: int = 0, limit: int = 100, paid_from: Optional[date] = None, paid_to: Optional[date] = None, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Lists payments, optionally within a payment date window (inclusive). The window lets a partitioned table skip old partitions."""
+    query = db.query(DBPayment).join(DBInvoice).join(DBCustomer).filter(DBCustomer.owner_id == current_user.id)
+    if paid_from:
+        query = query.filter(DBPayment.payment_date >= paid_from)
+    if paid_to:
+        query = query.filter(DBPayment.payment_date < paid_to + timedelta(days=1))
+    return json_response(List[Payment], query.offset(skip).limit(limit).all())
 
 @router.get("/payments/{payment_id}", response_model=Payment)
 def read_payment(payment_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
@@ -64,6 +75,9 @@ def simulate_payment(payment_details: PaymentBase, db: Session = Depends(get_db)
     db.add(db_payment)
     db.commit()
     db.refresh(db_payment)
+    versions.bump(current_user.id, "payments")
+    versions.bump(current_user.id, "invoices") # Invoices embed their payments
+    metrics.record_payment(db_payment.method, db_payment.amount)
 
     # Optional: Update invoice status to 'paid' if amount matches grand_total, etc.
     # This logic would be part of a more robust payment processing flow.
@@ -78,11 +92,13 @@ def update_payment(payment_id: int, payment_update: PaymentCreate, db: Session =
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Payment not found")
     
     # Update fields
-    for key, value in payment_update.dict(exclude_unset=True).items():
+    for key, value in payment_update.model_dump(exclude_unset=True).items():
         setattr(db_payment, key, value)
     
     db.commit()
     db.refresh(db_payment)
+    versions.bump(current_user.id, "payments")
+    versions.bump(current_user.id, "invoices") # Invoices embed their payments
     return db_payment
 
 @router.delete("/payments/{payment_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -92,4 +108,6 @@ def delete_payment(payment_id: int, db: Session = Depends(get_db), current_user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Payment not found")
     db.delete(db_payment)
     db.commit()
+    versions.bump(current_user.id, "payments")
+    versions.bump(current_user.id, "invoices") # Invoices embed their payments
     return {"ok": True}
\ No newline at end of file
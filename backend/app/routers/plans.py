@@ -1,19 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from sqlalchemy.orm import Session
 from typing import List
 
 from ..database import get_db
-from ..models import Plan as DBPlan, Product as DBProduct, User
+from ..models import Plan as DBPlan, User
 from ..schemas import Plan, PlanCreate
 from ..auth_utils import get_current_user
+from ..cache import catalog_cache, versions, collection_etag, check_etag
 
 router = APIRouter()
 
 @router.post("/", response_model=Plan, status_code=status.HTTP_201_CREATED)
 def create_plan(plan: PlanCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     # Validate product ownership
-    product = db.query(DBProduct).filter(DBProduct.id == plan.product_id, DBProduct.owner_id == current_user.id).first()
-    if not product:
+    if plan.product_id not in catalog_cache.get(db, current_user.id, "products"):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Associated product not found")
 
     db_plan = DBPlan(
@@ -32,16 +32,20 @@ def create_plan(plan: PlanCreate, db: Session = Depends(get_db), current_user: U
     db.add(db_plan)
     db.commit()
     db.refresh(db_plan)
+    versions.bump(current_user.id, "plans")
     return db_plan
 
 @router.get("/", response_model=List[Plan])
-def read_plans(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    plans = db.query(DBPlan).filter(DBPlan.owner_id == current_user.id).offset(skip).limit(limit).all()
+def read_plans(request: Request, response: Response, skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    not_modified = check_etag(request, response, collection_etag(current_user.id, "plans", skip, limit))
+    if not_modified:
+        return not_modified
+    plans = catalog_cache.list(db, current_user.id, "plans", skip, limit)
     return plans
 
 @router.get("/{plan_id}", response_model=Plan)
 def read_plan(plan_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    plan = db.query(DBPlan).filter(DBPlan.id == plan_id, DBPlan.owner_id == current_user.id).first()
+    plan = catalog_cache.get(db, current_user.id, "plans").get(plan_id)
     if plan is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Plan not found")
     return plan
@@ -65,6 +69,7 @@ def update_plan(plan_id: int, plan: PlanCreate, db: Session = Depends(get_db), c
     
     db.commit()
     db.refresh(db_plan)
+    versions.bump(current_user.id, "plans")
     return db_plan
 
 @router.delete("/{plan_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -75,4 +80,5 @@ def delete_plan(plan_id: int, db: Session = Depends(get_db), current_user: User
     
     db.delete(db_plan)
     db.commit()
+    versions.bump(current_user.id, "plans")
     return {"ok": True}
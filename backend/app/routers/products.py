@@ -1,11 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, UploadFile, File, status
 from sqlalchemy.orm import Session
 from typing import List
+import io
 
 from ..database import get_db
 from ..models import Product as DBProduct, User
-from ..schemas import Product, ProductCreate
+from ..schemas import Product, ProductCreate, CatalogProductImport, CatalogImportResult
 from ..auth_utils import get_current_user
+from ..cache import catalog_cache, versions, collection_etag, check_etag
+from ..catalog_import import upsert_catalog, parse_catalog_csv
 
 router = APIRouter()
 
@@ -22,16 +25,41 @@ def create_product(product: ProductCreate, db: Session = Depends(get_db), curren
     db.add(db_product)
     db.commit()
     db.refresh(db_product)
+    versions.bump(current_user.id, "products")
     return db_product
 
+def _import_catalog(db: Session, owner_id: int, catalog: List[CatalogProductImport]) -> CatalogImportResult:
+    result = upsert_catalog(db, owner_id, catalog)
+    db.commit()
+    versions.bump(owner_id, "products")
+    versions.bump(owner_id, "plans")
+    return result
+
+@router.post("/import", response_model=CatalogImportResult)
+def import_catalog(catalog: List[CatalogProductImport], db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Bulk upsert of products and their plans in a single transaction."""
+    return _import_catalog(db, current_user.id, catalog)
+
+@router.post("/import/csv", response_model=CatalogImportResult)
+def import_catalog_csv(file: UploadFile = File(...), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Same as /import, from a CSV with one row per plan (see app/catalog_import.py for the columns)."""
+    try:
+        catalog = parse_catalog_csv(io.TextIOWrapper(file.file, encoding="utf-8-sig"))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    return _import_catalog(db, current_user.id, catalog)
+
 @router.get("/", response_model=List[Product])
-def read_products(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    products = db.query(DBProduct).filter(DBProduct.owner_id == current_user.id).offset(skip).limit(limit).all()
+def read_products(request: Request, response: Response, skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    not_modified = check_etag(request, response, collection_etag(current_user.id, "products", skip, limit))
+    if not_modified:
+        return not_modified
+    products = catalog_cache.list(db, current_user.id, "products", skip, limit)
     return products
 
 @router.get("/{product_id}", response_model=Product)
 def read_product(product_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    product = db.query(DBProduct).filter(DBProduct.id == product_id, DBProduct.owner_id == current_user.id).first()
+    product = catalog_cache.get(db, current_user.id, "products").get(product_id)
     if product is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
     return product
@@ -50,6 +78,7 @@ def update_product(product_id: int, product: ProductCreate, db: Session = Depend
     
     db.commit()
     db.refresh(db_product)
+    versions.bump(current_user.id, "products")
     return db_product
 
 @router.delete("/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -60,4 +89,5 @@ def delete_product(product_id: int, db: Session = Depends(get_db), current_user:
     
     db.delete(db_product)
     db.commit()
+    versions.bump(current_user.id, "products")
     return {"ok": True}
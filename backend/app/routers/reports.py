@@ -0,0 +1,136 @@
+import csv
+import io
+from datetime import date, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, func, case, or_
+from sqlalchemy.orm import Session
+
+from ..database import get_db
+from ..models import Invoice as DBInvoice, Customer as DBCustomer, User
+from ..schemas import ARAgingReport, ARAgingBuckets, ARAgingCustomer, Job
+from ..auth_utils import get_current_user
+from .. import jobs, sharding
+
+router = APIRouter()
+
+AGING_BUCKETS = ("current", "days_1_30", "days_31_60", "days_61_90", "days_over_90")
+
+def _bucket_conditions(as_of: date) -> list:
+    # Compare due_date to cutoff dates instead of computing days overdue per row:
+    # portable across databases and usable by the (customer_id, due_date) index
+    due = DBInvoice.due_date
+    d30, d60, d90 = (as_of - timedelta(days=days) for days in (30, 60, 90))
+    return [
+        or_(due.is_(None), due >= as_of),
+        (due < as_of) & (due >= d30),
+        (due < d30) & (due >= d60),
+        (due < d60) & (due >= d90),
+        due < d90,
+    ]
+
+def ar_aging_query(owner_id: int, as_of: date, with_totals: bool = False):
+    """
+    Unpaid invoice amounts per customer and aging bucket, as one grouped aggregation.
+    with_totals adds window columns (total_<bucket>, customer_count) with the sums over all customers,
+    so a limited page still carries the report totals.
+    """
+    sums = [func.sum(case((condition, DBInvoice.grand_total), else_=0.0)) for condition in _bucket_conditions(as_of)]
+    grand_total = func.sum(DBInvoice.grand_total)
+    columns = [DBCustomer.id.label("customer_id"), DBCustomer.name.label("customer_name"), func.count().label("invoice_count")]
+    columns += [func.coalesce(expr, 0.0).label(name) for name, expr in zip(AGING_BUCKETS, sums)]
+    columns.append(func.coalesce(grand_total, 0.0).label("total"))
+    if with_totals:
+        columns += [func.coalesce(func.sum(expr).over(), 0.0).label(f"total_{name}") for name, expr in zip(AGING_BUCKETS, sums)]
+        columns += [func.coalesce(func.sum(grand_total).over(), 0.0).label("total_total"), func.count().over().label("customer_count")]
+
+    return select(*columns)\
+        .join(DBInvoice, DBInvoice.customer_id == DBCustomer.id)\
+        .where(DBCustomer.owner_id == owner_id, DBInvoice.status != "paid")\
+        .group_by(DBCustomer.id, DBCustomer.name)\
+        .order_by(grand_total.desc(), DBCustomer.id)
+
+@router.get("/ar-aging", response_model=ARAgingReport)
+def read_ar_aging(as_of: Optional[date] = None, skip: int = 0, limit: int = Query(100, ge=1, le=1000), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Accounts-receivable aging by customer, largest balances first. Totals cover all customers, not just this page."""
+    as_of = as_of or date.today()
+    query = ar_aging_query(current_user.id, as_of, with_totals=True)
+    rows = db.execute(query.offset(skip).limit(limit)).all()
+    # Past the last page there is no row to read the totals from
+    first = rows[0] if rows else (db.execute(query.limit(1)).first() if skip else None)
+    if first:
+        totals = ARAgingBuckets(**{name: round(getattr(first, f"total_{name}"), 2) for name in (*AGING_BUCKETS, "total")})
+        customer_count = first.customer_count
+    else:
+        totals, customer_count = ARAgingBuckets(), 0
+    customers = [
+        ARAgingCustomer(
+            customer_id=row.customer_id,
+            customer_name=row.customer_name or "",
+            invoice_count=row.invoice_count,
+            **{name: round(getattr(row, name), 2) for name in (*AGING_BUCKETS, "total")},
+        )
+        for row in rows
+    ]
+    return ARAgingReport(as_of=as_of, totals=totals, customer_count=customer_count, customers=customers)
+
+def stream_ar_aging_csv(owner_id: int, as_of: date, chunk_size: int = 1000):
+    """CSV lines of the aging report, fetched and written chunk by chunk, ending with a TOTAL row."""
+    db = sharding.session_for(owner_id)
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["customer_id", "customer_name", "invoice_count", *AGING_BUCKETS, "total"])
+        totals = [0.0] * (len(AGING_BUCKETS) + 1)
+        invoice_count = 0
+        result = db.execute(ar_aging_query(owner_id, as_of).execution_options(yield_per=chunk_size))
+        for chunk in result.partitions():
+            for row in chunk:
+                amounts = [getattr(row, name) for name in (*AGING_BUCKETS, "total")]
+                totals = [total + amount for total, amount in zip(totals, amounts)]
+                invoice_count += row.invoice_count
+                writer.writerow([row.customer_id, row.customer_name, row.invoice_count, *(f"{amount:.2f}" for amount in amounts)])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        writer.writerow(["", "TOTAL", invoice_count, *(f"{amount:.2f}" for amount in totals)])
+        yield buffer.getvalue()
+    finally:
+        db.close()
+
+@router.get("/ar-aging.csv")
+def export_ar_aging(as_of: Optional[date] = None, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """The full aging report as a streamed CSV download."""
+    as_of = as_of or date.today()
+    owner_id = current_user.id
+    # The export reads through its own session, don't hold the request's connection while streaming
+    db.close()
+    return StreamingResponse(
+        stream_ar_aging_csv(owner_id, as_of),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="ar-aging-{as_of.isoformat()}.csv"'},
+    )
+
+@jobs.job("ar_aging_export")
+def run_ar_aging_export(ctx: jobs.JobContext) -> dict:
+    """The aging report CSV, streamed to the job's output file."""
+    as_of = date.fromisoformat(ctx.params["as_of"])
+    lines = 0
+
+    def chunks():
+        nonlocal lines
+        for chunk in stream_ar_aging_csv(ctx.owner_id, as_of):
+            yield chunk
+            lines += chunk.count("\n")
+            ctx.progress(message=f"{max(lines - 1, 0)} lines written")
+
+    ctx.write_output(chunks(), "text/csv")
+    return {"filename": f"ar-aging-{as_of.isoformat()}.csv", "customers": max(lines - 2, 0)}
+
+@router.post("/ar-aging/export", response_model=Job, status_code=status.HTTP_202_ACCEPTED)
+def queue_ar_aging_export(as_of: Optional[date] = None, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Builds the aging report CSV in the background, download it from /jobs/{id}/output once the job succeeded."""
+    as_of = as_of or date.today()
+    return jobs.enqueue(db, current_user.id, "ar_aging_export", {"as_of": as_of.isoformat()})
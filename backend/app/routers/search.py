@@ -0,0 +1,61 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select, union_all, literal, case, func
+from sqlalchemy.orm import Session
+from typing import List
+
+from ..database import get_db
+from ..models import Customer as DBCustomer, Product as DBProduct, Plan as DBPlan, Subscription as DBSubscription, Invoice as DBInvoice, User
+from ..schemas import SearchResult
+from ..auth_utils import get_current_user
+from ..search_index import search_index_cache
+
+router = APIRouter()
+
+def _like_pattern(q: str, anywhere: bool) -> str:
+    escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%" if anywhere else f"{escaped}%"
+
+def _search_postgres(db: Session, owner_id: int, q: str, limit: int) -> list:
+    # Trigram indexes can only serve patterns with at least 3 characters, shorter queries match by prefix
+    pattern = _like_pattern(q, anywhere=len(q) >= 3)
+    prefix = _like_pattern(q, anywhere=False)
+
+    def ranked(kind, id_col, label_col, detail_col, *criteria, join=None, search_detail=False):
+        matched = label_col.ilike(pattern, escape="\\")
+        if search_detail:
+            matched = matched | detail_col.ilike(pattern, escape="\\")
+        stmt = select(
+            literal(kind).label("type"),
+            id_col.label("id"),
+            label_col.label("label"),
+            detail_col.label("detail"),
+        )
+        if join is not None:
+            stmt = stmt.join(join)
+        stmt = stmt.where(matched, *criteria)\
+            .order_by(case((label_col.ilike(prefix, escape="\\"), 0), else_=1), func.length(label_col))\
+            .limit(limit)
+        return select(stmt.subquery())
+
+    # One round trip for all entity types
+    stmt = union_all(
+        ranked("customer", DBCustomer.id, DBCustomer.name, DBCustomer.email, DBCustomer.owner_id == owner_id, search_detail=True),
+        ranked("product", DBProduct.id, DBProduct.name, DBProduct.type, DBProduct.owner_id == owner_id),
+        ranked("plan", DBPlan.id, DBPlan.name, DBPlan.billing_period, DBPlan.owner_id == owner_id),
+        ranked("subscription", DBSubscription.id, DBSubscription.subscription_number, DBCustomer.name, DBCustomer.owner_id == owner_id, join=DBCustomer),
+        ranked("invoice", DBInvoice.id, DBInvoice.invoice_number, DBCustomer.name, DBCustomer.owner_id == owner_id, join=DBCustomer),
+    )
+    return [SearchResult(type=row.type, id=row.id, label=row.label, detail=row.detail) for row in db.execute(stmt)]
+
+@router.get("/", response_model=List[SearchResult])
+def search(q: str = Query(..., min_length=1, max_length=100), limit: int = Query(10, ge=1, le=50), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Searches the owner's customers, products, plans, subscription numbers and invoice numbers."""
+    q = q.strip()
+    if not q:
+        return []
+    if db.get_bind().dialect.name == "postgresql":
+        return _search_postgres(db, current_user.id, q, limit)
+
+    # Up to `limit` per type, like the Postgres path
+    index = search_index_cache.get(db, current_user.id)
+    return [SearchResult(type=kind, id=item_id, label=label, detail=detail) for kind, item_id, label, detail in index.search(q, limit)]
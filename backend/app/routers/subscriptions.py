@@ -1,28 +1,39 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 from typing import List
 from datetime import date, timedelta, datetime
 import random # For generating invoice_number for now
 
 from ..database import get_db
-from ..models import Subscription as DBSubscription, Plan as DBPlan, Invoice as DBInvoice, SubscriptionLine as DBSubscriptionLine, InvoiceLine as DBInvoiceLine, Product as DBProduct, User, Customer as DBCustomer
+from ..models import Subscription as DBSubscription, Plan as DBPlan, Invoice as DBInvoice, SubscriptionLine as DBSubscriptionLine, InvoiceLine as DBInvoiceLine, Product as DBProduct, User, Customer as DBCustomer, subscription_line_taxes
 from ..schemas import Subscription, SubscriptionCreate, SubscriptionConfirm, SubscriptionLineCreate, InvoiceCreate, InvoiceLineCreate, Invoice
 from ..auth_utils import get_current_user
+from ..cache import catalog_cache, versions
+from .. import metrics
+from ..serialization import json_response
+from ..fieldsets import Fieldset, SparseFields
+from ..discounts import find_active_discount, discount_percent_for, combine_percents, redeem
+from ..tax_rates import resolve_tax_percents, TaxResolutionError
 
 router = APIRouter()
 
+subscription_fields = SparseFields(Subscription, DBSubscription, required=("customer_id",))
+
 @router.get("/", response_model=List[Subscription], tags=["subscriptions"])
-def read_subscriptions(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def read_subscriptions(skip: int = 0, limit: int = 100, fieldset: Fieldset = Depends(subscription_fields), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """`fields` / `include` select what is returned, e.g. ?fields=subscription_number,status&include=subscription_lines"""
+    query = db.query(DBSubscription).join(DBCustomer).options(*fieldset.options())
     if current_user.mode == 'portal':
-         subscriptions = db.query(DBSubscription).join(DBCustomer).filter(DBCustomer.portal_user_id == current_user.id).offset(skip).limit(limit).all()
+         subscriptions = query.filter(DBCustomer.portal_user_id == current_user.id).offset(skip).limit(limit).all()
     else:
          # Filter subscriptions where the customer is owned by the current user
-         subscriptions = db.query(DBSubscription).join(DBCustomer).filter(DBCustomer.owner_id == current_user.id).offset(skip).limit(limit).all()
-    return subscriptions
+         subscriptions = query.filter(DBCustomer.owner_id == current_user.id).offset(skip).limit(limit).all()
+    return json_response(List[fieldset.schema], subscriptions)
 
 @router.get("/{subscription_id}", response_model=Subscription, tags=["subscriptions"])
-def read_subscription(subscription_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    subscription = db.query(DBSubscription).join(DBCustomer).filter(DBSubscription.id == subscription_id).first()
+def read_subscription(subscription_id: int, fieldset: Fieldset = Depends(subscription_fields), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    subscription = db.query(DBSubscription).join(DBCustomer).options(*fieldset.options()).filter(DBSubscription.id == subscription_id).first()
     if not subscription:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Subscription not found")
     
@@ -33,7 +44,7 @@ def read_subscription(subscription_id: int, db: Session = Depends(get_db), curre
     elif subscription.customer.owner_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Subscription not found")
         
-    return subscription
+    return json_response(fieldset.schema, subscription)
 
 
 def calculate_next_billing_date(start_date: date, interval: str) -> date:
@@ -64,6 +75,18 @@ def calculate_next_billing_date(start_date: date, interval: str) -> date:
         else:
             return date(next_year, next_month + 1, 1) - timedelta(days=1)
 
+def _resolve_line_taxes(db: Session, owner_id: int, lines):
+    """Sets tax_percent on every line with tax_ids, resolving all of them in one batch at today's rates."""
+    taxed_lines = [line for line in lines if line.tax_ids]
+    if not taxed_lines:
+        return
+    try:
+        percents = resolve_tax_percents(db, owner_id, [(line.tax_ids, date.today()) for line in taxed_lines])
+    except TaxResolutionError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    for line, percent in zip(taxed_lines, percents):
+        line.tax_percent = percent
+
 @router.post("/", response_model=Subscription, status_code=status.HTTP_201_CREATED)
 def create_subscription(subscription: SubscriptionCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     # Validate Customer
@@ -75,10 +98,33 @@ def create_subscription(subscription: SubscriptionCreate, db: Session = Depends(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Customer not found")
 
     # Validate Plan ownership
-    plan = db.query(DBPlan).filter(DBPlan.id == subscription.plan_id, DBPlan.owner_id == current_user.id).first()
-    if not plan:
+    if subscription.plan_id not in catalog_cache.get(db, current_user.id, "plans"):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Plan not found")
 
+    owned_products = catalog_cache.get(db, current_user.id, "products")
+    for line_data in subscription.subscription_lines:
+        # Validate Product ownership
+        if line_data.product_id not in owned_products:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with ID {line_data.product_id} not found")
+
+    # Lines that reference taxes get their tax_percent from the owner's rate cache, not from the client
+    _resolve_line_taxes(db, current_user.id, subscription.subscription_lines)
+
+    # Apply the discount code on top of each line's own discount, so confirmation and invoices see it in discount_percent
+    discount = None
+    if subscription.discount_code:
+        discount = find_active_discount(db, current_user.id, subscription.discount_code, date.today())
+        if discount is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Discount code is not valid")
+        discountable = sum(line.unit_price_snapshot * line.quantity * (1 - line.discount_percent / 100.0) for line in subscription.subscription_lines)
+        try:
+            extra_percent = discount_percent_for(discount, discountable)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        for line_data in subscription.subscription_lines:
+            line_data.discount_percent = combine_percents(line_data.discount_percent, extra_percent)
+        redeemed_amount = discountable * extra_percent / 100.0
+
     # Calculate totals from subscription lines
     subtotal = 0.0
     tax_total = 0.0
@@ -86,11 +132,6 @@ def create_subscription(subscription: SubscriptionCreate, db: Session = Depends(
     grand_total = 0.0
 
     for line_data in subscription.subscription_lines:
-        # Validate Product ownership
-        product = db.query(DBProduct).filter(DBProduct.id == line_data.product_id, DBProduct.owner_id == current_user.id).first()
-        if not product:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with ID {line_data.product_id} not found")
-        
         line_subtotal = line_data.unit_price_snapshot * line_data.quantity
         line_discount_amount = line_subtotal * (line_data.discount_percent / 100.0)
         line_tax_amount = (line_subtotal - line_discount_amount) * (line_data.tax_percent / 100.0)
@@ -114,13 +155,14 @@ def create_subscription(subscription: SubscriptionCreate, db: Session = Depends(
         tax_total=tax_total,
         discount_total=discount_total,
         grand_total=grand_total,
+        discount_id=discount.id if discount else None,
         created_at=datetime.utcnow()
     )
     db.add(db_subscription)
-    db.commit()
-    db.refresh(db_subscription) # Refresh to get the subscription ID
+    db.flush() # Get the subscription ID, everything below commits together
 
     # Create subscription lines
+    line_taxes = []
     for line_data in subscription.subscription_lines:
         db_subscription_line = DBSubscriptionLine(
             subscription_id=db_subscription.id,
@@ -133,9 +175,25 @@ def create_subscription(subscription: SubscriptionCreate, db: Session = Depends(
             line_total=line_data.line_total
         )
         db.add(db_subscription_line)
-    
+        if line_data.tax_ids:
+            line_taxes.append((db_subscription_line, set(line_data.tax_ids)))
+
+    if line_taxes:
+        db.flush()
+        db.execute(insert(subscription_line_taxes), [
+            {"subscription_line_id": line.id, "tax_id": tax_id} for line, tax_ids in line_taxes for tax_id in tax_ids
+        ])
+
+    # Redeem last, so a limited code's row is only locked until the commit right after
+    if discount and not redeem(db, discount, db_subscription.id, redeemed_amount):
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Discount code usage limit reached")
+
     db.commit()
-    db.refresh(db_subscription) # Refresh again to include lines
+    db.refresh(db_subscription) # Refresh to include lines
+    versions.bump(current_user.id, "subscriptions")
+    if discount:
+        versions.bump(current_user.id, "discounts") # Its used_count went up, the cached discounts are stale
 
     return db_subscription
 
@@ -171,6 +229,9 @@ def confirm_subscription(subscription_id: int, db: Session = Depends(get_db), cu
         if not db_subscription.subscription_lines:
              raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cannot confirm subscription without any subscription lines.")
 
+        # Re-price referenced taxes at the invoice date
+        _resolve_line_taxes(db, current_user.id, db_subscription.subscription_lines)
+
         for line in db_subscription.subscription_lines:
             # Recalculate line totals just in case (e.g., if price/quantity were updated directly)
             line_subtotal = line.unit_price_snapshot * line.quantity
@@ -178,6 +239,7 @@ def confirm_subscription(subscription_id: int, db: Session = Depends(get_db), cu
             line_tax_amount = (line_subtotal - line_discount_amount) * (line.tax_percent / 100.0)
             
             current_line_total = line_subtotal - line_discount_amount + line_tax_amount
+            line.line_total = current_line_total # Invoice lines copy this
             
             subtotal += line_subtotal
             tax_total += line_tax_amount
@@ -222,6 +284,7 @@ def confirm_subscription(subscription_id: int, db: Session = Depends(get_db), cu
         for sub_line in db_subscription.subscription_lines:
             db_invoice_line = DBInvoiceLine(
                 invoice_id=new_invoice.id,
+                issue_date=new_invoice.issue_date,
                 product_name=sub_line.product_name_snapshot,
                 unit_price=sub_line.unit_price_snapshot,
                 quantity=sub_line.quantity,
@@ -233,6 +296,9 @@ def confirm_subscription(subscription_id: int, db: Session = Depends(get_db), cu
         
         db.commit()
         db.refresh(new_invoice) # Refresh invoice to load new lines
+        versions.bump(current_user.id, "subscriptions")
+        versions.bump(current_user.id, "invoices")
+        metrics.INVOICES_GENERATED.inc()
 
         return SubscriptionConfirm(
             status=db_subscription.status,
@@ -1,30 +1,34 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import exists
 from sqlalchemy.orm import Session
 from typing import List
 
 from ..database import get_db
-from ..models import Tax as DBTax, User
-from ..schemas import Tax, TaxCreate
+from ..models import Tax as DBTax, TaxRate as DBTaxRate, User, subscription_line_taxes
+from ..schemas import Tax, TaxCreate, TaxRate, TaxRateCreate
 from ..auth_utils import get_current_user
+from ..cache import catalog_cache, versions
+from .. import tax_rates # Registers the tax_rates catalog loader
 
 router = APIRouter()
 
 @router.post("/taxes/", response_model=Tax, status_code=status.HTTP_201_CREATED)
 def create_tax(tax: TaxCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    db_tax = DBTax(name=tax.name, percent=tax.percent, is_active=tax.is_active, owner_id=current_user.id)
+    db_tax = DBTax(name=tax.name, percent=tax.percent, is_active=tax.is_active, is_compound=tax.is_compound, owner_id=current_user.id)
     db.add(db_tax)
     db.commit()
     db.refresh(db_tax)
+    versions.bump(current_user.id, "taxes")
     return db_tax
 
 @router.get("/taxes/", response_model=List[Tax])
 def read_taxes(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    taxes = db.query(DBTax).filter(DBTax.owner_id == current_user.id).offset(skip).limit(limit).all()
+    taxes = catalog_cache.list(db, current_user.id, "taxes", skip, limit)
     return taxes
 
 @router.get("/taxes/{tax_id}", response_model=Tax)
 def read_tax(tax_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    tax = db.query(DBTax).filter(DBTax.id == tax_id, DBTax.owner_id == current_user.id).first()
+    tax = catalog_cache.get(db, current_user.id, "taxes").get(tax_id)
     if tax is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tax not found")
     return tax
@@ -38,9 +42,11 @@ def update_tax(tax_id: int, tax: TaxCreate, db: Session = Depends(get_db), curre
     db_tax.name = tax.name
     db_tax.percent = tax.percent
     db_tax.is_active = tax.is_active
+    db_tax.is_compound = tax.is_compound
     
     db.commit()
     db.refresh(db_tax)
+    versions.bump(current_user.id, "taxes")
     return db_tax
 
 @router.delete("/taxes/{tax_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -48,6 +54,39 @@ def delete_tax(tax_id: int, db: Session = Depends(get_db), current_user: User =
     db_tax = db.query(DBTax).filter(DBTax.id == tax_id, DBTax.owner_id == current_user.id).first()
     if db_tax is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tax not found")
-    db.delete(db_tax)
+    if db.query(exists().where(subscription_line_taxes.c.tax_id == tax_id)).scalar():
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Tax is used by subscriptions, deactivate it instead")
+    db.delete(db_tax) # Its dated rates go with it
     db.commit()
-    return {"ok": True}
\ No newline at end of file
+    versions.bump(current_user.id, "taxes")
+    versions.bump(current_user.id, "tax_rates")
+    return {"ok": True}
+
+# Effective-dated rates
+@router.get("/taxes/{tax_id}/rates", response_model=List[TaxRate])
+def read_tax_rates(tax_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if tax_id not in catalog_cache.get(db, current_user.id, "taxes"):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tax not found")
+    rates = [rate for rate in catalog_cache.get(db, current_user.id, "tax_rates").values() if rate.tax_id == tax_id]
+    return sorted(rates, key=lambda rate: rate.effective_from)
+
+@router.post("/taxes/{tax_id}/rates", response_model=TaxRate, status_code=status.HTTP_201_CREATED)
+def create_tax_rate(tax_id: int, rate: TaxRateCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    if tax_id not in catalog_cache.get(db, current_user.id, "taxes"):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tax not found")
+    db_rate = DBTaxRate(tax_id=tax_id, percent=rate.percent, effective_from=rate.effective_from)
+    db.add(db_rate)
+    db.commit()
+    db.refresh(db_rate)
+    versions.bump(current_user.id, "tax_rates")
+    return db_rate
+
+@router.delete("/taxes/{tax_id}/rates/{rate_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_tax_rate(tax_id: int, rate_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    db_rate = db.query(DBTaxRate).join(DBTax).filter(DBTaxRate.id == rate_id, DBTaxRate.tax_id == tax_id, DBTax.owner_id == current_user.id).first()
+    if db_rate is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tax rate not found")
+    db.delete(db_rate)
+    db.commit()
+    versions.bump(current_user.id, "tax_rates")
+    return {"ok": True}
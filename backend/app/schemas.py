@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict
+from typing import Any, Dict, List, Optional
 from datetime import date, datetime
 
 # User Schemas
@@ -20,8 +20,7 @@ class UserResponse(UserBase):
     is_active: bool
     created_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Customer Schemas (NEW)
 class CustomerBase(BaseModel):
@@ -37,8 +36,31 @@ class Customer(CustomerBase):
     owner_id: int
     portal_user_id: Optional[int] = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class CustomerImportResult(BaseModel):
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0 # Invalid rows, repeated emails within the file and unchanged existing customers
+
+class Job(BaseModel):
+    id: int
+    kind: str
+    status: str # queued, running, succeeded, failed or cancelled
+    params: dict = {}
+    result: Optional[dict] = None
+    error: Optional[str] = None # Of the last failed attempt
+    progress: float = 0.0 # 0-1
+    progress_message: Optional[str] = None
+    attempts: int = 0
+    max_attempts: int
+    cancel_requested: bool = False
+    created_at: datetime
+    run_after: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
 
 class CustomerInviteResponse(BaseModel):
     username: str
@@ -68,8 +90,7 @@ class Product(ProductBase):
     id: int
     created_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class PlanBase(BaseModel):
     product_id: int
@@ -86,11 +107,31 @@ class PlanBase(BaseModel):
 class PlanCreate(PlanBase):
     pass
 
+# Bulk catalog import: products with their plans nested, matched by name
+class CatalogPlanImport(BaseModel):
+    name: str
+    billing_period: str
+    price: float
+    min_quantity: int = 1
+    auto_close: bool = False
+    pausable: bool = False
+    renewable: bool = True
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+
+class CatalogProductImport(ProductBase):
+    plans: List[CatalogPlanImport] = []
+
+class CatalogImportResult(BaseModel):
+    products_created: int = 0
+    products_updated: int = 0
+    plans_created: int = 0
+    plans_updated: int = 0
+
 class Plan(PlanBase):
     id: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class SubscriptionBase(BaseModel):
     subscription_number: str
@@ -103,6 +144,7 @@ class SubscriptionBase(BaseModel):
 
 class SubscriptionCreate(SubscriptionBase):
     subscription_lines: List["SubscriptionLineCreate"] = []
+    discount_code: Optional[str] = None
 
 class Subscription(SubscriptionBase):
     id: int
@@ -114,13 +156,13 @@ class Subscription(SubscriptionBase):
     created_at: datetime
     confirmed_at: Optional[datetime] = None
     closed_at: Optional[datetime] = None
+    discount_id: Optional[int] = None
     subscription_lines: List["SubscriptionLine"] = []
     
     # Optional: Include full customer details if needed
     customer: Optional[Customer] = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class SubscriptionConfirm(BaseModel):
     status: str
@@ -140,6 +182,7 @@ class SubscriptionLineBase(BaseModel):
     tax_percent: float = 0.0
     discount_percent: float = 0.0
     line_total: float
+    tax_ids: List[int] = [] # When set, tax_percent is resolved from these taxes
 
 class SubscriptionLineCreate(SubscriptionLineBase):
     pass
@@ -148,8 +191,7 @@ class SubscriptionLine(SubscriptionLineBase):
     id: int
     subscription_id: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class InvoiceBase(BaseModel):
@@ -184,8 +226,12 @@ class Invoice(InvoiceBase):
     
     customer: Optional[Customer] = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class InvoiceSummary(InvoiceBase):
+    id: int
+
+    model_config = ConfigDict(from_attributes=True)
 
 class InvoiceLineBase(BaseModel):
     product_name: str
@@ -202,13 +248,13 @@ class InvoiceLine(InvoiceLineBase):
     id: int
     invoice_id: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class TaxBase(BaseModel):
     name: str
     percent: float
     is_active: bool = True
+    is_compound: bool = False
 
 class TaxCreate(TaxBase):
     pass
@@ -216,12 +262,24 @@ class TaxCreate(TaxBase):
 class Tax(TaxBase):
     id: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class TaxRateBase(BaseModel):
+    percent: float
+    effective_from: date
+
+class TaxRateCreate(TaxRateBase):
+    pass
+
+class TaxRate(TaxRateBase):
+    id: int
+    tax_id: int
+
+    model_config = ConfigDict(from_attributes=True)
 
 class DiscountBase(BaseModel):
     name: str
-    type: str
+    type: str # 'percentage' or 'fixed'
     value: float
     start_date: Optional[date] = None
     end_date: Optional[date] = None
@@ -232,9 +290,9 @@ class DiscountCreate(DiscountBase):
 
 class Discount(DiscountBase):
     id: int
+    used_count: int = 0
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class PaymentBase(BaseModel):
     invoice_id: int
@@ -250,9 +308,121 @@ class PaymentCreate(PaymentBase):
 class Payment(PaymentBase):
     id: int
 
-    class Config:
-        orm_mode = True
-
-
+    model_config = ConfigDict(from_attributes=True)
+
+class CustomerOverview(BaseModel):
+    customer: Customer
+    outstanding_balance: float = 0.0 # Total of invoices not paid yet
+    lifetime_value: float = 0.0 # Total of paid invoices
+    subscription_count: int = 0
+    invoice_count: int = 0
+    payment_count: int = 0
+    # Most recent first, capped by the *_limit query parameters
+    subscriptions: List[Subscription] = []
+    recent_invoices: List[InvoiceSummary] = []
+    recent_payments: List[Payment] = []
+
+class ARAgingBuckets(BaseModel):
+    current: float = 0.0 # Not yet due
+    days_1_30: float = 0.0
+    days_31_60: float = 0.0
+    days_61_90: float = 0.0
+    days_over_90: float = 0.0
+    total: float = 0.0
+
+class ARAgingCustomer(ARAgingBuckets):
+    customer_id: int
+    customer_name: str
+    invoice_count: int = 0
+
+class ARAgingReport(BaseModel):
+    as_of: date
+    totals: ARAgingBuckets
+    customer_count: int = 0
+    customers: List[ARAgingCustomer] = []
+
+class SearchResult(BaseModel):
+    type: str # customer, product, plan, subscription or invoice
+    id: int
+    label: str
+    detail: Optional[str] = None
 
+class SQLRepeatedStatement(BaseModel):
+    statement: str
+    count: int # Executions within the one request
+    db_ms: float
 
+class SQLRequestProfile(BaseModel):
+    method: str
+    route: str # Path template, e.g. /invoices/{invoice_id}
+    status_code: int
+    queries: int
+    db_ms: float
+    total_ms: float
+    repeated: List[SQLRepeatedStatement] = [] # Likely N+1 patterns
+
+class SQLRouteProfile(BaseModel):
+    route: str # "<method> <path template>"
+    requests: int
+    queries: int
+    avg_queries: float
+    max_queries: int
+    db_ms: float
+    n_plus_one: int # Requests with repeated statements
+
+class SlowQuery(BaseModel):
+    fingerprint: str # Hash of the normalized statement
+    statement: str # As last seen
+    parameters: str # repr of the last parameters, truncated
+    count: int
+    total_ms: float
+    max_ms: float
+    last_ms: float
+    first_seen: datetime
+    last_seen: datetime
+    route: Optional[str] = None # Request that last ran it, "<method> <path template>"
+    owner_id: Optional[int] = None
+    plan: Optional[str] = None # Captured in the background, None until then
+    plan_captured_at: Optional[datetime] = None
+
+class SlowQueryLog(BaseModel):
+    threshold_ms: float
+    queries: List[SlowQuery] = []
+
+class SQLProfileReport(BaseModel):
+    enabled: bool
+    sample_rate: float
+    routes: List[SQLRouteProfile] = [] # Most database time first
+    recent: List[SQLRequestProfile] = [] # Most recent first
+
+class ShardStats(BaseModel):
+    shard: str
+    tenants: int = 0 # Owners with customers there
+    customers: int = 0
+    subscriptions: int = 0
+    invoices: int = 0
+    revenue: float = 0.0 # Paid invoices
+    error: Optional[str] = None # The shard could not be queried
+
+class ShardReport(BaseModel):
+    shards: List[ShardStats] = []
+    totals: ShardStats # Over the shards that answered
+
+class BatchRequestItem(BaseModel):
+    id: Optional[str] = None # Echoed in the response, defaults to the position
+    method: str = "GET"
+    path: str # With the query string, e.g. /customers/?limit=50
+    headers: Dict[str, str] = {} # e.g. If-None-Match; the batch's Authorization is always used
+    body: Optional[Any] = None # JSON body
+
+class BatchRequest(BaseModel):
+    requests: List[BatchRequestItem]
+
+class BatchResponseItem(BaseModel):
+    id: str
+    status: int
+    headers: Dict[str, str] = {}
+    body: Optional[Any] = None # Parsed JSON, or text for other content types
+
+class BatchResponse(BaseModel):
+    responses: List[BatchResponseItem] # In request order
@@ -0,0 +1,175 @@
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+from sqlalchemy.orm import Session
+
+from .cache import versions
+from .config import settings
+from .metrics import track_job
+from .models import Customer, Product, Plan, Subscription, Invoice
+
+# Collections whose writes make an owner's index stale
+SEARCH_COLLECTIONS = ("customers", "products", "plans", "subscriptions", "invoices")
+
+# Types whose detail text is searchable too (customer emails), the rest only match on their label
+SEARCHABLE_DETAIL = {"customer"}
+
+_token_re = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> set:
+    """Lowercased words of `text`, plus the whole string so prefixes like 'inv-12' match."""
+    if not text:
+        return set()
+    text = text.lower().strip()
+    tokens = set(_token_re.findall(text))
+    tokens.add(text)
+    return tokens
+
+
+class PrefixIndex:
+    """Sorted token list for one owner's searchable records, queried by prefix with bisect."""
+
+    def __init__(self, docs: list):
+        # docs: list of (type, id, label, detail)
+        self.docs = docs
+        pairs = []
+        for position, doc in enumerate(docs):
+            for token in self._doc_tokens(doc):
+                pairs.append((token, position))
+        pairs.sort()
+        self._tokens = [token for token, _ in pairs]
+        self._positions = [position for _, position in pairs]
+
+    @staticmethod
+    def _doc_tokens(doc) -> set:
+        kind, _, label, detail = doc
+        return tokenize(label) | tokenize(detail) if kind in SEARCHABLE_DETAIL else tokenize(label)
+
+    def _matches_all(self, position: int, terms: list) -> bool:
+        doc_tokens = self._doc_tokens(self.docs[position])
+        return all(any(token.startswith(term) for token in doc_tokens) for term in terms)
+
+    def search(self, query: str, limit: int) -> list:
+        terms = sorted(_token_re.findall(query.lower()), key=len, reverse=True) or [query.lower().strip()]
+        # Walk the longest term's prefix range, then check the remaining terms per candidate
+        lead, rest = terms[0], terms[1:]
+        results, seen = [], set()
+        i = bisect_left(self._tokens, lead)
+        while i < len(self._tokens) and self._tokens[i].startswith(lead):
+            position = self._positions[i]
+            i += 1
+            if position in seen:
+                continue
+            seen.add(position)
+            if rest and not self._matches_all(position, rest):
+                continue
+            results.append(self.docs[position])
+            if len(results) >= limit:
+                break
+        return results
+
+
+class OwnerIndex:
+    """One PrefixIndex per searchable collection of an owner, so a write only rebuilds its collection's index."""
+
+    def __init__(self, versions_by_collection: dict, indexes: dict, built_at: float):
+        self.versions = versions_by_collection
+        self.indexes = indexes # collection -> PrefixIndex
+        self.built_at = built_at
+        self.used_at = built_at
+
+    def search(self, query: str, limit: int) -> list:
+        """Up to `limit` matches per collection."""
+        results = []
+        for collection in SEARCH_COLLECTIONS:
+            results += self.indexes[collection].search(query, limit)
+        return results
+
+
+class SearchIndexCache:
+    """
+    Per-owner OwnerIndex. Collections whose version changed are reloaded on the next search, all of
+    them after ttl_seconds. Keeps the max_owners most recently searched owners and drops owners
+    that haven't searched for idle_seconds.
+    """
+
+    def __init__(self, ttl_seconds: float, max_owners: int, idle_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.max_owners = max_owners
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()  # owner_id -> OwnerIndex, least recently used first
+
+    def get(self, db: Session, owner_id: int) -> OwnerIndex:
+        current = {collection: versions.get(owner_id, collection) for collection in SEARCH_COLLECTIONS}
+        now = time.monotonic()
+        with self._lock:
+            index = self._indexes.get(owner_id)
+
+        fresh = index is not None and now - index.built_at < self.ttl_seconds
+        stale = [collection for collection in SEARCH_COLLECTIONS if not fresh or index.versions[collection] != current[collection]]
+        if stale:
+            indexes = dict(index.indexes) if fresh else {}
+            with track_job("search_index_build"):
+                for collection in stale:
+                    indexes[collection] = PrefixIndex(_LOADERS[collection](db, owner_id))
+            # The TTL counts from the last full build
+            index = OwnerIndex(current, indexes, built_at=index.built_at if fresh else now)
+
+        with self._lock:
+            index.used_at = now
+            self._indexes[owner_id] = index
+            self._indexes.move_to_end(owner_id)
+            while len(self._indexes) > self.max_owners:
+                self._indexes.popitem(last=False)
+            while self._indexes:
+                oldest_owner, oldest = next(iter(self._indexes.items()))
+                if now - oldest.used_at < self.idle_seconds:
+                    break
+                del self._indexes[oldest_owner]
+        return index
+
+
+def _load_customers(db: Session, owner_id: int) -> list:
+    return [("customer", row.id, row.name, row.email)
+            for row in db.query(Customer.id, Customer.name, Customer.email).filter(Customer.owner_id == owner_id)]
+
+
+def _load_products(db: Session, owner_id: int) -> list:
+    return [("product", row.id, row.name, row.type)
+            for row in db.query(Product.id, Product.name, Product.type).filter(Product.owner_id == owner_id)]
+
+
+def _load_plans(db: Session, owner_id: int) -> list:
+    return [("plan", row.id, row.name, row.billing_period)
+            for row in db.query(Plan.id, Plan.name, Plan.billing_period).filter(Plan.owner_id == owner_id)]
+
+
+def _load_subscriptions(db: Session, owner_id: int) -> list:
+    return [("subscription", row.id, row.subscription_number, row.name)
+            for row in db.query(Subscription.id, Subscription.subscription_number, Customer.name).join(Customer).filter(Customer.owner_id == owner_id)]
+
+
+def _load_invoices(db: Session, owner_id: int) -> list:
+    return [("invoice", row.id, row.invoice_number, row.name)
+            for row in db.query(Invoice.id, Invoice.invoice_number, Customer.name).join(Customer).filter(Customer.owner_id == owner_id)]
+
+
+_LOADERS = {
+    "customers": _load_customers,
+    "products": _load_products,
+    "plans": _load_plans,
+    "subscriptions": _load_subscriptions,
+    "invoices": _load_invoices,
+}
+
+
+search_index_cache = SearchIndexCache(
+    ttl_seconds=settings.SEARCH_INDEX_TTL_SECONDS,
+    max_owners=settings.SEARCH_INDEX_MAX_OWNERS,
+    idle_seconds=settings.SEARCH_INDEX_IDLE_SECONDS,
+)
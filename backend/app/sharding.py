@@ -0,0 +1,128 @@
+"""
+Tenant sharding. A tenant (a business user, its data and its portal users) lives in one database,
+its shard: the primary database (DATABASE_URL) or one of SHARD_DATABASE_URLS. The primary database
+also holds the users, for login, and the shard directory (tenant_shards), where users of tenants
+on other shards have a row. Users without one are on the primary database, so a deployment
+without SHARD_DATABASE_URLS works as before and never reads the directory.
+
+get_current_user routes the request's session to the user's shard (ShardedSession in
+database.py sends the users and directory tables to the primary database regardless). Shards
+carry stub users rows (ids only) so their foreign keys hold. move_tenant.py moves a tenant
+between shards while it stays online, see app/tenant_move.py. Rows keep their ids when they move:
+on Postgres every shard hands out ids from its own range (reserve_id_range, run by run_migration.py).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import insert, text
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import DIRECTORY_TABLES, PRIMARY_SHARD, Base, SessionLocal, shard_engines, shard_urls
+from .models import TenantShard, User
+
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def enabled() -> bool:
+    return len(shard_engines) > 1
+
+
+def shard_of(db: Session, user_id: int) -> Optional[TenantShard]:
+    """The user's directory entry, None for users on the primary database."""
+    if not enabled():
+        return None
+    return db.query(TenantShard).filter(TenantShard.user_id == user_id).first()
+
+
+def route(db: Session, user: User, method: str):
+    """Points the request's session at the user's shard. Writes are refused while the tenant is being moved."""
+    entry = shard_of(db, user.id)
+    if entry is None:
+        return
+    db.info["shard"] = entry.shard
+    if entry.state == "moving" and method not in READ_METHODS:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="This account is being moved, try again in a moment",
+            headers={"Retry-After": "5"},
+        )
+
+
+def session_for(owner_id: int) -> Session:
+    """A new session on the owner's shard, for work outside the request's session."""
+    db = SessionLocal()
+    entry = shard_of(db, owner_id)
+    if entry is not None:
+        db.info["shard"] = entry.shard
+    return db
+
+
+def stub_user(user) -> dict:
+    """A user's row as kept on shards: enough for the foreign keys, nothing to log in with."""
+    return {"id": user.id, "is_active": user.is_active, "created_at": user.created_at, "mode": user.mode}
+
+
+def place_user(db: Session, user: User, owner_id: Optional[int] = None):
+    """
+    Records where a new user's tenant lives: a new business user on NEW_TENANT_SHARD, a portal user
+    on its owner's shard. Adds the directory row and the stub; the caller commits.
+    """
+    if not enabled():
+        return
+    if owner_id is None:
+        shard = settings.NEW_TENANT_SHARD or PRIMARY_SHARD
+    else:
+        entry = shard_of(db, owner_id)
+        shard = entry.shard if entry else PRIMARY_SHARD
+    if shard == PRIMARY_SHARD:
+        return
+    if shard not in shard_engines:
+        raise RuntimeError(f"Unknown shard {shard!r}, configured: {', '.join(shard_engines)}")
+    db.add(TenantShard(user_id=user.id, owner_id=owner_id or user.id, shard=shard))
+    db.execute(insert(User.__table__).values(stub_user(user)), bind_arguments={"bind": shard_engines[shard]})
+
+
+def id_range(shard: str) -> tuple:
+    """(first, last) id the shard hands out for tenant rows."""
+    position = list(shard_urls()).index(shard)
+    return position * settings.SHARD_ID_RANGE_SIZE + 1, (position + 1) * settings.SHARD_ID_RANGE_SIZE
+
+
+def reserve_id_range(conn, shard: str):
+    """
+    Points the id sequences of the tenant tables at the shard's range, past the ids already used in it.
+    Postgres only: SQLite hands out max(id) + 1, so there a tenant move refuses ids the target already has.
+    """
+    if conn.dialect.name != "postgresql":
+        return
+    first, last = id_range(shard)
+    for table in Base.metadata.sorted_tables:
+        if table.name in DIRECTORY_TABLES or "id" not in table.c:
+            continue
+        if conn.execute(text("SELECT to_regclass(:table)"), {"table": table.name}).scalar() is None:
+            continue # Not created yet (run_migration.py --target)
+        sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table.name}).scalar()
+        if not sequence:
+            continue
+        used = conn.execute(text(f"SELECT max(id) FROM {table.name} WHERE id BETWEEN {first} AND {last}")).scalar()
+        if conn.execute(text(f"SELECT count(*) FROM {table.name} WHERE id > {last}")).scalar():
+            raise RuntimeError(f"{table.name} on {shard} has ids past {last}, raise SHARD_ID_RANGE_SIZE")
+        restart = (used or first - 1) + 1
+        conn.execute(text(f"ALTER SEQUENCE {sequence} MINVALUE {first} MAXVALUE {last} START WITH {first} RESTART WITH {restart}"))
+
+
+def scatter(query, shards=None) -> dict:
+    """Runs `query(session)` on every shard (or the given ones) concurrently. Returns {shard: result}."""
+    names = list(shards or shard_engines)
+
+    def run(name):
+        db = SessionLocal(info={"shard": name})
+        try:
+            return query(db)
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=len(names)) as pool:
+        return dict(zip(names, pool.map(run, names)))
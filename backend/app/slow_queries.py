@@ -0,0 +1,151 @@
+"""
+Slow-query log: statements slower than SLOW_QUERY_THRESHOLD_MS are grouped by a fingerprint of their
+normalized text and kept, with the route and owner of the request that ran them, in a bounded
+in-memory log per worker (GET /admin/slow-queries).
+
+The first time a fingerprint shows up, its plan is captured on a background thread with a
+connection of its own, so the request that hit the slow query doesn't wait for it. On Postgres
+SELECTs get EXPLAIN (ANALYZE, BUFFERS), which runs them again under a statement_timeout; other
+statements get a plain EXPLAIN, both in a transaction that is rolled back.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import event
+
+from . import request_context
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+_placeholder_re = re.compile(r"%\(\w+\)s|%s|\?|:\w+")
+_in_list_re = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_literal_re = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_space_re = re.compile(r"\s+")
+
+
+def normalize(statement: str) -> str:
+    """Statement text with placeholders and literals as ? and IN lists of any length as (?)."""
+    text = _placeholder_re.sub("?", statement)
+    text = _literal_re.sub("?", text)
+    text = _in_list_re.sub("(?)", text)
+    return _space_re.sub(" ", text).strip()
+
+
+def fingerprint(statement: str) -> str:
+    return hashlib.blake2b(normalize(statement).encode(), digest_size=8).hexdigest()
+
+
+class SlowQueryLog:
+    """Slow statements by fingerprint, least recently seen evicted first."""
+
+    def __init__(self, threshold_ms: float, size: int = 100, explain: bool = True, explain_timeout_ms: int = 5000):
+        self.threshold_ms = threshold_ms
+        self.size = size
+        self.explain = explain
+        self.explain_timeout_ms = explain_timeout_ms
+        self.engine = None
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._executor = None
+
+    def install(self, engine):
+        """Times the engine's statements. Plans are captured on the database the statement ran on."""
+        self.engine = engine
+        if not event.contains(engine, "before_cursor_execute", self._before_cursor_execute):
+            event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._slow_query_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_slow_query_started", None)
+        if started is None:
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms >= self.threshold_ms and context.execution_options.get("slow_query_log", True):
+            self.record(statement, parameters, elapsed_ms, executemany, engine=conn.engine)
+
+    def record(self, statement: str, parameters, elapsed_ms: float, executemany: bool = False, engine=None):
+        key = fingerprint(statement)
+        request = request_context.current()
+        route = f"{request.method} {request.route}" if request else None
+        owner_id = request.owner_id if request else None
+        now = datetime.utcnow()
+        logger.warning("Slow query %s (%.1f ms) in %s for owner %s: %s", key, elapsed_ms, route or "-", owner_id, statement[:500])
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = {
+                    "fingerprint": key, "statement": statement, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                    "first_seen": now, "plan": None, "plan_captured_at": None,
+                }
+                explain = self.explain and not executemany
+                if len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+                explain = False
+            entry["count"] += 1
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+            entry.update(last_ms=elapsed_ms, last_seen=now, route=route, owner_id=owner_id, parameters=repr(parameters)[:1000])
+
+        if explain:
+            self._submit_explain(key, statement, parameters, engine or self.engine)
+
+    def _submit_explain(self, key: str, statement: str, parameters, engine):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # One thread: plans are captured one at a time and never pile up on the database
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-explain")
+        self._executor.submit(self._capture_plan, key, statement, parameters, engine)
+
+    def _capture_plan(self, key: str, statement: str, parameters, engine):
+        try:
+            with engine.connect() as conn:
+                conn = conn.execution_options(slow_query_log=False)
+                if conn.dialect.name == "postgresql":
+                    conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(self.explain_timeout_ms)}")
+                    analyze = statement.lstrip().upper().startswith("SELECT")
+                    rows = conn.exec_driver_sql(("EXPLAIN (ANALYZE, BUFFERS) " if analyze else "EXPLAIN ") + statement, parameters).fetchall()
+                    plan = "\n".join(row[0] for row in rows)
+                else:
+                    rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+                    plan = "\n".join(str(row[-1]) for row in rows)
+                conn.rollback()
+        except Exception as exc:
+            plan = f"EXPLAIN failed: {exc}"
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["plan"] = plan
+                entry["plan_captured_at"] = datetime.utcnow()
+
+    def entries(self, order_by: str = "last_seen", limit: int = 50) -> list:
+        with self._lock:
+            entries = [dict(entry) for entry in self._entries.values()]
+        entries.sort(key=lambda entry: entry[order_by], reverse=True)
+        return entries[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+slow_query_log = SlowQueryLog(
+    settings.SLOW_QUERY_THRESHOLD_MS,
+    size=settings.SLOW_QUERY_LOG_SIZE,
+    explain=settings.SLOW_QUERY_EXPLAIN,
+    explain_timeout_ms=settings.SLOW_QUERY_EXPLAIN_TIMEOUT_MS,
+)
@@ -0,0 +1,57 @@
+"""
+Statement timeout for the queries of the current request, so a runaway query gives its connection
+back instead of holding it. RateLimitMiddleware sets the timeout of the request's route group
+(STATEMENT_TIMEOUTS_MS); queries outside requests run without one.
+
+Postgres gets SET LOCAL statement_timeout at the start of each transaction. SQLite has no such
+setting, so a progress handler interrupts statements that run past their deadline.
+"""
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+_timeout_ms: ContextVar[Optional[int]] = ContextVar("statement_timeout_ms", default=None)
+
+
+def set_timeout(timeout_ms: Optional[int]):
+    return _timeout_ms.set(timeout_ms or None)
+
+
+def reset_timeout(token):
+    _timeout_ms.reset(token)
+
+
+def _set_local_timeout(conn):
+    timeout_ms = _timeout_ms.get()
+    if timeout_ms:
+        # Straight on the DBAPI connection: this runs while SQLAlchemy is still beginning the transaction
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.execute(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+        finally:
+            cursor.close()
+
+
+def _arm_sqlite_deadline(conn, cursor, statement, parameters, context, executemany):
+    timeout_ms = _timeout_ms.get()
+    dbapi_connection = conn.connection.dbapi_connection
+    if timeout_ms:
+        deadline = time.monotonic() + timeout_ms / 1000
+        dbapi_connection.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+    else:
+        dbapi_connection.set_progress_handler(None, 0)
+
+
+def install(engine):
+    if engine.dialect.name == "postgresql":
+        event.listen(engine, "begin", _set_local_timeout)
+    elif engine.dialect.name == "sqlite":
+        event.listen(engine, "before_cursor_execute", _arm_sqlite_deadline)
+
+
+def is_timeout(exc: Exception) -> bool:
+    """Whether a DBAPI error raised through SQLAlchemy is a statement timeout."""
+    orig = getattr(exc, "orig", None)
+    return getattr(orig, "pgcode", None) == "57014" or "interrupted" in str(orig)
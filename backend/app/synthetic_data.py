@@ -0,0 +1,237 @@
+"""
+Deterministic synthetic data for load tests and benchmarks.
+
+Every tenant gets its own random stream derived from the seed and the tenant number, so the same
+arguments always produce the same rows (ids aside, which continue from what is already in the
+database) and a tenant's data does not depend on how many tenants are generated. Rows are written
+with COPY on Postgres and executemany elsewhere, in batches of customers that are committed on
+their own. Ids are assigned here rather than by the database, so nothing else should write to
+the same tables while the generator runs.
+"""
+import csv
+import io
+import random
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import func, select, text
+
+from .models import (
+    Customer, Discount, Invoice, InvoiceLine, Payment, Plan, Product, Subscription, SubscriptionLine, Tax, User,
+    subscription_line_taxes,
+)
+
+PRODUCTS_PER_TENANT = 10
+BILLING_PERIODS = (("monthly", 1, 1.0), ("quarterly", 3, 2.8), ("yearly", 12, 10.0)) # name, months, price factor
+TAXES_PER_TENANT = 3
+DISCOUNTS_PER_TENANT = 5
+PAYMENT_METHODS = ("credit_card", "credit_card", "bank_transfer", "paypal")
+
+# Parents before children, the order rows are written in within a batch
+TABLES = [model.__table__ for model in (User, Product, Plan, Tax, Discount, Customer, Subscription, SubscriptionLine)] \
+    + [subscription_line_taxes] + [model.__table__ for model in (Invoice, InvoiceLine, Payment)]
+
+
+def add_months(day: date, months: int) -> date:
+    year, month = divmod(day.month - 1 + months, 12)
+    return date(day.year + year, month + 1, min(day.day, 28))
+
+
+def _sqlite_value(value):
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+class BulkWriter:
+    """Hands out ids and writes buffered rows per table, with COPY on Postgres."""
+
+    def __init__(self, conn):
+        self.postgres = conn.dialect.name == "postgresql"
+        self.next_ids = {
+            table.name: conn.execute(select(func.coalesce(func.max(table.c.id), 0))).scalar() + 1
+            for table in TABLES if "id" in table.c
+        }
+        self.rows = {table.name: [] for table in TABLES}
+        self.counts = {table.name: 0 for table in TABLES}
+
+    def add(self, table: str, row: dict) -> int:
+        """Buffers a row, giving it the next id if the table has one. Returns the id."""
+        if table in self.next_ids:
+            row = {"id": self.next_ids[table], **row}
+            self.next_ids[table] += 1
+        self.rows[table].append(row)
+        return row.get("id")
+
+    def _copy(self, conn, table, rows: list):
+        columns = list(rows[0])
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(row[column] for column in columns)
+        buffer.seek(0)
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        finally:
+            cursor.close()
+
+    def _executemany(self, conn, table, rows: list):
+        # Straight to the DBAPI cursor, SQLAlchemy's per-row parameter processing would cost more than the insert.
+        # Dates go in as the strings SQLAlchemy's SQLite types store
+        columns = list(rows[0])
+        placeholder = "?" if conn.dialect.paramstyle == "qmark" else "%s"
+        statement = f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({', '.join([placeholder] * len(columns))})"
+        convert = _sqlite_value if conn.dialect.name == "sqlite" else (lambda value: value)
+        cursor = conn.connection.cursor()
+        try:
+            cursor.executemany(statement, [tuple(convert(row[column]) for column in columns) for row in rows])
+        finally:
+            cursor.close()
+
+    def flush(self, conn):
+        for table in TABLES:
+            rows = self.rows[table.name]
+            if not rows:
+                continue
+            if self.postgres:
+                self._copy(conn, table, rows)
+            else:
+                self._executemany(conn, table, rows)
+            self.counts[table.name] += len(rows)
+            self.rows[table.name] = []
+
+    def sync_sequences(self, conn):
+        """Moves the Postgres id sequences past the ids handed out here."""
+        if not self.postgres:
+            return
+        for table in self.next_ids:
+            sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table}).scalar()
+            if sequence:
+                conn.execute(text(f"SELECT setval('{sequence}', (SELECT coalesce(max(id), 1) FROM {table}))"))
+
+
+def _catalog(writer: BulkWriter, rng: random.Random, owner_id: int, username: str):
+    plans = []
+    for n in range(1, PRODUCTS_PER_TENANT + 1):
+        base_price = round(rng.uniform(5, 500), 2)
+        product_id = writer.add("products", {
+            "name": f"Product {n}", "base_price": base_price, "type": rng.choice(("Service", "Software", "Infrastructure")),
+            "description": f"Synthetic product {n}", "is_active": True, "created_at": datetime.utcnow(), "owner_id": owner_id,
+        })
+        for period, months, factor in BILLING_PERIODS:
+            price = round(base_price * factor, 2)
+            plan_id = writer.add("plans", {
+                "product_id": product_id, "name": f"{period.capitalize()} Plan {n}", "billing_period": period, "price": price,
+                "min_quantity": 1, "auto_close": False, "pausable": False, "renewable": True, "owner_id": owner_id,
+            })
+            plans.append({"id": plan_id, "product_id": product_id, "months": months, "price": price, "name": f"Product {n}"})
+    taxes = []
+    for n in range(1, TAXES_PER_TENANT + 1):
+        percent = float(rng.choice((5, 8, 12, 18, 20)))
+        taxes.append((writer.add("taxes", {"name": f"{username} tax {n}", "percent": percent, "is_active": True, "is_compound": False, "owner_id": owner_id}), percent))
+    for n in range(1, DISCOUNTS_PER_TENANT + 1):
+        writer.add("discounts", {"name": f"{username}-SAVE{n}", "type": "percentage", "value": float(5 * n), "used_count": 0, "owner_id": owner_id})
+    return plans, taxes
+
+
+def _subscription(writer: BulkWriter, rng: random.Random, customer_id: int, number: str, plans: list, taxes: list,
+                  as_of: date, history_months: int, payment_ratio: float):
+    plan = rng.choice(plans)
+    start = add_months(as_of, -rng.randrange(history_months + 1)).replace(day=rng.randint(1, 28))
+    start = min(start, as_of)
+    roll = rng.random()
+    status = "draft" if roll < 0.1 else "closed" if roll < 0.2 else "active"
+    end = None
+    if status == "closed":
+        end = add_months(start, rng.randint(1, max(1, history_months)))
+        if end > as_of:
+            status, end = "active", None
+
+    lines = []
+    for quantity in [rng.randint(1, 5) for _ in range(rng.choice((1, 1, 2, 3)))]:
+        tax_id, tax_percent = rng.choice(taxes) if rng.random() < 0.7 else (None, 0.0)
+        subtotal = plan["price"] * quantity
+        lines.append({"quantity": quantity, "tax_id": tax_id, "tax_percent": tax_percent, "subtotal": subtotal,
+                      "tax": round(subtotal * tax_percent / 100.0, 2)})
+    subtotal = sum(line["subtotal"] for line in lines)
+    tax_total = sum(line["tax"] for line in lines)
+
+    # Billing periods started so far, one invoice each
+    periods = []
+    if status != "draft":
+        issued = start
+        while issued <= (end or as_of):
+            periods.append(issued)
+            issued = add_months(issued, plan["months"])
+
+    created = datetime.combine(start, time(9)) - timedelta(days=rng.randint(0, 14))
+    subscription_id = writer.add("subscriptions", {
+        "subscription_number": number, "customer_id": customer_id, "plan_id": plan["id"], "discount_id": None,
+        "status": status, "start_date": start, "end_date": end,
+        "next_billing_date": add_months(periods[-1], plan["months"]) if status == "active" else None,
+        "payment_terms": "Net 30", "subtotal": subtotal, "tax_total": tax_total, "discount_total": 0.0, "grand_total": subtotal + tax_total,
+        "created_at": created, "confirmed_at": created + timedelta(days=1) if status != "draft" else None,
+        "closed_at": datetime.combine(end, time(18)) if end else None,
+    })
+    for line in lines:
+        line["id"] = writer.add("subscription_lines", {
+            "subscription_id": subscription_id, "product_id": plan["product_id"], "product_name_snapshot": plan["name"],
+            "unit_price_snapshot": plan["price"], "quantity": line["quantity"], "tax_percent": line["tax_percent"],
+            "discount_percent": 0.0, "line_total": line["subtotal"] + line["tax"],
+        })
+        if line["tax_id"]:
+            writer.add("subscription_line_taxes", {"subscription_line_id": line["id"], "tax_id": line["tax_id"]})
+
+    for period, issued in enumerate(periods, 1):
+        due = issued + timedelta(days=30)
+        paid = rng.random() < payment_ratio
+        paid_date = min(issued + timedelta(days=rng.randint(0, 45)), as_of) if paid else None
+        invoice_id = writer.add("invoices", {
+            "invoice_number": f"INV-{number}-{period}", "subscription_id": subscription_id, "customer_id": customer_id,
+            "issue_date": issued, "due_date": due, "status": "paid" if paid else "pending", "paid_date": paid_date,
+            "subtotal": subtotal, "tax_total": tax_total, "discount_total": 0.0, "grand_total": subtotal + tax_total,
+        })
+        for line in lines:
+            writer.add("invoice_lines", {
+                "invoice_id": invoice_id, "issue_date": issued, "product_name": plan["name"], "unit_price": plan["price"],
+                "quantity": line["quantity"], "tax_percent": line["tax_percent"], "discount_percent": 0.0,
+                "line_total": line["subtotal"] + line["tax"],
+            })
+        if paid:
+            writer.add("payments", {
+                "invoice_id": invoice_id, "amount": subtotal + tax_total, "method": rng.choice(PAYMENT_METHODS),
+                "reference_id": f"PAY-{invoice_id}", "status": "success",
+                "payment_date": datetime.combine(paid_date, time(rng.randint(0, 23), rng.randint(0, 59))),
+            })
+
+
+def generate_tenant(engine, writer: BulkWriter, username: str, rng: random.Random, customers: int = 1000,
+                    subscriptions_per_customer: float = 2.0, history_months: int = 12, payment_ratio: float = 0.8,
+                    as_of: date = None, hashed_password: str = "!", batch_size: int = 1000) -> bool:
+    """
+    One business user with a small catalog and `customers` customers, each with on average
+    `subscriptions_per_customer` subscriptions started over the last `history_months` months and an
+    invoice per billing period since, a `payment_ratio` share of them paid. False if the user exists.
+    """
+    as_of = as_of or date.today()
+    with engine.begin() as conn:
+        if conn.execute(select(User.id).where(User.username == username)).scalar() is not None:
+            return False
+        owner_id = writer.add("users", {
+            "username": username, "email": f"{username}@synthetic.test", "hashed_password": hashed_password,
+            "is_active": True, "created_at": datetime.utcnow(), "mode": "business",
+        })
+        plans, taxes = _catalog(writer, rng, owner_id, username)
+        writer.flush(conn)
+
+    whole, fraction = divmod(subscriptions_per_customer, 1)
+    for start in range(0, customers, batch_size):
+        for n in range(start, min(start + batch_size, customers)):
+            customer_id = writer.add("customers", {"owner_id": owner_id, "name": f"Customer {n}", "email": f"customer{n}@{username}.test", "portal_user_id": None})
+            for s in range(int(whole) + (rng.random() < fraction)):
+                _subscription(writer, rng, customer_id, f"{username}-{n}-{s}", plans, taxes, as_of, history_months, payment_ratio)
+        with engine.begin() as conn:
+            writer.flush(conn)
+    return True
@@ -0,0 +1,94 @@
+from bisect import bisect_right
+from datetime import date
+from typing import Iterable, List, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+from .cache import catalog_cache
+from .models import Tax, TaxRate
+from .schemas import TaxRate as SchemaTaxRate
+
+
+PERCENT_PRECISION = 6 # Decimals kept of combined rates, so float noise doesn't reach line and invoice totals
+
+
+class TaxResolutionError(ValueError):
+    pass
+
+
+class TaxRateTable:
+    """An owner's taxes with their dated rate schedules, resolved entirely in memory."""
+
+    def __init__(self, taxes: dict, rates: Iterable):
+        self._taxes = taxes
+        schedules = {}
+        for rate in rates:
+            schedules.setdefault(rate.tax_id, []).append((rate.effective_from, rate.percent))
+        self._schedules = {}
+        for tax_id, entries in schedules.items():
+            entries.sort()
+            self._schedules[tax_id] = ([start for start, _ in entries], [percent for _, percent in entries])
+
+    def rate(self, tax_id: int, on_date: date) -> float:
+        """Rate of one tax on a date: the latest dated rate that has started, else the tax's base percent."""
+        tax = self._taxes.get(tax_id)
+        if tax is None:
+            raise TaxResolutionError(f"Tax with ID {tax_id} not found")
+        if not tax.is_active:
+            raise TaxResolutionError(f"Tax '{tax.name}' is not active")
+        schedule = self._schedules.get(tax_id)
+        if schedule:
+            position = bisect_right(schedule[0], on_date)
+            if position:
+                return schedule[1][position - 1]
+        return tax.percent
+
+    def effective_percent(self, tax_ids: Sequence[int], on_date: date) -> float:
+        """
+        Combined rate of several taxes as one percentage of the taxable amount.
+        Simple taxes apply to the amount, compound taxes (in id order) to the amount plus the taxes before them.
+        """
+        simple = 0.0
+        multiplier = None
+        for tax_id in sorted(set(tax_ids)):
+            rate = self.rate(tax_id, on_date)
+            if self._taxes[tax_id].is_compound:
+                multiplier = (multiplier or 1.0) * (1 + rate / 100.0)
+            else:
+                simple += rate
+        if multiplier is None:
+            return round(simple, PERCENT_PRECISION)
+        return round(simple + (100.0 + simple) * (multiplier - 1), PERCENT_PRECISION)
+
+
+def rate_table(db: Session, owner_id: int) -> TaxRateTable:
+    """Per-owner TaxRateTable, kept on the cached rates and rebuilt only when the taxes or rates reload."""
+    taxes = catalog_cache.get(db, owner_id, "taxes")
+    cached = catalog_cache.derive(db, owner_id, "tax_rates", "rate_table",
+                                  lambda rates: (taxes, TaxRateTable(taxes, rates.values())),
+                                  current=lambda cached: cached[0] is taxes)
+    return cached[1]
+
+
+def resolve_tax_percents(db: Session, owner_id: int, requests: Iterable[Tuple[Sequence[int], date]]) -> List[float]:
+    """
+    Batch resolution for billing runs: one (tax_ids, date) request per line, answered without per-line queries.
+    Lines sharing the same taxes and date are resolved once.
+    """
+    table = rate_table(db, owner_id)
+    resolved = {}
+    percents = []
+    for tax_ids, on_date in requests:
+        key = (tuple(sorted(set(tax_ids))), on_date)
+        if key not in resolved:
+            resolved[key] = table.effective_percent(key[0], on_date) if key[0] else 0.0
+        percents.append(resolved[key])
+    return percents
+
+
+def _load_tax_rates(db: Session, owner_id: int) -> dict:
+    rows = db.query(TaxRate).join(Tax).filter(Tax.owner_id == owner_id).all()
+    return {row.id: SchemaTaxRate.model_validate(row, from_attributes=True) for row in rows}
+
+
+catalog_cache.register("tax_rates", _load_tax_rates)
@@ -0,0 +1,243 @@
+"""
+Moves a tenant to another shard while it stays online (move_tenant.py).
+
+1. copy: the tenant's rows are copied to the target, ids included, while it keeps reading and
+   writing. Every shard hands out ids from its own range (see reserve_id_range in sharding.py), so
+   they don't collide with the target's; if they do anyway, the move stops before the flip.
+2. freeze: the tenant's directory rows are marked 'moving', which turns its writes away with 503.
+   After `drain_seconds` for writes already under way, its rows are read again and what changed
+   since the copy (new, updated and deleted rows) is applied to the target.
+3. flip: the directory points at the target and writes resume there. Workers drop what they cached
+   for the tenant through the invalidation bus.
+4. cleanup: after another `drain_seconds` for reads still running on the source, the tenant's rows
+   are deleted from it.
+
+Anything failing before the flip deletes the copy and leaves the tenant where it was. The tenant is
+held in memory during the move.
+"""
+import time
+
+from sqlalchemy import and_, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from . import invalidation
+from .database import PRIMARY_SHARD, engine as directory_engine, shard_engines
+from .models import (
+    Customer, Discount, DiscountRedemption, Invoice, InvoiceLine, Payment, Plan, Product, Subscription, SubscriptionLine,
+    Tax, TaxRate, TenantShard, User, subscription_line_taxes,
+)
+from .sharding import stub_user
+
+# Parents first: table, the column tying its rows to the tenant (owner_id, or a reference to the parent
+# table named next to it), and every reference to another tenant table
+TENANT_TABLES = [
+    (Product.__table__, "owner_id", None, {}),
+    (Plan.__table__, "owner_id", None, {"product_id": "products"}),
+    (Tax.__table__, "owner_id", None, {}),
+    (TaxRate.__table__, "tax_id", "taxes", {"tax_id": "taxes"}),
+    (Discount.__table__, "owner_id", None, {}),
+    (Customer.__table__, "owner_id", None, {}),
+    (Subscription.__table__, "customer_id", "customers", {"customer_id": "customers", "plan_id": "plans", "discount_id": "discounts"}),
+    (SubscriptionLine.__table__, "subscription_id", "subscriptions", {"subscription_id": "subscriptions", "product_id": "products"}),
+    (subscription_line_taxes, "subscription_line_id", "subscription_lines", {"subscription_line_id": "subscription_lines", "tax_id": "taxes"}),
+    (DiscountRedemption.__table__, "discount_id", "discounts", {"discount_id": "discounts", "subscription_id": "subscriptions"}),
+    (Invoice.__table__, "customer_id", "customers", {"subscription_id": "subscriptions", "customer_id": "customers"}),
+    (InvoiceLine.__table__, "invoice_id", "invoices", {"invoice_id": "invoices"}),
+    (Payment.__table__, "invoice_id", "invoices", {"invoice_id": "invoices"}),
+]
+_SPECS = {table.name: (table, column, parent, references) for table, column, parent, references in TENANT_TABLES}
+
+# Everything the routers version per owner (versions.bump), dropped in every worker after the flip
+TENANT_COLLECTIONS = ("products", "plans", "taxes", "tax_rates", "discounts", "customers", "subscriptions", "invoices", "payments")
+
+
+class MoveError(Exception):
+    pass
+
+
+def tenant_condition(name: str, owner_id: int):
+    """WHERE clause selecting the tenant's rows of a table."""
+    table, column, parent, _ = _SPECS[name]
+    if parent is None:
+        return table.c[column] == owner_id
+    return table.c[column].in_(select(_SPECS[parent][0].c.id).where(tenant_condition(parent, owner_id)))
+
+
+def _chunks(values: list, size: int = 500):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class TenantCopy:
+    """The tenant's rows as last read from the source, which are also the ones on the target."""
+
+    def __init__(self, owner_id: int):
+        self.owner_id = owner_id
+        self.rows = {name: {} for name in _SPECS} # table -> {key: row}
+
+    @staticmethod
+    def _key(table, row: dict):
+        return row["id"] if "id" in table.c else tuple(row[column.name] for column in table.primary_key)
+
+    def read(self, conn) -> dict:
+        rows = {}
+        for name, (table, *_) in _SPECS.items():
+            result = conn.execute(select(table).where(tenant_condition(name, self.owner_id)))
+            rows[name] = {self._key(table, row): row for row in map(dict, result.mappings())}
+        return rows
+
+    def _complete(self, name: str, row: dict) -> bool:
+        """Whether every row the row references is on the target."""
+        return all(row[column] is None or row[column] in self.rows[parent] for column, parent in _SPECS[name][3].items())
+
+    def _insert(self, conn, name: str, rows: dict, strict: bool):
+        """Inserts rows on the target with their ids and records them. Returns the keys inserted."""
+        table = _SPECS[name][0]
+        keys = []
+        for key, row in rows.items():
+            if not self._complete(name, row):
+                if strict:
+                    raise MoveError(f"{name} row {key} references a row outside the tenant")
+                continue # Written while we were copying, the sync picks it up
+            keys.append(key)
+        if not keys:
+            return keys
+        try:
+            conn.execute(insert(table), [rows[key] for key in keys])
+        except IntegrityError as exc:
+            raise MoveError(f"{name} ids of the tenant are already used on the target, are the shards' id ranges set up (run_migration.py)? {exc.orig}") from exc
+        for key in keys:
+            self.rows[name][key] = rows[key]
+        return keys
+
+    def copy(self, source, target):
+        """First pass, while the tenant is live: whatever is consistent gets copied."""
+        fresh = self.read(source)
+        for name in _SPECS:
+            self._insert(target, name, fresh[name], strict=False)
+
+    def sync(self, source, target) -> dict:
+        """Second pass, with the tenant's writes paused: applies every difference. Returns counts per change."""
+        fresh = self.read(source)
+        counts = {"inserted": 0, "updated": 0, "deleted": 0}
+        for name, (table, *_) in _SPECS.items():
+            old, new = dict(self.rows[name]), fresh[name]
+            counts["inserted"] += len(self._insert(target, name, {key: row for key, row in new.items() if key not in old}, strict=True))
+            for key, row in new.items():
+                if key in old and old[key] != row:
+                    target.execute(update(table).where(table.c.id == key).values(row))
+                    counts["updated"] += 1
+        for name, (table, *_) in reversed(list(_SPECS.items())):
+            removed = [key for key in self.rows[name] if key not in fresh[name]]
+            counts["deleted"] += len(removed)
+            self._delete(target, table, removed)
+        self.rows = fresh
+        return counts
+
+    @staticmethod
+    def _delete(conn, table, keys: list):
+        if "id" in table.c:
+            for chunk in _chunks(keys):
+                conn.execute(delete(table).where(table.c.id.in_(chunk)))
+        else:
+            columns = [column.name for column in table.primary_key]
+            for key in keys:
+                conn.execute(delete(table).where(and_(*(table.c[column] == value for column, value in zip(columns, key)))))
+
+    def discard(self, target):
+        """Deletes everything copied to the target."""
+        for name, (table, *_) in reversed(list(_SPECS.items())):
+            self._delete(target, table, list(self.rows[name]))
+
+
+def _tenant_users(source, owner_id: int) -> list:
+    customers = Customer.__table__
+    portal_users = source.execute(select(customers.c.portal_user_id).where(customers.c.owner_id == owner_id, customers.c.portal_user_id.isnot(None))).scalars()
+    return [owner_id, *portal_users]
+
+
+def _add_stubs(directory, target, shard: str, user_ids: list) -> list:
+    """Adds the stub users the target is missing. Returns their ids."""
+    if shard == PRIMARY_SHARD:
+        return []
+    users = User.__table__
+    present = set(target.execute(select(users.c.id).where(users.c.id.in_(user_ids))).scalars())
+    missing = [user for user in directory.execute(select(users).where(users.c.id.in_(user_ids))) if user.id not in present]
+    if missing:
+        target.execute(insert(users), [stub_user(user) for user in missing])
+    return [user.id for user in missing]
+
+
+def _set_directory(owner_id: int, user_ids: list, shard: str, state: str):
+    directory = TenantShard.__table__
+    with directory_engine.begin() as conn:
+        conn.execute(delete(directory).where((directory.c.owner_id == owner_id) | directory.c.user_id.in_(user_ids)))
+        if shard != PRIMARY_SHARD or state != "active":
+            conn.execute(insert(directory), [{"user_id": user_id, "owner_id": owner_id, "shard": shard, "state": state} for user_id in user_ids])
+
+
+def move_tenant(username: str, target_shard: str, drain_seconds: float = 10, log=print) -> dict:
+    """Moves the tenant of business user `username` to `target_shard`. Returns row counts."""
+    if target_shard not in shard_engines:
+        raise MoveError(f"Unknown shard {target_shard!r}, configured: {', '.join(shard_engines)}")
+    with directory_engine.connect() as conn:
+        owner = conn.execute(select(User.__table__).where(User.__table__.c.username == username)).first()
+        if owner is None:
+            raise MoveError(f"No user {username!r}")
+        if owner.mode == "portal":
+            raise MoveError(f"{username!r} is a portal user, move the business user that owns it")
+        entry = conn.execute(select(TenantShard.__table__).where(TenantShard.__table__.c.user_id == owner.id)).first()
+    source_shard = entry.shard if entry else PRIMARY_SHARD
+    if entry is not None and entry.state != "active":
+        raise MoveError(f"{username!r} is already being moved (state {entry.state!r}), fix the directory row first")
+    if source_shard == target_shard:
+        raise MoveError(f"{username!r} is already on {target_shard!r}")
+    source_engine, target_engine = shard_engines[source_shard], shard_engines[target_shard]
+
+    tenant = TenantCopy(owner.id)
+    started = time.monotonic()
+    log(f"Copying {username} (owner {owner.id}) from {source_shard} to {target_shard}...")
+    with source_engine.connect() as source, target_engine.begin() as target, directory_engine.connect() as directory:
+        stubs = _add_stubs(directory, target, target_shard, _tenant_users(source, owner.id))
+        tenant.copy(source, target)
+    log(f"Copied {sum(len(rows) for rows in tenant.rows.values())} rows in {time.monotonic() - started:.1f}s")
+
+    user_ids = None
+    copied = {name: dict(rows) for name, rows in tenant.rows.items()}
+    try:
+        with source_engine.connect() as source:
+            user_ids = _tenant_users(source, owner.id)
+        _set_directory(owner.id, user_ids, source_shard, "moving")
+        log(f"Writes paused, waiting {drain_seconds}s for writes in progress...")
+        time.sleep(drain_seconds)
+        frozen = time.monotonic()
+        with source_engine.connect() as source, target_engine.begin() as target, directory_engine.connect() as directory:
+            user_ids = _tenant_users(source, owner.id)
+            new_stubs = _add_stubs(directory, target, target_shard, user_ids)
+            counts = tenant.sync(source, target)
+        stubs += new_stubs
+        log(f"Synced {counts['inserted']} new, {counts['updated']} changed and {counts['deleted']} deleted rows in {time.monotonic() - frozen:.1f}s")
+        _set_directory(owner.id, user_ids, target_shard, "active")
+    except BaseException:
+        log("Move failed, removing the copy")
+        # The sync's transaction was rolled back, so rows it deleted are still there
+        tenant.rows = {name: {**copied[name], **rows} for name, rows in tenant.rows.items()}
+        with target_engine.begin() as target:
+            tenant.discard(target)
+            target.execute(delete(User.__table__).where(User.__table__.c.id.in_(stubs)))
+        if user_ids is not None:
+            _set_directory(owner.id, user_ids, source_shard, "active")
+        raise
+    log(f"Writes resumed on {target_shard} after {time.monotonic() - frozen:.1f}s")
+    invalidation.broadcast(directory_engine, owner.id, TENANT_COLLECTIONS)
+
+    log(f"Waiting {drain_seconds}s for reads in progress before cleaning up {source_shard}...")
+    time.sleep(drain_seconds)
+    with source_engine.begin() as source:
+        for name, (table, *_) in reversed(list(_SPECS.items())):
+            source.execute(delete(table).where(tenant_condition(name, owner.id)))
+        if source_shard != PRIMARY_SHARD:
+            source.execute(delete(User.__table__).where(User.__table__.c.id.in_(user_ids)))
+    rows = {name: len(rows) for name, rows in tenant.rows.items()}
+    log(f"Moved {sum(rows.values())} rows in {time.monotonic() - started:.1f}s")
+    return rows
@@ -0,0 +1,254 @@
+"""
+End-to-end API benchmark: drives the routers in-process (httpx over ASGI, lifespan included) against
+a locally seeded database, at one or more scale points, and reports throughput and p50/p95/p99 per endpoint.
+
+    python -m benchmarks.bench_api --database-url sqlite:///bench_api.db --scales 1000,100000,1000000
+    python -m benchmarks.bench_api --scales 1000 --compare benchmarks/results/api-<commit>.json
+
+Each scale point is its own tenant (bench_api_<subscriptions>, see app/synthetic_data.py) in the same database, seeded once and
+reused on later runs. Results are written as JSON (default benchmarks/results/api-<commit>.json);
+--compare exits non-zero when an endpoint's p95 regressed by more than --threshold percent.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+SEED = 1234
+
+
+def seed_tenant(engine, subscriptions: int) -> str:
+    """
+    One tenant with about `subscriptions` subscriptions from the synthetic data generator, a customer
+    per 10 subscriptions and three months of invoices. Does nothing if the tenant already exists.
+    """
+    from app.synthetic_data import BulkWriter, generate_tenant
+
+    username = f"bench_api_{subscriptions}"
+    started = time.perf_counter()
+    customers = max(10, subscriptions // 10)
+    with engine.connect() as conn:
+        writer = BulkWriter(conn)
+    if generate_tenant(engine, writer, username, random.Random(SEED + subscriptions), customers=customers,
+                       subscriptions_per_customer=subscriptions / customers, history_months=3, payment_ratio=0.6):
+        with engine.begin() as conn:
+            writer.sync_sequences(conn)
+        print(f"Seeded {username} ({sum(writer.counts.values()):,} rows) in {time.perf_counter() - started:.1f}s", flush=True)
+    return username
+
+
+def sample_ids(db, username: str, size: int = 200) -> dict:
+    from sqlalchemy import func, select
+    from app.models import User, Customer, Product, Subscription, Invoice
+
+    owner_id = db.execute(select(User.id).where(User.username == username)).scalar()
+
+    def sample(query):
+        return db.execute(query.order_by(func.random()).limit(size)).scalars().all()
+
+    return {
+        "customer": sample(select(Customer.id).where(Customer.owner_id == owner_id)),
+        "subscription": sample(select(Subscription.id).join(Customer).where(Customer.owner_id == owner_id)),
+        "invoice": sample(select(Invoice.id).join(Customer).where(Customer.owner_id == owner_id)),
+        "plan": sample(select(Subscription.plan_id).join(Customer).where(Customer.owner_id == owner_id)),
+        "product": sample(select(Product.id).where(Product.owner_id == owner_id)),
+    }
+
+
+def endpoints(ids: dict, run_id: str) -> list:
+    """
+    (name, request factory) pairs, in run order, and the list collecting the ids of created subscriptions.
+    A factory takes the request number and returns (method, url, json body).
+    """
+    rng = random.Random(SEED)
+    pick = lambda kind: rng.choice(ids[kind])
+    created_subscriptions = []
+
+    def create_subscription(n):
+        return "POST", "/subscriptions/", {
+            "subscription_number": f"BENCH-{run_id}-{n}", "customer_id": pick("customer"), "plan_id": pick("plan"),
+            "start_date": date.today().isoformat(),
+            "subscription_lines": [{"product_id": pick("product"), "product_name_snapshot": "Bench", "unit_price_snapshot": 10.0, "quantity": 2, "line_total": 0}],
+        }
+
+    def confirm_subscription(n):
+        # Each confirm needs its own draft, created by the POST /subscriptions/ run before it
+        return "PATCH", f"/subscriptions/{created_subscriptions[n]}/confirm", None
+
+    return [
+        ("GET /auth/users/me", lambda n: ("GET", "/auth/users/me", None)),
+        ("GET /products/", lambda n: ("GET", "/products/", None)),
+        ("GET /plans/", lambda n: ("GET", "/plans/", None)),
+        ("GET /taxes/taxes/", lambda n: ("GET", "/taxes/taxes/", None)),
+        ("GET /discounts/discounts/", lambda n: ("GET", "/discounts/discounts/", None)),
+        ("GET /customers/", lambda n: ("GET", "/customers/", None)),
+        ("GET /customers/{id}", lambda n: ("GET", f"/customers/{pick('customer')}", None)),
+        ("GET /customers/{id}/overview", lambda n: ("GET", f"/customers/{pick('customer')}/overview", None)),
+        ("GET /subscriptions/", lambda n: ("GET", "/subscriptions/", None)),
+        ("GET /subscriptions/{id}", lambda n: ("GET", f"/subscriptions/{pick('subscription')}", None)),
+        ("GET /invoices/", lambda n: ("GET", "/invoices/", None)),
+        ("GET /invoices/{id}", lambda n: ("GET", f"/invoices/{pick('invoice')}", None)),
+        ("GET /payments/payments/", lambda n: ("GET", "/payments/payments/", None)),
+        ("GET /dashboard/stats", lambda n: ("GET", "/dashboard/stats", None)),
+        ("GET /search/", lambda n: ("GET", f"/search/?q=Customer%20{n % 100}", None)),
+        ("GET /reports/ar-aging", lambda n: ("GET", "/reports/ar-aging", None)),
+        ("POST /customers/", lambda n: ("POST", "/customers/", {"name": f"Bench {run_id} {n}", "email": f"bench-{run_id}-{n}@bench.test"})),
+        ("POST /subscriptions/", create_subscription),
+        ("PATCH /subscriptions/{id}/confirm", confirm_subscription),
+    ], created_subscriptions
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Nearest-rank percentile."""
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+async def run_endpoint(client, factory, requests: int, concurrency: int, warmup: int, on_response=None) -> dict:
+    latencies, errors = [], 0
+    counter = iter(range(warmup + requests))
+
+    async def worker():
+        nonlocal errors
+        for n in counter:
+            method, url, body = factory(n)
+            started = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            elapsed = time.perf_counter() - started
+            if response.status_code >= 400:
+                errors += 1
+            elif on_response:
+                on_response(response)
+            if n >= warmup:
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round((warmup + requests) / wall, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+async def bench_scale(app, username: str, ids: dict, args) -> dict:
+    import httpx
+    from app.auth_utils import create_access_token
+
+    token = create_access_token({"sub": username}, expires_delta=timedelta(hours=6))
+    run_id = f"{int(time.time())}{random.randrange(1000)}"
+    items, created_subscriptions = endpoints(ids, run_id)
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers={"Authorization": f"Bearer {token}"}, timeout=None) as client:
+        for name, factory in items:
+            on_response = None
+            if name == "POST /subscriptions/":
+                on_response = lambda response: created_subscriptions.append(response.json()["id"])
+            elif name == "PATCH /subscriptions/{id}/confirm" and len(created_subscriptions) < args.warmup + args.requests:
+                continue
+            results[name] = await run_endpoint(client, factory, args.requests, args.concurrency, args.warmup, on_response)
+            print(f"  {name:<36} {results[name]['throughput_rps']:>8} req/s  p50 {results[name]['p50_ms']:>8} ms  "
+                  f"p95 {results[name]['p95_ms']:>8} ms  p99 {results[name]['p99_ms']:>8} ms  errors {results[name]['errors']}", flush=True)
+    return results
+
+
+def compare(results: dict, baseline_path: str, threshold: float) -> int:
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    regressions = 0
+    print(f"\nCompared with {baseline_path} (p95):")
+    for scale, endpoints_results in results.items():
+        for name, current in endpoints_results.items():
+            before = baseline.get(scale, {}).get(name)
+            if not before:
+                continue
+            change = (current["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+            # Sub-millisecond differences are noise
+            regressed = change > threshold and current["p95_ms"] - before["p95_ms"] > 1.0
+            regressions += regressed
+            print(f"  {'REGRESSED' if regressed else 'ok':<9} {scale:>8} {name:<36} {before['p95_ms']:>8} -> {current['p95_ms']:>8} ms ({change:+.1f}%)")
+    return regressions
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args) -> dict:
+    from app.main import app
+    from app.database import SessionLocal, engine
+    from app import migrations
+
+    migrations.upgrade(engine, log=lambda message: None)
+    results = {}
+    async with app.router.lifespan_context(app):
+        for scale in args.scales:
+            username = seed_tenant(engine, scale)
+            db = SessionLocal()
+            try:
+                ids = sample_ids(db, username)
+            finally:
+                db.close()
+            print(f"Scale {scale} subscriptions ({username}):", flush=True)
+            results[str(scale)] = await bench_scale(app, username, ids, args)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process load and latency benchmark of the API.")
+    parser.add_argument("--database-url", help="database to seed and benchmark (default: DATABASE_URL)")
+    parser.add_argument("--scales", default="1000,100000,1000000", help="comma-separated subscription counts, one tenant each")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--output", help="results JSON (default benchmarks/results/api-<commit>.json)")
+    parser.add_argument("--compare", help="baseline results JSON to compare p95 against")
+    parser.add_argument("--threshold", type=float, default=20.0, help="allowed p95 regression in percent")
+    args = parser.parse_args()
+    args.scales = [int(scale) for scale in args.scales.split(",")]
+
+    # Settings are read on import, so the database has to be chosen before the app is imported
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    # One client hammering the API is exactly what the rate limits are for, measure the endpoints instead
+    os.environ.setdefault("RATE_LIMITS", "")
+    os.environ.setdefault("MAX_IN_FLIGHT_PER_USER", "0")
+
+    results = asyncio.run(run(args))
+
+    from app.database import engine
+    commit = git_commit()
+    output = args.output or os.path.join(RESULTS_DIR, f"api-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "database": engine.dialect.name,
+            "settings": {"requests": args.requests, "warmup": args.warmup, "concurrency": args.concurrency},
+            "results": results,
+        }, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+AR aging report benchmark. Run from backend/ against a scratch database:
+
+    DATABASE_URL=postgresql://.../bench python -m benchmarks.bench_ar_aging --invoices 10000000 --customers 100000
+
+Generates the data once for a dedicated owner (rerunning only tops it up), then times the grouped
+aggregation behind /reports/ar-aging and the full streamed CSV export.
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import func, insert, select, text
+
+from app.database import engine, SessionLocal, create_all_tables
+from app.models import Customer, Invoice, User
+from app.routers.reports import ar_aging_query, stream_ar_aging_csv
+
+BENCH_USERNAME = "bench_ar_aging"
+
+
+def get_owner(db) -> int:
+    owner_id = db.execute(select(User.id).where(User.username == BENCH_USERNAME)).scalar()
+    if owner_id is None:
+        owner_id = db.execute(insert(User).values(username=BENCH_USERNAME, email=f"{BENCH_USERNAME}@bench.test", hashed_password="!", mode="business").returning(User.id)).scalar()
+        db.commit()
+    return owner_id
+
+
+def generate_postgres(db, owner_id: int, customers: int, invoices: int, have_customers: int, have_invoices: int):
+    # Generated server-side, nothing goes over the wire
+    if have_customers < customers:
+        db.execute(text(
+            "INSERT INTO customers (owner_id, name, email) "
+            "SELECT :owner, 'Customer ' || g, 'customer' || g || '@bench.test' FROM generate_series(:start, :stop) g"
+        ), {"owner": owner_id, "start": have_customers + 1, "stop": customers})
+        db.commit()
+    if have_invoices < invoices:
+        # Due dates spread over the last 150 days and the next 30, a third of the invoices paid
+        db.execute(text(
+            "WITH c AS (SELECT array_agg(id ORDER BY id) AS ids FROM customers WHERE owner_id = :owner) "
+            "INSERT INTO invoices (invoice_number, customer_id, issue_date, due_date, status, subtotal, tax_total, discount_total, grand_total) "
+            "SELECT 'BENCH-' || :owner || '-' || g, c.ids[1 + g % cardinality(c.ids)], "
+            "       CURRENT_DATE - (g * 7919 % 180), CURRENT_DATE - (g * 7919 % 180) + 30, "
+            "       CASE WHEN g % 3 = 0 THEN 'paid' ELSE 'pending' END, 0, 0, 0, (g * 37 % 50000) / 100.0 "
+            "FROM c, generate_series(:start, :stop) g"
+        ), {"owner": owner_id, "start": have_invoices + 1, "stop": invoices})
+        db.commit()
+    db.execute(text("ANALYZE customers"))
+    db.execute(text("ANALYZE invoices"))
+    db.commit()
+
+
+def generate_generic(db, owner_id: int, customers: int, invoices: int, have_customers: int, have_invoices: int, batch_size: int = 10000):
+    rng = random.Random(42)
+    for start in range(have_customers + 1, customers + 1, batch_size):
+        db.execute(insert(Customer), [
+            {"owner_id": owner_id, "name": f"Customer {n}", "email": f"customer{n}@bench.test"}
+            for n in range(start, min(start + batch_size, customers + 1))
+        ])
+    db.commit()
+    customer_ids = db.execute(select(Customer.id).where(Customer.owner_id == owner_id)).scalars().all()
+    today = date.today()
+    for start in range(have_invoices + 1, invoices + 1, batch_size):
+        rows = []
+        for n in range(start, min(start + batch_size, invoices + 1)):
+            issued = today - timedelta(days=rng.randrange(180))
+            rows.append({
+                "invoice_number": f"BENCH-{owner_id}-{n}", "customer_id": rng.choice(customer_ids),
+                "issue_date": issued, "due_date": issued + timedelta(days=30),
+                "status": "paid" if n % 3 == 0 else "pending", "grand_total": rng.randrange(50000) / 100.0,
+            })
+        db.execute(insert(Invoice), rows)
+        db.commit()
+
+
+def timed(fn, repeat: int) -> list:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def report(label: str, timings: list):
+    print(f"{label}: min {min(timings):.3f}s  median {statistics.median(timings):.3f}s  max {max(timings):.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the AR aging report.")
+    parser.add_argument("--invoices", type=int, default=10_000_000)
+    parser.add_argument("--customers", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--explain", action="store_true", help="print the Postgres plan of the aggregation")
+    args = parser.parse_args()
+
+    create_all_tables()
+    db = SessionLocal()
+    try:
+        owner_id = get_owner(db)
+        have_customers = db.execute(select(func.count()).select_from(Customer).where(Customer.owner_id == owner_id)).scalar()
+        have_invoices = db.execute(select(func.count()).select_from(Invoice).join(Customer).where(Customer.owner_id == owner_id)).scalar()
+        if have_customers < args.customers or have_invoices < args.invoices:
+            print(f"Generating data ({have_invoices} of {args.invoices} invoices present)...")
+            started = time.perf_counter()
+            generate = generate_postgres if engine.dialect.name == "postgresql" else generate_generic
+            generate(db, owner_id, args.customers, args.invoices, have_customers, have_invoices)
+            print(f"Generated in {time.perf_counter() - started:.1f}s")
+
+        as_of = date.today()
+        if args.explain and engine.dialect.name == "postgresql":
+            compiled = ar_aging_query(owner_id, as_of).compile(engine, compile_kwargs={"literal_binds": True})
+            for line in db.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {compiled}")).scalars():
+                print(line)
+
+        report("aging page (100 customers + totals)", timed(lambda: db.execute(ar_aging_query(owner_id, as_of, with_totals=True).limit(100)).all(), args.repeat))
+    finally:
+        db.close()
+
+    # Consumes the whole export the way the StreamingResponse would
+    report("full CSV export", timed(lambda: sum(len(chunk) for chunk in stream_ar_aging_csv(owner_id, as_of)), args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Serialization cost of the invoice list response, per 1,000 invoices with their lines and payments.
+Builds the ORM objects in memory (no database) and times each way of turning them into JSON bytes:
+
+    default   what FastAPI does with response_model and JSONResponse: validate, dump to Python objects, json.dumps
+    orjson    the same with ORJSONResponse (the app's default response class): orjson.dumps instead of json.dumps
+    adapter   serialization.json_response: cached TypeAdapter, validate and dump_json in pydantic-core
+
+    python -m benchmarks.bench_serialization [--invoices 1000] [--lines 3] [--runs 20] [--output serialization.json]
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import List
+
+import orjson
+
+from app.models import Invoice, InvoiceLine, Payment
+from app.schemas import Invoice as SchemaInvoice
+from app.serialization import type_adapter
+
+
+def build_invoices(count: int, lines: int) -> list:
+    invoices = []
+    for n in range(count):
+        issued = date(2024, 1, 1) + timedelta(days=n % 365)
+        invoice = Invoice(
+            id=n + 1, invoice_number=f"INV-{n:07d}", subscription_id=n + 1, customer_id=n % 100 + 1,
+            issue_date=issued, due_date=issued + timedelta(days=30), status="paid" if n % 3 else "pending",
+            paid_date=issued + timedelta(days=5) if n % 3 else None,
+            subtotal=100.0, tax_total=18.0, discount_total=0.0, grand_total=118.0,
+        )
+        invoice.invoice_lines = [
+            InvoiceLine(id=n * lines + k + 1, invoice_id=n + 1, issue_date=issued, product_name=f"Product {k}",
+                        unit_price=100.0 / lines, quantity=1, tax_percent=18.0, discount_percent=0.0, line_total=118.0 / lines)
+            for k in range(lines)
+        ]
+        invoice.payments = [
+            Payment(id=n + 1, invoice_id=n + 1, amount=118.0, method="credit_card", reference_id=f"PAY-{n}", status="success",
+                    payment_date=datetime.combine(issued, datetime.min.time()) + timedelta(days=5))
+        ] if n % 3 else []
+        invoices.append(invoice)
+    return invoices
+
+
+def fastapi_default(adapter, invoices) -> bytes:
+    # fastapi.routing.serialize_response, then JSONResponse.render
+    content = adapter.dump_python(adapter.validate_python(invoices, from_attributes=True), mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def fastapi_orjson(adapter, invoices) -> bytes:
+    content = adapter.dump_python(adapter.validate_python(invoices, from_attributes=True), mode="json")
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def adapter_json(adapter, invoices) -> bytes:
+    return adapter.dump_json(adapter.validate_python(invoices, from_attributes=True))
+
+
+PATHS = {"default": fastapi_default, "orjson": fastapi_orjson, "adapter": adapter_json}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time JSON serialization of the invoice list response.")
+    parser.add_argument("--invoices", type=int, default=1000)
+    parser.add_argument("--lines", type=int, default=3, help="lines per invoice")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--output", help="write the timings to this JSON file")
+    args = parser.parse_args()
+
+    invoices = build_invoices(args.invoices, args.lines)
+    adapter = type_adapter(List[SchemaInvoice])
+    outputs = {name: path(adapter, invoices) for name, path in PATHS.items()} # Also warms up
+    assert len({json.dumps(json.loads(output), sort_keys=True) for output in outputs.values()}) == 1, "paths disagree"
+
+    summary = {}
+    for name, path in PATHS.items():
+        timings = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            path(adapter, invoices)
+            timings.append((time.perf_counter() - started) * 1000 * 1000 / args.invoices)
+        summary[name] = {"median_ms": statistics.median(timings), "min_ms": min(timings), "bytes": len(outputs[name])}
+    baseline = summary["default"]["median_ms"]
+    for name, result in summary.items():
+        print(f"{name:<8} {result['median_ms']:8.2f} ms per 1,000 invoices (min {result['min_ms']:.2f})   {baseline / result['median_ms']:.2f}x   {result['bytes']:,} bytes")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"invoices": args.invoices, "lines": args.lines, "runs": args.runs, "python": sys.version.split()[0], "timings": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Startup benchmark: import time, lifespan (warm-up) time and time to the first database-backed response, each measured
+in a fresh interpreter like a new worker process. Run from backend/ against a migrated database:
+
+    python -m benchmarks.bench_startup [--runs 10] [--output startup.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Runs in the child process, prints one JSON line of timings in seconds
+PROBE = r"""
+import asyncio, json, time
+import httpx
+started = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+
+async def probe():
+    async with app.router.lifespan_context(app):
+        ready = time.perf_counter()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            # A request that goes through the ORM: unknown user, so 401 after one query
+            response = await client.post("/auth/token", data={"username": "bench-startup-nobody", "password": "x"})
+            assert response.status_code in (400, 401), response.status_code
+            responded = time.perf_counter()
+            response = await client.get("/openapi.json")
+            response.raise_for_status()
+            openapi = time.perf_counter()
+    return ready, responded, openapi
+
+ready, responded, openapi = asyncio.run(probe())
+print(json.dumps({
+    "import": imported - started,
+    "lifespan": ready - imported,
+    "first_response": responded - ready,
+    "openapi": openapi - responded,
+    "total": responded - started,
+}))
+"""
+
+METRICS = ("import", "lifespan", "first_response", "openapi", "total")
+
+
+def run_once() -> dict:
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", PROBE], cwd=backend, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure application startup in fresh processes.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", help="write the median timings to this JSON file")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    summary = {}
+    for metric in METRICS:
+        values = [run[metric] for run in runs]
+        summary[metric] = {"median": statistics.median(values), "min": min(values), "max": max(values)}
+        print(f"{metric:<15} median {summary[metric]['median'] * 1000:8.1f} ms   min {summary[metric]['min'] * 1000:8.1f} ms   max {summary[metric]['max'] * 1000:8.1f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"runs": args.runs, "python": sys.version.split()[0], "timings": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
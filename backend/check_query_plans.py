@@ -0,0 +1,93 @@
+"""
+Query-plan regression check: fails (exit code 1) when a hot query can only be answered with a full table scan.
+
+    python check_query_plans.py [--verbose]
+
+On Postgres sequential scans are disabled for the check, so the planner picks an index whenever one
+can serve the query no matter how little data the database holds; a Seq Scan left in the plan means
+no usable index. On SQLite, EXPLAIN QUERY PLAN is checked for SCAN steps that use no index.
+Run it after `run_migration.py` (e.g. in CI) against a migrated database.
+"""
+import argparse
+import json
+import re
+import sys
+from datetime import date
+
+from sqlalchemy import create_engine, func, select, text
+
+from app.config import settings
+from app.models import Customer, Invoice, InvoiceLine, Payment, Plan, Product, Subscription, SubscriptionLine
+from app.routers.reports import ar_aging_query
+
+OWNER_ID, CUSTOMER_ID, SUBSCRIPTION_ID, INVOICE_ID, PORTAL_USER_ID = 1, 1, 1, 1, 2
+
+HOT_QUERIES = {
+    "customers of an owner": select(Customer).where(Customer.owner_id == OWNER_ID).limit(100),
+    "products of an owner": select(Product).where(Product.owner_id == OWNER_ID),
+    "plans of an owner": select(Plan).where(Plan.owner_id == OWNER_ID),
+    "invoices of an owner": select(Invoice).join(Customer).where(Customer.owner_id == OWNER_ID).limit(100),
+    "invoices of a portal user": select(Invoice).join(Customer).where(Customer.portal_user_id == PORTAL_USER_ID).limit(100),
+    "payments of an owner": select(Payment).join(Invoice).join(Customer).where(Customer.owner_id == OWNER_ID).limit(100),
+    "active subscription count": select(func.count()).select_from(Subscription).join(Customer)
+        .where(Customer.owner_id == OWNER_ID, Subscription.status == "active"),
+    "unpaid invoice count": select(func.count()).select_from(Invoice).join(Customer)
+        .where(Customer.owner_id == OWNER_ID, Invoice.status != "paid"),
+    "subscriptions of a customer": select(Subscription).where(Subscription.customer_id == CUSTOMER_ID),
+    "invoices of a customer": select(Invoice).where(Invoice.customer_id == CUSTOMER_ID),
+    "lines of a subscription": select(SubscriptionLine).where(SubscriptionLine.subscription_id == SUBSCRIPTION_ID),
+    "lines of an invoice": select(InvoiceLine).where(InvoiceLine.invoice_id == INVOICE_ID),
+    "payments of an invoice": select(Payment).where(Payment.invoice_id == INVOICE_ID),
+    "AR aging": ar_aging_query(OWNER_ID, date.today()),
+}
+
+
+def _postgres_seq_scans(plan: dict) -> list:
+    found = [plan["Relation Name"]] if plan.get("Node Type") == "Seq Scan" else []
+    for child in plan.get("Plans", []):
+        found += _postgres_seq_scans(child)
+    return found
+
+
+def check_postgres(conn, sql: str):
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return _postgres_seq_scans(plan[0]["Plan"]), json.dumps(plan[0]["Plan"], indent=2)
+
+
+def check_sqlite(conn, sql: str):
+    steps = [row[3] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+    scans = [match.group(1) for step in steps if (match := re.match(r"SCAN (\w+)", step)) and "INDEX" not in step]
+    return scans, "\n".join(steps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail when a hot query falls back to a full table scan.")
+    parser.add_argument("--verbose", action="store_true", help="print every plan")
+    args = parser.parse_args()
+
+    engine = create_engine(settings.DATABASE_URL)
+    postgres = engine.dialect.name == "postgresql"
+    failures = 0
+    with engine.begin() as conn:
+        if postgres:
+            conn.execute(text("SET LOCAL enable_seqscan = off"))
+        for label, query in HOT_QUERIES.items():
+            sql = str(query.compile(engine, compile_kwargs={"literal_binds": True}))
+            scans, plan = check_postgres(conn, sql) if postgres else check_sqlite(conn, sql)
+            if scans:
+                failures += 1
+                print(f"FAIL  {label}: full scan of {', '.join(sorted(set(scans)))}")
+                print(plan)
+            else:
+                print(f"ok    {label}")
+                if args.verbose:
+                    print(plan)
+
+    if failures:
+        print(f"{failures} hot quer{'y' if failures == 1 else 'ies'} without a usable index")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Generates deterministic synthetic tenants for load testing, straight into a database:
+
+    python generate_data.py --tenants 10 --customers 10000 --subscriptions 2 --history-months 24
+    python generate_data.py --database-url sqlite:///bench.db --tenants 1 --customers 100000
+
+Tenants are named <prefix><seed>_<n> and can log in with --password. Existing tenants are skipped,
+so a run can be extended with more tenants or repeated after an interruption (a partly generated
+tenant has to be deleted first). Nothing else should write to the database while it runs.
+"""
+import argparse
+import random
+import time
+from datetime import date
+
+from sqlalchemy import create_engine
+
+from app import migrations
+from app.auth_utils import get_password_hash
+from app.config import settings
+from app.synthetic_data import BulkWriter, generate_tenant
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate deterministic synthetic tenants with bulk inserts (COPY on Postgres).")
+    parser.add_argument("--database-url", default=settings.DATABASE_URL, help="Postgres or SQLite URL (default: DATABASE_URL)")
+    parser.add_argument("--tenants", type=int, default=1)
+    parser.add_argument("--customers", type=int, default=1000, help="customers per tenant")
+    parser.add_argument("--subscriptions", type=float, default=2.0, help="average subscriptions per customer")
+    parser.add_argument("--history-months", type=int, default=12, help="how far back subscriptions start, one invoice per billing period since")
+    parser.add_argument("--payment-ratio", type=float, default=0.8, help="share of invoices that are paid")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--as-of", type=date.fromisoformat, default=date.today(), help="generate history up to this date (YYYY-MM-DD)")
+    parser.add_argument("--prefix", default="synthetic")
+    parser.add_argument("--password", default="password", help="password of the generated tenant users")
+    parser.add_argument("--batch-size", type=int, default=1000, help="customers per committed batch")
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    migrations.upgrade(engine)
+    hashed_password = get_password_hash(args.password)
+
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        writer = BulkWriter(conn)
+    for n in range(args.tenants):
+        username = f"{args.prefix}{args.seed}_{n}"
+        created = generate_tenant(
+            engine, writer, username, random.Random(f"{args.seed}:{n}"),
+            customers=args.customers, subscriptions_per_customer=args.subscriptions, history_months=args.history_months,
+            payment_ratio=args.payment_ratio, as_of=args.as_of, hashed_password=hashed_password, batch_size=args.batch_size,
+        )
+        print(f"{username}: {'generated' if created else 'already exists, skipped'}", flush=True)
+    with engine.begin() as conn:
+        writer.sync_sequences(conn)
+
+    elapsed = time.perf_counter() - started
+    total = sum(writer.counts.values())
+    for table, count in writer.counts.items():
+        if count:
+            print(f"  {table:<25} {count:>12,}")
+    print(f"{total:,} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import argparse
+import json
+
+from app.database import engine
+from app.invalidation import broadcast
+from app.sharding import session_for
+from app.catalog_import import upsert_catalog, parse_catalog_csv
+from app.schemas import CatalogProductImport
+
+def load_catalog(path):
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            return parse_catalog_csv(f)
+        return [CatalogProductImport(**product) for product in json.load(f)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk upsert products and plans for one owner from a CSV or JSON catalog.")
+    parser.add_argument("path", help="catalog.csv (one row per plan) or catalog.json (products with nested plans)")
+    parser.add_argument("--owner-id", type=int, required=True)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    catalog = load_catalog(args.path)
+    session = session_for(args.owner_id) # On the owner's shard; the invalidations go through the primary database
+    try:
+        result = upsert_catalog(session, args.owner_id, catalog, batch_size=args.batch_size)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    # Running workers evict their cached catalog and ETags of this owner
+    broadcast(engine, args.owner_id, ("products", "plans"))
+
+    print(f"Products: {result.products_created} created, {result.products_updated} updated")
+    print(f"Plans: {result.plans_created} created, {result.plans_updated} updated")
+
+if __name__ == "__main__":
+    main()
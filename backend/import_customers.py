@@ -0,0 +1,32 @@
+import argparse
+
+from app.database import engine
+from app.customer_import import import_customers, iter_customer_rows
+from app.invalidation import broadcast
+from app.sharding import session_for
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import customers for one owner from a CSV or JSON lines file, deduplicated by email.")
+    parser.add_argument("path", help="customers.csv (name,email columns) or customers.jsonl (one object per line)")
+    parser.add_argument("--owner-id", type=int, required=True)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    fmt = "jsonl" if args.path.lower().endswith((".jsonl", ".ndjson")) else "csv"
+    session = session_for(args.owner_id) # On the owner's shard; the invalidations go through the primary database
+    try:
+        # Batches are committed as they go, so a failed run can be repeated
+        with open(args.path, encoding="utf-8-sig", newline="") as f:
+            result = import_customers(session, args.owner_id, iter_customer_rows(f, fmt), batch_size=args.batch_size)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+        # Earlier batches may be committed even if a later one failed; running workers drop their customer ETags
+        broadcast(engine, args.owner_id, ("customers",))
+
+    print(f"Customers: {result.inserted} inserted, {result.updated} updated, {result.skipped} skipped")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+Moves a tenant (a business user with its data and portal users) to another shard, online:
+
+    python move_tenant.py alice eu2
+    python move_tenant.py alice primary --drain-seconds 30
+
+Shards are DATABASE_URL ("primary") and SHARD_DATABASE_URLS, migrated with run_migration.py. The
+tenant's writes are refused with 503 for the drain time plus the final sync; reads go on throughout.
+See app/tenant_move.py for the steps.
+"""
+import argparse
+import sys
+
+from app.database import shard_engines
+from app.tenant_move import MoveError, move_tenant
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move a tenant to another shard while it stays online.")
+    parser.add_argument("username", help="the tenant's business user")
+    parser.add_argument("shard", help=f"target shard ({', '.join(shard_engines)})")
+    parser.add_argument("--drain-seconds", type=float, default=10,
+                        help="wait for requests already under way, longer than the slowest write (see STATEMENT_TIMEOUTS_MS)")
+    args = parser.parse_args()
+
+    try:
+        rows = move_tenant(args.username, args.shard, drain_seconds=args.drain_seconds)
+    except MoveError as exc:
+        sys.exit(str(exc))
+    for table, count in rows.items():
+        if count:
+            print(f"  {table:<25} {count:>12,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+Monthly range partitioning for invoices, invoice_lines and payments (Postgres only).
+
+    python partition_tables.py migrate [--months-ahead 3]
+    python partition_tables.py create-partitions [--months-ahead 3]
+    python partition_tables.py archive --before 2023-01-01 [--tablespace archive_ts]
+    python partition_tables.py attach --month 2022-06
+
+invoices and invoice_lines are partitioned by issue_date (lines carry a copy of their invoice's
+issue_date, so an invoice and its lines always live in matching partitions), payments by payment_date.
+Archived months are detached into the `archive` schema and stay queryable through the
+archive.invoices, archive.invoice_lines and archive.payments views, or can be attached back.
+"""
+import argparse
+from datetime import date
+
+from sqlalchemy import create_engine, text
+
+from app.config import settings
+
+ARCHIVE_SCHEMA = "archive"
+
+# Parents before children: invoice_lines references invoices
+TABLES = [
+    ("invoices", "issue_date"),
+    ("invoice_lines", "issue_date"),
+    ("payments", "payment_date"),
+]
+
+# Recreated on the partitioned parents after the move. Unique constraints must contain the partition key.
+CONSTRAINTS = {
+    "invoices": [
+        "ALTER TABLE invoices ADD PRIMARY KEY (id, issue_date)",
+        "ALTER TABLE invoices ADD CONSTRAINT uq_invoices_number_issue_date UNIQUE (invoice_number, issue_date)",
+        "ALTER TABLE invoices ADD FOREIGN KEY (subscription_id) REFERENCES subscriptions (id)",
+        "ALTER TABLE invoices ADD FOREIGN KEY (customer_id) REFERENCES customers (id)",
+        "CREATE INDEX ix_invoices_id ON invoices (id)",
+        "CREATE INDEX ix_invoices_invoice_number ON invoices (invoice_number)",
+        "CREATE INDEX ix_invoices_customer_id_status ON invoices (customer_id, status)",
+        "CREATE INDEX ix_invoices_subscription_id ON invoices (subscription_id)",
+        "CREATE INDEX ix_invoices_number_trgm ON invoices USING gin (invoice_number gin_trgm_ops)",
+        "CREATE INDEX ix_invoices_unpaid_customer_due ON invoices (customer_id, due_date) INCLUDE (grand_total) WHERE status <> 'paid'",
+    ],
+    "invoice_lines": [
+        "ALTER TABLE invoice_lines ADD PRIMARY KEY (id, issue_date)",
+        "ALTER TABLE invoice_lines ADD FOREIGN KEY (invoice_id, issue_date) REFERENCES invoices (id, issue_date)",
+        "CREATE INDEX ix_invoice_lines_id ON invoice_lines (id)",
+        "CREATE INDEX ix_invoice_lines_invoice_id ON invoice_lines (invoice_id)",
+    ],
+    # A foreign key to invoices would need the invoice's issue_date on every payment,
+    # so payments -> invoices is only enforced by the application once partitioned
+    "payments": [
+        "ALTER TABLE payments ADD PRIMARY KEY (id, payment_date)",
+        "CREATE INDEX ix_payments_id ON payments (id)",
+        "CREATE INDEX ix_payments_invoice_id ON payments (invoice_id)",
+    ],
+}
+
+# Partition keys must be NOT NULL to be part of the primary key
+BACKFILL = [
+    "ALTER TABLE invoice_lines ADD COLUMN IF NOT EXISTS issue_date DATE",
+    # Invoices are due 30 days after issue
+    "UPDATE invoices SET issue_date = COALESCE(due_date - 30, CURRENT_DATE) WHERE issue_date IS NULL",
+    "UPDATE invoice_lines l SET issue_date = i.issue_date FROM invoices i WHERE l.invoice_id = i.id AND l.issue_date IS DISTINCT FROM i.issue_date",
+    "UPDATE invoice_lines SET issue_date = CURRENT_DATE WHERE issue_date IS NULL",
+    "UPDATE payments SET payment_date = now() WHERE payment_date IS NULL",
+]
+
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def parse_month(value: str) -> date:
+    year, month = value.split("-")[:2]
+    return date(int(year), int(month), 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month.year}_{month.month:02d}"
+
+
+def month_of(partition: str) -> date:
+    """Inverse of partition_name."""
+    year, month = partition.rsplit("_p", 1)[1].split("_")
+    return date(int(year), int(month), 1)
+
+
+def is_partitioned(conn, table: str) -> bool:
+    return conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}).scalar() == "p"
+
+
+def partitions(conn, table: str) -> list:
+    """Monthly partitions currently attached to `table`, oldest first (the default partition is left out)."""
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table) AND c.relname LIKE :pattern"
+    ), {"table": table, "pattern": f"{table}\\_p%"}).scalars().all()
+    return sorted(rows)
+
+
+def create_partition(conn, table: str, month: date) -> bool:
+    name = partition_name(table, month)
+    if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar():
+        return False
+    conn.execute(text(
+        f"CREATE TABLE {name} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    ))
+    return True
+
+
+def ensure_partitions(conn, first_month: date, months_ahead: int) -> int:
+    """
+    Creates missing monthly partitions from first_month up to months_ahead past the current month.
+    Run it ahead of time (e.g. monthly from cron): rows for a month without a partition land in the
+    default partition, and Postgres refuses to create that month's partition until they are moved out.
+    """
+    last_month = add_months(month_start(date.today()), months_ahead)
+    created = 0
+    for table, _ in TABLES:
+        month = first_month
+        while month <= last_month:
+            created += create_partition(conn, table, month)
+            month = add_months(month, 1)
+    return created
+
+
+def migrate(engine, months_ahead: int):
+    """Moves the existing heap tables into partitioned tables, in a single transaction."""
+    with engine.begin() as conn:
+        if all(is_partitioned(conn, table) for table, _ in TABLES):
+            print("Tables are already partitioned.")
+            return
+
+        for statement in BACKFILL:
+            conn.execute(text(statement))
+
+        oldest = conn.execute(text(
+            "SELECT LEAST((SELECT min(issue_date) FROM invoices), (SELECT min(payment_date)::date FROM payments))"
+        )).scalar() or date.today()
+
+        sequences = {}
+        for table, key in TABLES:
+            print(f"Partitioning {table} by {key}...")
+            old = f"{table}_unpartitioned"
+            conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+            # The id sequence would go away with the old table
+            sequences[table] = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": old}).scalar()
+            if sequences[table]:
+                conn.execute(text(f"ALTER SEQUENCE {sequences[table]} OWNED BY NONE"))
+            conn.execute(text(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE ({key})"))
+            conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {key} SET NOT NULL"))
+            conn.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+
+        ensure_partitions(conn, month_start(oldest), months_ahead)
+
+        for table, _ in TABLES:
+            moved = conn.execute(text(f"INSERT INTO {table} SELECT * FROM {table}_unpartitioned")).rowcount
+            print(f"Moved {moved} rows into {table}.")
+
+        for table, _ in reversed(TABLES):
+            conn.execute(text(f"DROP TABLE {table}_unpartitioned"))
+
+        for table, _ in TABLES:
+            if sequences[table]:
+                conn.execute(text(f"ALTER SEQUENCE {sequences[table]} OWNED BY {table}.id"))
+            for statement in CONSTRAINTS[table]:
+                conn.execute(text(statement))
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for table, _ in TABLES:
+            conn.execute(text(f"ANALYZE {table}"))
+    print("Partitioning complete.")
+
+
+def refresh_archive_views(conn):
+    """One view per table over all its archived months, so archived data can still be queried."""
+    for table, _ in TABLES:
+        names = conn.execute(text(
+            "SELECT tablename FROM pg_tables WHERE schemaname = :schema AND tablename LIKE :pattern ORDER BY tablename"
+        ), {"schema": ARCHIVE_SCHEMA, "pattern": f"{table}\\_p%"}).scalars().all()
+        conn.execute(text(f"DROP VIEW IF EXISTS {ARCHIVE_SCHEMA}.{table}"))
+        if names:
+            union = " UNION ALL ".join(f"SELECT * FROM {ARCHIVE_SCHEMA}.{name}" for name in names)
+            conn.execute(text(f"CREATE VIEW {ARCHIVE_SCHEMA}.{table} AS {union}"))
+
+
+def archive(engine, before: date, tablespace: str = None):
+    """Detaches every monthly partition that ends on or before `before` into the archive schema."""
+    before = month_start(before)
+    archived = []
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+        # Children first, an invoices partition cannot be detached while attached lines reference it
+        for table, _ in reversed(TABLES):
+            for name in partitions(conn, table):
+                if month_of(name) >= before:
+                    continue
+                conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+                # The detached copy keeps the parent's foreign keys, which would pin the live invoices
+                for constraint in conn.execute(text(
+                    "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:name) AND contype = 'f'"
+                ), {"name": name}).scalars().all():
+                    conn.execute(text(f'ALTER TABLE {name} DROP CONSTRAINT "{constraint}"'))
+                conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+                archived.append(name)
+        refresh_archive_views(conn)
+
+    if not archived:
+        print("Nothing to archive.")
+        return
+
+    # Compaction rewrites the tables, which cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        lz4 = int(conn.execute(text("SHOW server_version_num")).scalar()) >= 140000
+        for name in archived:
+            qualified = f"{ARCHIVE_SCHEMA}.{name}"
+            # Archived months are read-only, pack the pages full and compress wide values
+            conn.execute(text(f"ALTER TABLE {qualified} SET (fillfactor = 100, autovacuum_enabled = false)"))
+            if lz4:
+                for column in conn.execute(text(
+                    "SELECT column_name FROM information_schema.columns "
+                    "WHERE table_schema = :schema AND table_name = :name AND data_type IN ('character varying', 'text')"
+                ), {"schema": ARCHIVE_SCHEMA, "name": name}).scalars().all():
+                    conn.execute(text(f'ALTER TABLE {qualified} ALTER COLUMN "{column}" SET COMPRESSION lz4'))
+            if tablespace:
+                # e.g. a tablespace on a compressed filesystem or cheaper storage
+                conn.execute(text(f"ALTER TABLE {qualified} SET TABLESPACE {tablespace}"))
+            conn.execute(text(f"VACUUM FULL {qualified}"))
+            conn.execute(text(f"ANALYZE {qualified}"))
+            print(f"Archived {name}")
+
+
+def attach(engine, month: date):
+    """Moves one archived month back into the live tables."""
+    with engine.begin() as conn:
+        for table, _ in TABLES:
+            name = partition_name(table, month)
+            if not conn.execute(text("SELECT to_regclass(:name)"), {"name": f"{ARCHIVE_SCHEMA}.{name}"}).scalar():
+                print(f"{ARCHIVE_SCHEMA}.{name} not found, skipping")
+                continue
+            conn.execute(text(f"DROP VIEW IF EXISTS {ARCHIVE_SCHEMA}.{table}"))
+            conn.execute(text(f"ALTER TABLE {ARCHIVE_SCHEMA}.{name} SET SCHEMA public"))
+            conn.execute(text(f"ALTER TABLE {name} RESET (fillfactor, autovacuum_enabled)"))
+            # Attaching validates the range and clones the parent's keys and indexes
+            conn.execute(text(
+                f"ALTER TABLE {table} ATTACH PARTITION {name} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            ))
+            print(f"Attached {name}")
+        refresh_archive_views(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Partition and archive invoices, invoice_lines and payments by month (Postgres).")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_cmd = commands.add_parser("migrate", help="convert the existing tables to partitioned tables and move their rows")
+    migrate_cmd.add_argument("--months-ahead", type=int, default=3)
+
+    create_cmd = commands.add_parser("create-partitions", help="create the partitions for the coming months")
+    create_cmd.add_argument("--months-ahead", type=int, default=3)
+
+    archive_cmd = commands.add_parser("archive", help="detach months before a date into the archive schema")
+    archive_cmd.add_argument("--before", type=date.fromisoformat, required=True, help="first month to keep live, YYYY-MM-DD")
+    archive_cmd.add_argument("--tablespace", help="move archived partitions to this tablespace")
+
+    attach_cmd = commands.add_parser("attach", help="move an archived month back into the live tables")
+    attach_cmd.add_argument("--month", type=parse_month, required=True, help="YYYY-MM")
+
+    args = parser.parse_args()
+    engine = create_engine(settings.DATABASE_URL)
+    if engine.dialect.name != "postgresql":
+        parser.error("partitioning needs Postgres")
+
+    if args.command == "migrate":
+        migrate(engine, args.months_ahead)
+    elif args.command == "create-partitions":
+        with engine.begin() as conn:
+            created = ensure_partitions(conn, month_start(date.today()), args.months_ahead)
+        print(f"Created {created} partitions.")
+    elif args.command == "archive":
+        archive(engine, args.before, args.tablespace)
+    elif args.command == "attach":
+        attach(engine, args.month)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, joinedload
 from app.database import Base
 from app.models import Product, Plan, Customer, Subscription, SubscriptionLine, Invoice, InvoiceLine, Payment, User
 from app.config import settings
+from app.catalog_import import upsert_catalog
+from app.schemas import CatalogProductImport
 from datetime import date, timedelta, datetime
 import random
 
@@ -31,42 +33,22 @@ def seed():
             {"name": "Premium Tier Support", "base_price": 150.0, "type": "Service", "description": "Dedicated support engineer with 1hr SLA."}
         ]
 
-        db_products = []
-        for p in products_data:
-            # Check if product already exists for this owner to avoid duplicates if re-run
-            existing_p = session.query(Product).filter(Product.name == p['name'], Product.owner_id == owner_id).first()
-            if existing_p:
-                db_products.append(existing_p)
-                continue
-            db_p = Product(**p, owner_id=owner_id)
-            session.add(db_p)
-            db_products.append(db_p)
-        
-        session.flush() # Ensure products have IDs
-
         # 2. Plans
         billing_periods = ["monthly", "quarterly", "yearly"]
         multipliers = {"monthly": 1, "quarterly": 2.8, "yearly": 10}
-        
-        db_plans = []
-        for product in db_products:
-            for period in billing_periods:
-                existing_plan = session.query(Plan).filter(Plan.product_id == product.id, Plan.billing_period == period, Plan.owner_id == owner_id).first()
-                if existing_plan:
-                    db_plans.append(existing_plan)
-                    continue
-                price = round(product.base_price * multipliers[period], 2)
-                db_plan = Plan(
-                    product_id=product.id,
-                    name=f"{period.capitalize()} Plan",
-                    billing_period=period,
-                    price=price,
-                    owner_id=owner_id
-                )
-                session.add(db_plan)
-                db_plans.append(db_plan)
-        
-        session.flush()
+
+        # Upsert products and plans together, existing rows are matched with one lookup per table so re-runs don't duplicate
+        catalog = [
+            CatalogProductImport(**p, plans=[
+                {"name": f"{period.capitalize()} Plan", "billing_period": period, "price": round(p["base_price"] * multipliers[period], 2)}
+                for period in billing_periods
+            ])
+            for p in products_data
+        ]
+        upsert_catalog(session, owner_id, catalog)
+
+        db_plans = session.query(Plan).join(Product).options(joinedload(Plan.product))\
+            .filter(Plan.owner_id == owner_id, Product.name.in_([p["name"] for p in products_data])).all()
 
         # 3. Customers
         customers_data = [
@@ -75,9 +57,13 @@ def seed():
             {"name": f"Soylent Corp ({owner.username})", "email": f"accounts@{owner.username}.soylent.net"}
         ]
 
+        existing_customers = {
+            c.name: c for c in session.query(Customer).filter(Customer.owner_id == owner_id, Customer.name.in_([c["name"] for c in customers_data]))
+        }
+
         db_customers = []
         for c in customers_data:
-            existing_c = session.query(Customer).filter(Customer.name == c['name'], Customer.owner_id == owner_id).first()
+            existing_c = existing_customers.get(c['name'])
             if existing_c:
                 db_customers.append(existing_c)
                 continue
@@ -87,11 +73,14 @@ def seed():
         
         session.flush()
 
+        customers_with_subs = {
+            row.customer_id for row in session.query(Subscription.customer_id).filter(Subscription.customer_id.in_([c.id for c in db_customers])).distinct()
+        }
+
         # 4. Subscriptions & Invoices
         for customer in db_customers:
             # Only seed if no subscriptions exist for this customer
-            existing_sub = session.query(Subscription).filter(Subscription.customer_id == customer.id).first()
-            if existing_sub:
+            if customer.id in customers_with_subs:
                 continue
 
             num_subs = random.randint(1, 2)
@@ -151,6 +140,7 @@ def seed():
 
                     inv_line = InvoiceLine(
                         invoice_id=db_invoice.id,
+                        issue_date=db_invoice.issue_date,
                         product_name=plan.product.name,
                         unit_price=plan.price,
                         quantity=1,
@@ -0,0 +1,34 @@
+from datetime import date
+from types import SimpleNamespace
+
+from app.tax_rates import TaxRateTable
+
+ON = date(2024, 1, 1)
+
+
+def _table(*taxes):
+    return TaxRateTable({tax.id: tax for tax in taxes}, [])
+
+
+def _tax(tax_id, percent, is_compound=False):
+    return SimpleNamespace(id=tax_id, name=f"Tax {tax_id}", percent=percent, is_active=True, is_compound=is_compound)
+
+
+def test_simple_taxes_add_up_exactly():
+    assert _table(_tax(1, 10)).effective_percent([1], ON) == 10
+    assert _table(_tax(1, 10.1), _tax(2, 5.2)).effective_percent([1, 2], ON) == 15.3
+
+
+def test_compound_tax_alone():
+    assert _table(_tax(1, 10, is_compound=True)).effective_percent([1], ON) == 10
+
+
+def test_compound_tax_applies_to_the_simple_taxes_too():
+    table = _table(_tax(1, 10), _tax(2, 5, is_compound=True))
+    # 10% of the amount, then 5% of the amount plus that 10%
+    assert table.effective_percent([1, 2], ON) == 15.5
+
+
+def test_compound_taxes_apply_in_id_order():
+    table = _table(_tax(1, 10, is_compound=True), _tax(2, 10, is_compound=True))
+    assert table.effective_percent([2, 1], ON) == 21